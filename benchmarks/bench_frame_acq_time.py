@@ -0,0 +1,39 @@
+"""Benchmark of configure_frame_acq_time on the xpdsim detector
+
+Alternates the frame acquisition time of the simulated detector between
+two values and reports the latency of each change, to be compared with
+the two seconds of fixed sleeps of the previous implementation.
+
+usage: python benchmarks/bench_frame_acq_time.py [n_changes]
+"""
+import sys
+import time
+
+from xpdsim import simple_pe1c, shctl1, cs700, db
+
+from xpdacq.xpdacq_conf import configure_device, configure_frame_acq_time
+
+DEFAULT_CHANGES = 20
+FIXED_SLEEPS = 2.0
+
+
+def main(n_changes):
+    configure_device(
+        area_det=simple_pe1c, shutter=shctl1, temp_controller=cs700, db=db
+    )
+    latencies = []
+    for i in range(n_changes):
+        t0 = time.time()
+        configure_frame_acq_time(0.1 if i % 2 else 0.2)
+        latencies.append(time.time() - t0)
+    latencies.sort()
+    print("{} changes of frame acquisition time".format(n_changes))
+    print(
+        "median latency {:.4f} s, max {:.4f} s (previously >= {} s)".format(
+            latencies[len(latencies) // 2], latencies[-1], FIXED_SLEEPS
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_CHANGES)
@@ -0,0 +1,86 @@
+"""Benchmark of ``ExceltoYaml.create_yaml`` against spreadsheet size
+
+Compares the per-sample import with the ``bulk=True`` import on synthetic
+spreadsheets. The benchmark creates a throw-away xpdUser tree under
+``glbl['base']`` and refuses to run if one already exists.
+
+usage: python benchmarks/bench_import_sample_info.py [n_rows ...]
+"""
+import os
+import sys
+import time
+import shutil
+
+import pandas as pd
+
+from xpdacq.glbl import glbl
+from xpdacq.beamtime import Beamtime
+from xpdacq.utils import ExceltoYaml
+from xpdacq.yamldict import flush_engine
+
+DEFAULT_SIZES = [10, 100, 500, 1000]
+
+
+def synthetic_sheet(n_rows):
+    """spreadsheet-like DataFrame with n_rows samples"""
+    return pd.DataFrame(
+        {
+            "Sample Name [required]": [
+                "sample_{}".format(i) for i in range(n_rows)
+            ],
+            "Phase Info [required]": ["TiO2:1, C:2"] * n_rows,
+            "Sample-name of sample background": ["kapton"] * n_rows,
+            "Collaborators": ["Simon Billinge, Timothy Liu"] * n_rows,
+            "User supplied tags": ["powder, high-throughput"] * n_rows,
+        }
+    )
+
+
+def time_import(n_rows, bulk):
+    for d in glbl["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    try:
+        bt = Beamtime("Billinge", 300000, [], wavelength=0.1812)
+        excel_to_yaml = ExceltoYaml(glbl["import_dir"])
+        excel_to_yaml.pd_df = synthetic_sheet(n_rows)
+        excel_to_yaml.parse_sample_md()
+        n_writes = flush_engine.write_count
+        t0 = time.time()
+        excel_to_yaml.create_yaml(bt, bulk=bulk)
+        return time.time() - t0, flush_engine.write_count - n_writes
+    finally:
+        shutil.rmtree(glbl["home"])
+
+
+def main(sizes):
+    if os.path.exists(glbl["home"]):
+        sys.exit("{} exists, refusing to run".format(glbl["home"]))
+    rows = []
+    for n_rows in sizes:
+        plain_time, plain_writes = time_import(n_rows, bulk=False)
+        bulk_time, bulk_writes = time_import(n_rows, bulk=True)
+        rows.append(
+            (n_rows, plain_time, plain_writes, bulk_time, bulk_writes)
+        )
+    print()
+    print(
+        "{:>8} {:>12} {:>12} {:>12} {:>12} {:>8}".format(
+            "rows", "plain [s]", "plain writes", "bulk [s]", "bulk writes",
+            "speedup",
+        )
+    )
+    for n_rows, plain_time, plain_writes, bulk_time, bulk_writes in rows:
+        print(
+            "{:>8} {:>12.3f} {:>12} {:>12.3f} {:>12} {:>8.1f}".format(
+                n_rows,
+                plain_time,
+                plain_writes,
+                bulk_time,
+                bulk_writes,
+                plain_time / bulk_time,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main([int(el) for el in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,91 @@
+"""Benchmark of the open_run metadata injectors on a tseries-like plan
+
+Drives the messages of a ``tseries`` with ``num`` points (checkpoint,
+trigger, wait, create, read, save and sleep per point) through the
+injectors without a RunEngine, once as one ``msg_mutator`` layer per
+injector as xrun used to do and once through the single
+``OpenRunInjectors`` layer, and reports the overhead per message.
+
+usage: python benchmarks/bench_open_run_injectors.py [num]
+"""
+import sys
+import time
+
+import bluesky.preprocessors as bpp
+from bluesky.utils import Msg
+
+from xpdacq.xpdacq import OpenRunInjectors
+
+DEFAULT_NUM = 10000
+N_INJECTORS = 5
+
+
+def tseries_msgs(num):
+    yield Msg("open_run", plan_name="tseries")
+    for _ in range(num):
+        yield Msg("checkpoint")
+        yield Msg("trigger", "pe1c", group="trigger")
+        yield Msg("wait", None, group="trigger")
+        yield Msg("create", name="primary")
+        yield Msg("read", "pe1c")
+        yield Msg("save")
+        yield Msg("sleep", None, 0.1)
+    yield Msg("close_run")
+
+
+def make_injector(i):
+    def inject(msg):
+        if msg.command == "open_run":
+            msg.kwargs["injected_{}".format(i)] = True
+        return msg
+
+    inject.__name__ = "inject_{}".format(i)
+    return inject
+
+
+def drain(plan):
+    t0 = time.time()
+    n = 0
+    for _ in plan:
+        n += 1
+    return time.time() - t0, n
+
+
+def stacked(plan, injectors):
+    for inject in injectors:
+        plan = bpp.msg_mutator(plan, inject)
+    return plan
+
+
+def fused(plan, injectors):
+    registry = OpenRunInjectors()
+    for order, inject in enumerate(injectors):
+        registry.register(inject, order=order)
+    return bpp.msg_mutator(plan, registry.mutator())
+
+
+def main(num):
+    injectors = [make_injector(i) for i in range(N_INJECTORS)]
+    bare, n_msgs = drain(tseries_msgs(num))
+    print(
+        "{} points, {} messages, {} injectors".format(
+            num, n_msgs, N_INJECTORS
+        )
+    )
+    print(
+        "{:>10} {:>12} {:>22}".format(
+            "layers", "time [s]", "overhead per msg [us]"
+        )
+    )
+    print("{:>10} {:>12.4f} {:>22}".format("none", bare, "-"))
+    for label, wrap in [("stacked", stacked), ("fused", fused)]:
+        t, _ = drain(wrap(tseries_msgs(num), injectors))
+        print(
+            "{:>10} {:>12.4f} {:>22.3f}".format(
+                label, t, (t - bare) / n_msgs * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_NUM)
@@ -0,0 +1,66 @@
+"""Benchmark of ``ExceltoYaml.parse_sample_md`` against spreadsheet size
+
+Synthetic sheets mimic plate work: a few distinct phase, collaborator and
+tag strings repeated over many wells.
+
+usage: python benchmarks/bench_parse_sample_md.py [n_rows ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from xpdacq.utils import ExceltoYaml
+
+DEFAULT_SIZES = [96, 1000, 10000]
+
+
+def synthetic_sheet(n_rows, seed=0):
+    """spreadsheet-like DataFrame with n_rows samples"""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "Sample Name [required]": [
+                "well_{}".format(i) for i in range(n_rows)
+            ],
+            "Phase Info [required]": rng.choice(
+                ["TiO2:1, C:2", "NaCl", "Ni:50%, Si:50%", "La0.5Ca0.5MnO3"],
+                n_rows,
+            ),
+            "Sample-name of sample background": ["kapton"] * n_rows,
+            "Collaborators": rng.choice(
+                ["Simon Billinge, Timothy Liu", "van der Banerjee", np.nan],
+                n_rows,
+            ),
+            "User supplied tags": rng.choice(
+                ["powder, plate", "film", np.nan], n_rows
+            ),
+            "structural database ID for phases": rng.choice(
+                ["TiO2: 9852, C", np.nan], n_rows
+            ),
+            "Notes": rng.choice(["dried", "as made", np.nan], n_rows),
+        }
+    )
+
+
+def time_parse(n_rows, repeat=3):
+    excel_to_yaml = ExceltoYaml(".")
+    excel_to_yaml.pd_df = synthetic_sheet(n_rows)
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.time()
+        excel_to_yaml.parse_sample_md()
+        best = min(best, time.time() - t0)
+    return best
+
+
+def main(sizes):
+    print("{:>8} {:>12} {:>14}".format("rows", "parse [s]", "rows per s"))
+    for n_rows in sizes:
+        t = time_parse(n_rows)
+        print("{:>8} {:>12.4f} {:>14.0f}".format(n_rows, t, n_rows / t))
+
+
+if __name__ == "__main__":
+    main([int(el) for el in sys.argv[1:]] or DEFAULT_SIZES)
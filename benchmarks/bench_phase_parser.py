@@ -0,0 +1,53 @@
+"""Benchmark of the memoized phase parser on a synthetic sheet
+
+Parses the phase column of a synthetic sheet with the uncached parser,
+with a cold cache and with a warm cache, then reports the cache
+statistics.
+
+usage: python benchmarks/bench_phase_parser.py [n_rows]
+"""
+import sys
+import time
+
+from xpdacq.utils import (
+    ExceltoYaml,
+    _cached_phase_parser,
+    _normalize_phase_str,
+    clear_phase_parser_cache,
+    phase_parser_cache_info,
+)
+from bench_parse_sample_md import synthetic_sheet
+
+DEFAULT_ROWS = 10000
+
+
+def time_phases(phase_strs, parser):
+    t0 = time.time()
+    for phase_str in phase_strs:
+        parser(phase_str)
+    return time.time() - t0
+
+
+def uncached_parser(phase_str):
+    return _cached_phase_parser.__wrapped__(_normalize_phase_str(phase_str))
+
+
+def main(n_rows):
+    phase_strs = list(synthetic_sheet(n_rows)["Phase Info [required]"])
+    print(
+        "{} rows, {} distinct phase strings".format(
+            n_rows, len(set(phase_strs))
+        )
+    )
+    uncached = time_phases(phase_strs, uncached_parser)
+    clear_phase_parser_cache()
+    cold = time_phases(phase_strs, ExceltoYaml.phase_parser)
+    warm = time_phases(phase_strs, ExceltoYaml.phase_parser)
+    print("{:>10} {:>12} {:>14}".format("parser", "time [s]", "rows per s"))
+    for label, t in [("uncached", uncached), ("cold", cold), ("warm", warm)]:
+        print("{:>10} {:>12.4f} {:>14.0f}".format(label, t, n_rows / t))
+    print(phase_parser_cache_info())
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_ROWS)
@@ -0,0 +1,92 @@
+"""Benchmark of yaml loading and dumping on a beamtime directory
+
+Writes a Beamtime with synthetic Samples, then reads and dumps every
+yaml file with ``yaml.unsafe_load``/``yaml.dump`` (pure-Python loader
+and dumper, as in earlier versions) and with ``xpdacq.serialization``.
+The benchmark creates a throw-away xpdUser tree under ``glbl['base']``
+and refuses to run if one already exists.
+
+usage: python benchmarks/bench_yaml_io.py [n_samples]
+"""
+import os
+import sys
+import time
+import shutil
+
+import yaml
+
+from xpdacq.glbl import glbl
+from xpdacq.beamtime import Beamtime, Sample
+from xpdacq.serialization import yaml_load, yaml_dump
+
+DEFAULT_SAMPLES = 1000
+
+
+def make_beamtime(n_samples):
+    bt = Beamtime(
+        "Billinge",
+        300000,
+        [("Simon", "Billinge", 1), ("Max", "Terban", 2)],
+        wavelength=0.1812,
+    )
+    with bt.deferred_flush():
+        for i in range(n_samples):
+            Sample(
+                bt,
+                {
+                    "sample_name": "sample_{}".format(i),
+                    "sample_composition": {"Ti": 0.33, "O": 0.67},
+                    "sample_phase": {"TiO2": 1.0},
+                    "composition_string": "O0.67Ti0.33",
+                    "collaborators": ["Simon", "Billinge"],
+                    "tags": ["powder", "capillary"],
+                    "bkgd_sample_name": "kapton",
+                },
+            )
+    return bt
+
+
+def yaml_files():
+    for root, _, fns in os.walk(glbl["yaml_dir"]):
+        for fn in fns:
+            if fn.endswith(".yml"):
+                with open(os.path.join(root, fn)) as f:
+                    yield f.read()
+
+
+def time_io(texts, load, dump):
+    t0 = time.time()
+    data = [load(text) for text in texts]
+    t1 = time.time()
+    for d in data:
+        dump(d, default_flow_style=False)
+    return t1 - t0, time.time() - t1
+
+
+def main(n_samples):
+    if os.path.exists(glbl["home"]):
+        sys.exit("{} exists, refusing to run".format(glbl["home"]))
+    for d in glbl["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    try:
+        make_beamtime(n_samples)
+        texts = list(yaml_files())
+    finally:
+        shutil.rmtree(glbl["home"])
+    rows = [
+        ("unsafe", time_io(texts, yaml.unsafe_load, yaml.dump)),
+        ("xpdacq", time_io(texts, yaml_load, yaml_dump)),
+    ]
+    print()
+    print(
+        "{} yaml files, libyaml: {}".format(
+            len(texts), yaml.__with_libyaml__
+        )
+    )
+    print("{:>8} {:>10} {:>10}".format("", "load [s]", "dump [s]"))
+    for label, (load_time, dump_time) in rows:
+        print("{:>8} {:>10.3f} {:>10.3f}".format(label, load_time, dump_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_SAMPLES)
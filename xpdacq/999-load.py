@@ -63,8 +63,8 @@ xrun.md["facility"] = glbl["facility"]
 beamline_config = _load_beamline_config(glbl["blconfig_path"])
 xrun.md["beamline_config"] = beamline_config
 
-# insert header to db, either simulated or real
-xrun.subscribe(db.insert, "all")
+# insert header to db, either simulated or real, from a background thread
+xrun.install_document_sink(db.insert)
 
 if bt:
     xrun.beamtime = bt
@@ -14,29 +14,45 @@
 #
 ##############################################################################
 import os
+import time
 import uuid
-import yaml
+import weakref
+import threading
 import inspect
+import functools
 import itertools
 from collections import ChainMap, OrderedDict
+from collections.abc import ItemsView, ValuesView
 
 import numpy as np
 import bluesky.plans as bp
 import bluesky.plan_stubs as bps
 import bluesky.preprocessors as bpp
+from bluesky.utils import short_uid
 from bluesky.callbacks import LiveTable
+from ophyd.status import Status, wait as status_wait
 
 from .glbl import glbl
-from .xpdacq_conf import xpd_configuration
+from .xpdacq_conf import xpd_configuration, area_det_config
 from xpdconf.conf import XPD_SHUTTER_CONF
-from .yamldict import YamlDict, YamlChainMap
+from .yamldict import YamlDict, YamlChainMap, flush_engine
+from .serialization import yaml_load, yaml_dump
 from .validated_dict import ValidatedDictLike
 from .tools import regularize_dict_key
+from .shutter_latency import shutter_settle_time
+from .run_timing import CadenceController, TIMING_LOG_FNAME
+from .settle import make_settle_monitor, settle_stub, settle_step
+from .table_writer import SampleTableWriter
+from .callback_workers import LiveTableFeed
 
 # This is used to map plan names (strings in the YAML file) to actual
 # plan functions in Python.
 _PLAN_REGISTRY = {}
 
+# Live Beamtime objects by bt_uid. Sample and ScanPlan yaml files only store
+# the bt_uid of their Beamtime and are re-linked through this mapping.
+_BEAMTIME_REGISTRY = weakref.WeakValueDictionary()
+
 
 def register_plan(plan_name, plan_func, overwrite=False):
     """
@@ -85,13 +101,18 @@ def _configure_area_det(exposure):
     det = xpd_configuration["area_det"]
     # cs studio configuration doesn't propagate to python level
 
-    yield from bps.abs_set(det.cam.acquire_time, glbl["frame_acq_time"])
-    acq_time = det.cam.acquire_time.get()
+    # only put what changed since the last configuration
+    if area_det_config.changed("acquire_time", glbl["frame_acq_time"]):
+        yield from bps.abs_set(det.cam.acquire_time, glbl["frame_acq_time"])
+        area_det_config.forget("acquire_time")
+    acq_time = area_det_config.get("acquire_time")
     _check_mini_expo(exposure, acq_time)
     if hasattr(det, "images_per_set"):
         # compute number of frames
         num_frame = np.ceil(exposure / acq_time)
-        yield from bps.abs_set(det.images_per_set, num_frame)
+        if area_det_config.changed("images_per_set", num_frame):
+            yield from bps.abs_set(det.images_per_set, num_frame)
+            area_det_config.forget("images_per_set")
     else:
         # The dexela detector does not support `images_per_set` so we just
         # use whatever the user asks for as the thing
@@ -141,31 +162,162 @@ def shutter_step(detectors, motor, step):
     """
     yield from bps.checkpoint()
     yield from bps.abs_set(motor, step, wait=True)
-    yield from open_shutter_stub()
-    yield from bps.sleep(glbl["shutter_sleep"])
+    yield from open_shutter_stub(skip_redundant=True)
     yield from bps.trigger_and_read(list(detectors) + [motor])
-    yield from close_shutter_stub()
+    yield from close_shutter_stub(skip_redundant=True)
 
 
-def open_shutter_stub():
-    """simple function to return a generator that yields messages to
-    open the shutter"""
+class ShutterTracker:
+    """
+    known state of xpd_configuration['shutter']
+
+    The state follows the readback of the shutter through an ophyd
+    subscription. The shutter stubs of the frames of a scan ask the
+    tracker before moving the shutter: moving it to the position it
+    already has, and the settle time after opening it, are skipped.
+    A move is only skipped if the last move done by a plan went to the
+    same position and the readback agrees, so a plan iterated without
+    a RunEngine, or a shutter moved by hand, still gets its moves. If
+    the shutter can't be subscribed to, its state is unknown and it is
+    always moved.
+
+    Examples
+    --------
+    >>> shutter_tracker.state
+    'close'
+    >>> shutter_tracker.stats
+    {'moves': 4, 'skipped_moves': 120, 'saved_time': 31.5}
+    """
+
+    def __init__(self):
+        self.state = None
+        self.last_move = None
+        self._shutter = None
+        self._cid = None
+        self._move_times = {"open": [], "close": []}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """start counting skipped moves and saved time again"""
+        self.moves = 0
+        self.skipped_moves = 0
+        self.saved_time = 0.0
+
+    @property
+    def stats(self):
+        """moves done and skipped, and time saved, in seconds"""
+        return {
+            "moves": self.moves,
+            "skipped_moves": self.skipped_moves,
+            "saved_time": self.saved_time,
+        }
+
+    @property
+    def shutter(self):
+        shutter = xpd_configuration["shutter"]
+        if shutter is not self._shutter:
+            if self._cid is not None:
+                self._shutter.unsubscribe(self._cid)
+                self._cid = None
+            self.state = None
+            self._shutter = shutter
+            if hasattr(shutter, "subscribe"):
+                self._cid = shutter.subscribe(self._update)
+        return shutter
+
+    def _update(self, value, **kwargs):
+        if value == XPD_SHUTTER_CONF["open"]:
+            self.state = "open"
+        elif value == XPD_SHUTTER_CONF["close"]:
+            self.state = "close"
+        else:
+            self.state = None
+
+    def forget(self):
+        """stop trusting the last move, e.g. before a new scan"""
+        self.last_move = None
+
+    def needs_move(self, target):
+        """tell if the shutter has to move to ``target``"""
+        self.shutter
+        return not (self.last_move == target and self.state == target)
+
+    def moved(self, target, duration):
+        """note that the shutter has been moved to ``target``"""
+        self.last_move = target
+        self.moves += 1
+        self._move_times[target] = self._move_times[target][-9:] + [
+            duration
+        ]
+
+    def skipped(self, target, settle_time=0):
+        """note that moving the shutter to ``target`` has been skipped"""
+        move_times = self._move_times[target]
+        if move_times:
+            settle_time += sum(move_times) / len(move_times)
+        self.skipped_moves += 1
+        self.saved_time += settle_time
+
+
+shutter_tracker = ShutterTracker()
+
+
+def _move_shutter(target, skip_redundant=False):
+    """move the shutter to ``target``, 'open' or 'close'
+
+    The settle time is waited after opening, see ``shutter_settle_time``.
+    With ``skip_redundant``, nothing is done if ``shutter_tracker``
+    knows the shutter is already there.
+    """
+    settle_time = shutter_settle_time() if target == "open" else 0
+    if skip_redundant and not shutter_tracker.needs_move(target):
+        shutter_tracker.skipped(target, settle_time)
+        return
+    t0 = time.time()
     yield from bps.abs_set(
-        xpd_configuration["shutter"], XPD_SHUTTER_CONF["open"], wait=True
+        shutter_tracker.shutter, XPD_SHUTTER_CONF[target], wait=True
     )
-    yield from bps.sleep(glbl["shutter_sleep"])
+    shutter_tracker.moved(target, time.time() - t0)
+    if target == "open":
+        yield from bps.sleep(settle_time)
+
+
+def open_shutter_stub(skip_redundant=False):
+    """simple function to return a generator that yields messages to
+    open the shutter
+
+    With ``skip_redundant``, for the frames of a scan, nothing is done,
+    and there is no settle time, if the shutter is known to be open.
+    """
+    yield from _move_shutter("open", skip_redundant)
     yield from bps.checkpoint()
 
 
-def close_shutter_stub():
+def close_shutter_stub(skip_redundant=False):
     """simple function to return a generator that yields messages to
-    close the shutter"""
-    yield from bps.abs_set(
-        xpd_configuration["shutter"], XPD_SHUTTER_CONF["close"], wait=True
-    )
+    close the shutter
+
+    With ``skip_redundant``, for the frames of a scan, nothing is done
+    if the shutter is known to be closed.
+    """
+    yield from _move_shutter("close", skip_redundant)
     yield from bps.checkpoint()
 
 
+def _live_table_wrapper(plan, fields, callbacks=()):
+    """subscribe a LiveTable of ``fields`` and ``callbacks`` to ``plan``
+
+    With glbl['isolate_live_table'], the table is printed from the live
+    table worker process of ``xrun``, so a slow console doesn't hold up
+    the acquisition.
+    """
+    if glbl["isolate_live_table"]:
+        table = LiveTableFeed(fields)
+    else:
+        table = LiveTable(fields)
+    return bpp.subs_wrapper(plan, [table] + list(callbacks))
+
+
 def ct(dets, exposure):
     """
     Take one reading from area detector with given exposure time
@@ -210,11 +362,21 @@ def ct(dets, exposure):
         },
     )
     plan = bp.count([area_det], md=_md)
-    plan = bpp.subs_wrapper(plan, LiveTable([]))
+    plan = _live_table_wrapper(plan, [])
     yield from plan
 
 
-def Tramp(dets, exposure, Tstart, Tstop, Tstep, *, per_step=shutter_step):
+def Tramp(
+    dets,
+    exposure,
+    Tstart,
+    Tstop,
+    Tstep,
+    *,
+    per_step=shutter_step,
+    ramp_rate=None,
+    settle=None
+):
     """
     Collect data over a range of temperatures
 
@@ -249,6 +411,26 @@ def Tramp(dets, exposure, Tstart, Tstop, Tstep, *, per_step=shutter_step):
         To make shutter always open during the temperature ramp,
         pass ``None`` to this argument. See ``Notes`` below for more
         detailed information.
+    ramp_rate : float, optional
+        ramp rate in degrees per minute. If given, the temperature is
+        ramped continuously from Tstart to Tstop at this rate while a
+        frame is taken every time the temperature changes by Tstep,
+        without waiting for the temperature to settle. Each frame is
+        tagged with the temperature at the middle of its exposure.
+        The shutter stays open during the whole ramp unless
+        ``per_step`` is None. Default to None, step at each
+        temperature.
+    settle : bool or dict, optional
+        Option on whether to wait for the temperature to settle at each
+        temperature, or at Tstart if ``ramp_rate`` is given. If True,
+        the readback of the temperature controller has to stay within
+        1 degree of the setpoint for 10 s, drifting by less than 0.5
+        degree/min with a standard deviation below 0.2 degree, waiting
+        no more than 600 s. Pass a dict with keys among 'tolerance',
+        'max_slope', 'max_std', 'window' and 'max_wait' to change these
+        criteria. The time it took to settle is saved with each frame,
+        or as 'sp_settle_time' if ``ramp_rate`` is given. Default to
+        None, no wait.
 
     Notes
     -----
@@ -266,6 +448,10 @@ def Tramp(dets, exposure, Tstart, Tstop, Tstep, *, per_step=shutter_step):
 
     This will create a ``Tramp`` ScanPlan, with shutter always
     open during the ramping.
+
+    3. To ramp from 300 K to 500 K at 10 K/min with a frame every 2 K:
+
+        >>> ScanPlan(bt, Tramp, 5, 300, 500, 2, ramp_rate=10)
     """
 
     pe1c, = dets
@@ -296,6 +482,36 @@ def Tramp(dets, exposure, Tstart, Tstop, Tstep, *, per_step=shutter_step):
             "sp_plan_name": "Tramp",
         },
     )
+    monitor = make_settle_monitor(temp_controller, settle)
+    if monitor is not None:
+        _md["sp_settle"] = monitor.criteria
+    if ramp_rate is not None:
+        rate = ramp_rate / 60
+        period = max(computed_exposure, abs(computed_step_size) / rate)
+        print(
+            "INFO: ramping at {} K/min, one frame every {} s".format(
+                ramp_rate, period
+            )
+        )
+        _md["sp_ramp_rate"] = ramp_rate
+        _md["sp_fly_period"] = period
+        return (
+            yield from _Tramp_fly(
+                area_det,
+                temp_controller,
+                Tstart,
+                Tstop,
+                rate,
+                period,
+                _md,
+                per_step is not None,
+                monitor,
+            )
+        )
+    table = [temp_controller]
+    if monitor is not None:
+        per_step = settle_step(monitor, per_step)
+        table.append(monitor)
     plan = bp.scan(
         [area_det],
         temp_controller,
@@ -305,11 +521,11 @@ def Tramp(dets, exposure, Tstart, Tstop, Tstep, *, per_step=shutter_step):
         per_step=per_step,
         md=_md,
     )
-    plan = bpp.subs_wrapper(plan, LiveTable([temp_controller]))
+    plan = _live_table_wrapper(plan, table)
     yield from plan
 
 
-def Tlist(dets, exposure, T_list, *, per_step=shutter_step):
+def Tlist(dets, exposure, T_list, *, per_step=shutter_step, settle=None):
     """
     Collect data over a list of user-specific temperatures
 
@@ -340,6 +556,10 @@ def Tlist(dets, exposure, T_list, *, per_step=shutter_step):
         To make shutter always open during the temperature ramp,
         pass ``None`` to this argument. See ``Notes`` below for more
         detailed information.
+    settle : bool or dict, optional
+        Option on whether to wait for the temperature to settle at each
+        temperature. See ``Tramp`` for the criteria. Default to None,
+        no wait.
 
     Notes
     -----
@@ -376,15 +596,316 @@ def Tlist(dets, exposure, T_list, *, per_step=shutter_step):
         "sp_uid": str(uuid.uuid4()),
         "sp_plan_name": "Tlist",
     }
+    table = [T_controller]
+    monitor = make_settle_monitor(T_controller, settle)
+    if monitor is not None:
+        xpdacq_md["sp_settle"] = monitor.criteria
+        per_step = settle_step(monitor, per_step)
+        table.append(monitor)
     # pass xpdacq_md to as additional md to bluesky plan
     plan = bp.list_scan(
         [area_det], T_controller, T_list, per_step=per_step, md=xpdacq_md
     )
-    plan = bpp.subs_wrapper(plan, LiveTable([T_controller]))
+    plan = _live_table_wrapper(plan, table)
     yield from plan
 
 
-def tseries(dets, exposure, delay, num, auto_shutter=True):
+class BurstFlyer:
+    """
+    flyer taking a burst of frames with a detector in one go
+
+    ``kickoff`` starts taking ``num`` frames, one every ``period``
+    seconds, in a background thread, without any message of the
+    RunEngine between frames. ``collect`` emits all of them at once,
+    with the time each frame started as ``<det name>_frame_start``.
+
+    Parameters
+    ----------
+    det : ophyd.Device
+        the detector, triggered and read for each frame
+    num : int
+        number of frames
+    period : float
+        time between the starts of two consecutive frames, in seconds
+    stream_name : str, optional
+        name of the event stream of the frames. default to 'primary'.
+    """
+
+    def __init__(self, det, num, period, stream_name="primary"):
+        self.det = det
+        self.num = num
+        self.period = period
+        self.stream_name = stream_name
+        self.name = "{}_burst".format(det.name)
+        self.parent = None
+        self.frames = []
+        self._asset_docs = []
+        self._complete_status = None
+
+    def _more_frames(self):
+        return len(self.frames) < self.num
+
+    def _take_frames(self):
+        t_next = time.time()
+        try:
+            while self._more_frames():
+                t_sleep = t_next - time.time()
+                if t_sleep > 0:
+                    time.sleep(t_sleep)
+                t_start = time.time()
+                t_next = t_start + self.period
+                status_wait(self.det.trigger())
+                reading = self.det.read()
+                if hasattr(self.det, "collect_asset_docs"):
+                    self._asset_docs.extend(self.det.collect_asset_docs())
+                self.frames.append((t_start, time.time(), reading))
+        except Exception as e:
+            self._complete_status.set_exception(e)
+        else:
+            self._complete_status.set_finished()
+
+    def kickoff(self):
+        self.frames = []
+        self._asset_docs = []
+        self._complete_status = Status(self)
+        threading.Thread(target=self._take_frames, daemon=True).start()
+        status = Status(self)
+        status.set_finished()
+        return status
+
+    def complete(self):
+        return self._complete_status
+
+    @property
+    def _start_key(self):
+        return "{}_frame_start".format(self.det.name)
+
+    def describe_collect(self):
+        data_keys = dict(self.det.describe())
+        data_keys[self._start_key] = {
+            "source": self.name,
+            "dtype": "number",
+            "shape": [],
+            "units": "s",
+        }
+        return {self.stream_name: data_keys}
+
+    def collect_asset_docs(self):
+        asset_docs, self._asset_docs = self._asset_docs, []
+        yield from asset_docs
+
+    def collect(self):
+        for t_start, t_read, reading in self.frames:
+            data = {k: v["value"] for k, v in reading.items()}
+            timestamps = {k: v["timestamp"] for k, v in reading.items()}
+            data[self._start_key] = timestamps[self._start_key] = t_start
+            yield {"time": t_read, "data": data, "timestamps": timestamps}
+
+    @property
+    def achieved_period(self):
+        """mean time between the starts of consecutive frames"""
+        if len(self.frames) < 2:
+            return None
+        return (self.frames[-1][0] - self.frames[0][0]) / (
+            len(self.frames) - 1
+        )
+
+
+class RampFlyer(BurstFlyer):
+    """
+    flyer taking frames while ramping a temperature controller
+
+    ``kickoff`` ramps ``temp_controller`` from ``start`` to ``target``
+    at ``rate`` by updating its setpoint every ``update_period``
+    seconds, and takes one frame every ``period`` seconds until the
+    ramp is over. The readback of the controller is monitored during
+    the ramp and each frame is tagged with the readback interpolated
+    to the middle of the frame, under the name of the readback.
+
+    Parameters
+    ----------
+    det : ophyd.Device
+        the detector, triggered and read for each frame
+    temp_controller : ophyd.Device
+        the temperature controller, already at ``start``
+    start : float
+        temperature at the beginning of the ramp
+    target : float
+        temperature at the end of the ramp
+    rate : float
+        ramp rate in degrees per second
+    period : float
+        time between the starts of two consecutive frames, in seconds
+    update_period : float, optional
+        time between two updates of the setpoint, in seconds. default
+        to the smallest of ``period`` and 1 second.
+    stream_name : str, optional
+        name of the event stream of the frames. default to 'primary'.
+    """
+
+    def __init__(
+        self,
+        det,
+        temp_controller,
+        start,
+        target,
+        rate,
+        period,
+        update_period=None,
+        stream_name="primary",
+    ):
+        super().__init__(det, None, period, stream_name=stream_name)
+        if rate <= 0:
+            raise ValueError("ramp rate must be positive")
+        self.temp_controller = temp_controller
+        self.start = start
+        self.target = target
+        self.rate = rate
+        if update_period is None:
+            update_period = min(period, 1.0)
+        self.update_period = update_period
+        self.name = "{}_ramp".format(det.name)
+        hinted = getattr(temp_controller, "hints", {}).get("fields", [])
+        self.temp_key = hinted[0] if hinted else temp_controller.name
+        self.readbacks = []
+        self._ramp_done = threading.Event()
+        self._ramp_error = None
+        self._cid = None
+
+    def _on_readback(self, value=None, timestamp=None, **kwargs):
+        self.readbacks.append((timestamp or time.time(), value))
+
+    def _ramp(self):
+        t0 = time.time()
+        duration = abs(self.target - self.start) / self.rate
+        direction = np.sign(self.target - self.start)
+        try:
+            while not self._ramp_done.is_set():
+                elapsed = time.time() - t0
+                if elapsed >= duration:
+                    status_wait(self.temp_controller.set(self.target))
+                    break
+                self.temp_controller.set(
+                    self.start + direction * self.rate * elapsed
+                )
+                self._ramp_done.wait(self.update_period)
+        except Exception as e:
+            self._ramp_error = e
+        finally:
+            self._ramp_done.set()
+
+    def _more_frames(self):
+        if self._ramp_error is not None:
+            raise self._ramp_error
+        return not self._ramp_done.is_set()
+
+    def _take_frames(self):
+        try:
+            super()._take_frames()
+        finally:
+            self.temp_controller.unsubscribe(self._cid)
+
+    def kickoff(self):
+        self.readbacks = [(time.time(), self.start)]
+        self._ramp_done.clear()
+        self._ramp_error = None
+        self._cid = self.temp_controller.subscribe(
+            self._on_readback, run=False
+        )
+        threading.Thread(target=self._ramp, daemon=True).start()
+        return super().kickoff()
+
+    def stop(self, *, success=False):
+        """end the ramp, the temperature stays where it got to"""
+        self._ramp_done.set()
+
+    def describe_collect(self):
+        description = super().describe_collect()
+        data_keys = description[self.stream_name]
+        data_keys[self.temp_key] = {
+            "source": self.name,
+            "dtype": "number",
+            "shape": [],
+        }
+        return description
+
+    def collect(self):
+        times, values = zip(*sorted(self.readbacks))
+        for event in super().collect():
+            t_start = event["data"][self._start_key]
+            midpoint = (t_start + event["time"]) / 2
+            event["data"][self.temp_key] = float(
+                np.interp(midpoint, times, values)
+            )
+            event["timestamps"][self.temp_key] = midpoint
+            yield event
+
+
+def _Tramp_fly(
+    area_det,
+    temp_controller,
+    Tstart,
+    Tstop,
+    rate,
+    period,
+    md,
+    auto_shutter,
+    monitor=None,
+):
+    """ramp the temperature continuously while taking frames"""
+    flyer = RampFlyer(area_det, temp_controller, Tstart, Tstop, rate, period)
+
+    @bpp.stage_decorator([area_det])
+    @bpp.run_decorator(md=md)
+    def ramp():
+        if auto_shutter:
+            yield from open_shutter_stub(skip_redundant=True)
+        yield from bps.kickoff(flyer, wait=True)
+        yield from bps.complete(flyer, wait=True)
+        if auto_shutter:
+            yield from close_shutter_stub(skip_redundant=True)
+        yield from bps.collect(flyer)
+
+    # reach the start of the ramp before the run, with the shutter closed
+    if monitor is None:
+        yield from bps.mv(temp_controller, Tstart)
+    else:
+        yield from settle_stub(monitor, Tstart)
+        md["sp_settle_time"] = monitor.settle_time.get()
+    uid = yield from bpp.finalize_wrapper(ramp(), bps.stop(flyer))
+    print(
+        "INFO: {} frames over the ramp, achieved period = {} s "
+        "(nominal {} s)".format(
+            len(flyer.frames), flyer.achieved_period, period
+        )
+    )
+    return uid
+
+
+def _tseries_burst(area_det, num, period, md, auto_shutter):
+    """take the frames of a tseries as one burst"""
+    flyer = BurstFlyer(area_det, num, period)
+
+    @bpp.stage_decorator([area_det])
+    @bpp.run_decorator(md=md)
+    def burst():
+        if auto_shutter:
+            yield from open_shutter_stub(skip_redundant=True)
+        yield from bps.kickoff(flyer, wait=True)
+        yield from bps.complete(flyer, wait=True)
+        if auto_shutter:
+            yield from close_shutter_stub(skip_redundant=True)
+        yield from bps.collect(flyer)
+
+    uid = yield from burst()
+    print(
+        "INFO: burst of {} frames, achieved period = {} s "
+        "(nominal {} s)".format(num, flyer.achieved_period, period)
+    )
+    return uid
+
+
+def tseries(dets, exposure, delay, num, auto_shutter=True, burst=False):
     """
     time series scan with area detector.
 
@@ -405,9 +926,18 @@ def tseries(dets, exposure, delay, num, auto_shutter=True):
 
         `` open shutter - collect data - close shutter ``
 
+        If the next reading starts within glbl['shutter_keep_open']
+        seconds, the shutter stays open between readings and is closed
+        after the last one.
+
         To make shutter stay open during ``tseries`` scan,
         pass ``False`` to this argument. See ``Notes`` below for more
         detailed information.
+    burst: bool, optional
+        Option on whether to take all readings in one burst. If True,
+        the shutter is opened once, the readings are taken one
+        ``delay`` apart without any RunEngine message in between and
+        are emitted together once the burst is over. Default to False.
 
     Notes
     -----
@@ -438,9 +968,8 @@ def tseries(dets, exposure, delay, num, auto_shutter=True):
         )
     )
     print(
-        "INFO: nominal period (neglecting readout overheads) of {} s".format(
-            period
-        )
+        "INFO: nominal period of {} s, readout overheads are "
+        "compensated after each reading".format(period)
     )
     # update md
     _md = ChainMap(
@@ -459,25 +988,55 @@ def tseries(dets, exposure, delay, num, auto_shutter=True):
             "sp_plan_name": "tseries",
         },
     )
-    plan = bp.count([area_det], num, delay, md=_md)
-    plan = bpp.subs_wrapper(plan, LiveTable([]))
+    if burst:
+        _md["sp_burst"] = True
+        return (
+            yield from _tseries_burst(area_det, num, period, _md, auto_shutter)
+        )
+    # delays are adapted to the measured times of the readings
+    cadence = CadenceController(
+        period, log_path=os.path.join(glbl["config_base"], TIMING_LOG_FNAME)
+    )
+    _md["plan_args"] = {
+        "detectors": [repr(area_det)],
+        "num": num,
+        "delay": delay,
+    }
+    plan = bp.count([area_det], num, cadence.delays(num), md=_md)
+    plan = _live_table_wrapper(plan, [], [cadence])
+
+    # no need to close the shutter if the next frame comes soon, the
+    # default of 0 closes it after every frame
+    keep_open = (
+        glbl["shutter_keep_open"] > 0
+        and real_delay <= glbl["shutter_keep_open"]
+    )
 
     def inner_shutter_control(msg):
         if msg.command == "trigger":
 
             def inner():
-                yield from open_shutter_stub()
+                yield from open_shutter_stub(skip_redundant=True)
                 yield msg
 
             return inner(), None
-        elif msg.command == "save":
-            return None, close_shutter_stub()
+        elif msg.command == "save" and not keep_open:
+            return None, close_shutter_stub(skip_redundant=True)
         else:
             return None, None
 
     if auto_shutter:
         plan = bpp.plan_mutator(plan, inner_shutter_control)
     yield from plan
+    if auto_shutter and keep_open:
+        yield from close_shutter_stub()
+    stats = cadence.stats()
+    if stats is not None:
+        print(
+            "INFO: achieved period of {:.4f} s, jitter {:.4f} s".format(
+                stats["period_mean"], stats["period_std"]
+            )
+        )
 
 
 def _nstep(start, stop, step_size):
@@ -497,16 +1056,82 @@ def _nstep(start, stop, step_size):
     return computed_nsteps, computed_step_size
 
 
-# FIXME: this scanplan is hot-fix for multi-sample scanplan. It serves as
-#       a prototype of the future scanplans but it's incomplete.
+def _snake_paths(mapping, num):
+    """samples in order of motor position, reversed every other pass
+
+    Parameters
+    ----------
+    mapping : dict
+        {sample index: motor position}
+    num : int
+        number of passes
+    """
+    path = sorted(mapping.items(), key=lambda x: x[1])
+    return [path if i % 2 == 0 else path[::-1] for i in range(num)]
+
+
+def _travel(positions):
+    """total distance travelled through ``positions``"""
+    return float(np.abs(np.diff(positions)).sum()) if positions else 0.0
+
+
 def statTramp(
-    dets, exposure, Tstart, Tstop, Tstep, sample_mapping, *, bt=None
+    dets,
+    exposure,
+    Tstart,
+    Tstop,
+    Tstep,
+    sample_mapping,
+    *,
+    bt=None,
+    settle=None,
+    T_tolerance=None
 ):
     """
+    Collect data on several samples over a range of temperatures
+
+    At each temperature, the samples are measured one after the other
+    by moving xpd_configuration['stat_motor'] to their positions. The
+    samples are visited in order of position, in alternate directions
+    from one temperature to the next, so that the stage never flies
+    back. The temperature moves together with the stage, and if the
+    next temperature is within ``T_tolerance`` of the current one, the
+    move starts while the last sample of the current temperature is
+    measured. The travel of the stage and the time saved are reported
+    at the end.
+
+    The scalar readings of each sample, e.g. temperature, stage position
+    and ring current, are appended to
+    ``<tiff_base>/<sample name>_<sp_uid>.csv`` as they are measured.
+
     Parameters:
     -----------
+    dets : list
+        list of 'readable' objects. default to the area detector
+        linked to xpdAcq.
+    exposure : float
+        exposure time of each sample at each temperature, in seconds.
+    Tstart : float
+        starting point of temperature sequence.
+    Tstop : float
+        stoping point of temperature sequence.
+    Tstep : float
+        step size between Tstart and Tstop of this sequence.
     sample_mapping : dict
         {'sample_ind': croysta_motor_pos}
+    settle : bool or dict, optional
+        Option on whether to wait for the temperature to settle at each
+        temperature before measuring the samples. See ``Tramp`` for the
+        criteria. Default to None, no wait.
+    T_tolerance : float, optional
+        largest acceptable difference between the temperature and its
+        setpoint during a measurement. Default to the tolerance of
+        ``settle`` if given, 0 otherwise.
+
+    Returns
+    -------
+    uids : dict
+        {'sample_ind': list of uids of the runs of that sample}
     """
     pe1c, = dets
     # setting up area_detector
@@ -519,8 +1144,8 @@ def statTramp(
     ring_current = xpd_configuration["ring_current"]
     # compute Nsteps
     (Nsteps, computed_step_size) = _nstep(Tstart, Tstop, Tstep)
-    # stat_list
-    _sorted_mapping = sorted(sample_mapping.items(), key=lambda x: x[1])
+    temperatures = np.linspace(Tstart, Tstop, Nsteps)
+    paths = _snake_paths(sample_mapping, Nsteps)
     sp_uid = str(uuid.uuid4())
     xpdacq_md = {
         "sp_time_per_frame": acq_time,
@@ -536,57 +1161,159 @@ def statTramp(
         "sp_uid": sp_uid,
         "sp_plan_name": "statTramp",
     }
+    readables = [temp_controller, stat_motor, ring_current]
+    monitor = make_settle_monitor(temp_controller, settle)
+    if monitor is not None:
+        xpdacq_md["sp_settle"] = monitor.criteria
+        readables.append(monitor)
+    if T_tolerance is None:
+        T_tolerance = monitor.tolerance if monitor is not None else 0
+    xpdacq_md["sp_T_tolerance"] = T_tolerance
+
+    move_temperature = functools.partial(
+        _start_temperature_move, temp_controller, monitor
+    )
+
     # plan
+    try:
+        from xpdan.data_reduction import save_last_tiff
+    except ImportError:
+        save_last_tiff = None
     uids = {k: [] for k in sample_mapping.keys()}
-    yield from bp.mv(temp_controller, Tstart)
-    for t in np.linspace(Tstart, Tstop, Nsteps):
-        yield from bp.mv(temp_controller, t)
-        for s, pos in _sorted_mapping:  # sample ind
-            yield from bp.mv(stat_motor, pos)
-            # update md
-            md = list(bt.samples.values())[int(s)]
-            _md = ChainMap(md, xpdacq_md)
-            plan = bp.count(
-                [temp_controller, stat_motor, ring_current] + dets, md=_md
+    # readings of each sample written as they come
+    sample_names = list(bt.samples.keys())
+    writers = {
+        s: SampleTableWriter(
+            os.path.join(
+                glbl["tiff_base"],
+                "_".join([sample_names[int(s)], sp_uid]) + ".csv",
             )
-            plan = bp.subs_wrapper(
-                plan,
-                LiveTable(
-                    [area_det, temp_controller, stat_motor, ring_current]
-                ),
-            )
-            # plan = bp.baseline_wrapper(plan, [temp_controller,
-            #                                  stat_motor,
-            #                                  ring_current])
-            uid = yield from plan
-            if uid is not None:
-                from xpdan.data_reduction import save_last_tiff
+        )
+        for s in sample_mapping
+    }
 
+    def measure(s):
+        md = bt.samples[sample_names[int(s)]]
+        plan = bp.count(readables + dets, md=ChainMap(md, xpdacq_md))
+        plan = _live_table_wrapper(
+            plan,
+            [area_det, temp_controller, stat_motor, ring_current],
+            [writers[s]],
+        )
+        uid = yield from plan
+        if uid is not None:
+            if save_last_tiff is not None:
                 save_last_tiff()
-                uids[s].append(uid)
-    for s, uid_list in uids.items():
-        from databroker import db
-        import pandas as pd
-
-        hdrs = db[uid_list]
-        dfs = [db.get_table(h, stream_name="primary") for h in hdrs]
-        df = pd.concat(dfs)
-        fn_md = list(bt.samples.keys())[int(s)]
-        fn_md = "_".join([fn_md, sp_uid]) + ".csv"
-        fn = os.path.join(glbl["tiff_base"], fn_md)
-        df.to_csv(fn)
+            uids[s].append(uid)
+
+    # next temperatures close enough to start moving to during a pass
+    early_moves = [
+        t1 if abs(t1 - t0) <= T_tolerance else None
+        for t0, t1 in zip(temperatures, temperatures[1:])
+    ] + [None]
+    positions = [stat_motor.position]
+    overlap = 0.0
+    pending = None
+    for t, t_next, path in zip(temperatures, early_moves, paths):
+        pass_positions, pass_overlap, pending = yield from _stat_pass(
+            stat_motor, path, t, t_next, move_temperature, measure, pending
+        )
+        positions += pass_positions
+        overlap += pass_overlap
+    if any(uids.values()):
+        _report_stat_travel(stat_motor, paths, positions, overlap)
     return uids
 
 
+def _start_temperature_move(temp_controller, monitor, t, group):
+    """start moving ``temp_controller`` to ``t``, under ``monitor`` if not
+    None
+    """
+    if monitor is None:
+        yield from bps.abs_set(temp_controller, t, group=group)
+    else:
+        yield from settle_stub(monitor, t, group=group, wait=False)
+
+
+def _stat_pass(
+    stat_motor, path, t, t_next, move_temperature, measure, pending
+):
+    """measure the samples of ``path`` at temperature ``t``, a pass of
+    statTramp
+
+    ``pending`` is the group and the start time of the move to ``t``,
+    if it was started during the previous pass. The move to ``t_next``,
+    unless None, starts while the last sample is measured.
+
+    Returns
+    -------
+    positions : list
+        positions of the stage at each sample
+    overlap : float
+        time the move to ``t`` ran during the previous pass
+    pending : tuple or None
+        group and start time of the move to ``t_next``
+    """
+    if pending is None:
+        group, t_move = short_uid("statTramp"), None
+        yield from move_temperature(t, group)
+    else:
+        group, t_move = pending
+    # the stage moves to the first sample while the temperature moves
+    yield from bps.abs_set(stat_motor, path[0][1], group=group)
+    t_wait = time.time()
+    yield from bps.wait(group=group)
+    overlap = t_wait - t_move if t_move is not None else 0.0
+    positions, pending = [], None
+    for j, (s, pos) in enumerate(path):
+        if j:
+            yield from bps.mv(stat_motor, pos)
+        positions.append(stat_motor.position)
+        if j == len(path) - 1 and t_next is not None:
+            group = short_uid("statTramp")
+            yield from move_temperature(t_next, group)
+            pending = (group, time.time())
+        yield from measure(s)
+    return positions, overlap, pending
+
+
+def _report_stat_travel(stat_motor, paths, positions, overlap):
+    """print the travel of the stage and the time saved by statTramp"""
+    start = positions[:1]
+    raster = start + [pos for _, pos in paths[0]] * len(paths)
+    snake = start + [pos for path in paths for _, pos in path]
+    saved_travel = _travel(raster) - _travel(snake)
+    print(
+        "INFO: {} travel: {:.3f} projected in one direction, {:.3f} "
+        "projected in snake order, {:.3f} actual".format(
+            stat_motor.name,
+            _travel(raster),
+            _travel(snake),
+            _travel(positions),
+        )
+    )
+    saved = [
+        "up to {:.1f} s by moving the temperature while measuring".format(
+            overlap
+        )
+    ]
+    velocity = getattr(stat_motor, "velocity", None)
+    if velocity is not None and velocity.get():
+        saved.append(
+            "about {:.1f} s of stage travel".format(
+                saved_travel / velocity.get()
+            )
+        )
+    print("INFO: time saved: {}".format(", ".join(saved)))
+
+
 # stream_name='primary'
 
 register_plan("ct", ct)
 register_plan("Tramp", Tramp)
 register_plan("tseries", tseries)
 register_plan("Tlist", Tlist)
-
-
-# register_plan('statTramp', statTramp)
+register_plan("statTramp", statTramp)
 
 
 def new_short_uid():
@@ -598,13 +1325,137 @@ def _clean_info(obj):
     return str(obj).strip().replace(" ", "_")
 
 
+def _dump_linked_maps(obj, f=None):
+    """dump a Sample or ScanPlan with a reference to its Beamtime
+
+    Only the bt_uid of the Beamtime is stored, so that a change to the
+    Beamtime is written to ``bt_bt.yml`` alone.
+    """
+    bt_link = {"bt_uid": obj.maps[1]["bt_uid"]}
+    return yaml_dump(
+        [dict(obj.maps[0]), bt_link], f, default_flow_style=False
+    )
+
+
+def _resolve_beamtime(bt_md):
+    """find the Beamtime referenced by the second map of a yaml file
+
+    Parameters
+    ----------
+    bt_md : dict
+        either ``{'bt_uid': <uid>}`` or, for files written by older
+        versions of xpdAcq, a full copy of the Beamtime metadata.
+
+    Returns
+    -------
+    bt : xpdacq.beamtime.Beamtime
+    """
+    bt_uid = bt_md.get("bt_uid")
+    bt = _BEAMTIME_REGISTRY.get(bt_uid)
+    if bt is not None:
+        return bt
+    if set(bt_md) - {"bt_uid"}:
+        # legacy format carries the full Beamtime
+        return Beamtime.from_dict(dict(bt_md))
+    bt_fpath = os.path.join(glbl["yaml_dir"], "bt_bt.yml")
+    if os.path.isfile(bt_fpath):
+        with open(bt_fpath, "r") as f:
+            bt = Beamtime.from_yaml(f)
+        if bt["bt_uid"] == bt_uid:
+            return bt
+    raise ValueError(
+        "Can't find the Beamtime with bt_uid={} this object "
+        "belongs to. Please load the beamtime first.".format(bt_uid)
+    )
+
+
+class _OrderFile:
+    """
+    hidden yaml file under config_base recording the order of the Samples
+    or ScanPlans of a Beamtime
+
+    It is written through ``flush_engine``, so that registering a batch of
+    objects inside ``Beamtime.deferred_flush`` writes it only once.
+    """
+
+    def __init__(self, fname, mapping):
+        self.fname = fname
+        self.mapping = mapping
+        self._last_dump = None
+
+    @property
+    def filepath(self):
+        return os.path.join(glbl["config_base"], self.fname)
+
+    def order(self):
+        return {i: name + ".yml" for i, name in enumerate(self.mapping)}
+
+    def _snapshot(self):
+        snapshot = (self.filepath, yaml_dump(self.order()))
+        if snapshot == self._last_dump and os.path.isfile(self.filepath):
+            return None
+        return snapshot
+
+
+class _LazyEntry:
+    """placeholder of a MDOrderedDict value built on first access"""
+
+    __slots__ = ("loader",)
+
+    def __init__(self, loader):
+        self.loader = loader
+
+
 class MDOrderedDict(OrderedDict):
+    """
+    OrderedDict of the Samples or ScanPlans of a Beamtime
+
+    Values can be added lazily with ``add_lazy``: the object is only built
+    when it is first accessed, e.g. ``bt.samples['Ni']`` or
+    ``bt.samples.by_index(0)``. Listing the keys never builds objects.
+    """
+
+    def add_lazy(self, key, loader):
+        """add a value built by calling ``loader()`` on first access
+
+        ``loader`` is expected to create an object registering itself to
+        this mapping, normally under the same key.
+        """
+        OrderedDict.__setitem__(self, key, _LazyEntry(loader))
+
+    def is_loaded(self, key):
+        """whether the value of ``key`` has been built"""
+        return not isinstance(OrderedDict.__getitem__(self, key), _LazyEntry)
+
+    def __getitem__(self, key):
+        val = OrderedDict.__getitem__(self, key)
+        if isinstance(val, _LazyEntry):
+            val = val.loader()
+            # the object registered itself under another key
+            if not self.is_loaded(key):
+                del self[key]
+        return val
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return ValuesView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def by_index(self, ind):
+        """value at position ``ind`` of bt.list(), only this one is built"""
+        return self[list(self.keys())[ind]]
+
     def get_md(self, ind):
         """special method to get metadata of sample object based on
         bt.list index
         """
-        obj_list = list(self.values())
-        md_dict = dict(obj_list[ind])
+        md_dict = dict(self.by_index(ind))
         return md_dict
 
 
@@ -660,9 +1511,14 @@ class Beamtime(ValidatedDictLike, YamlDict):
         self._wavelength = wavelength
         self.scanplans = MDOrderedDict()
         self.samples = MDOrderedDict()
+        self._scanplan_order = _OrderFile(
+            ".scanplan_order.yml", self.scanplans
+        )
+        self._sample_order = _OrderFile(".sample_order.yml", self.samples)
         self._referenced_by = []
         # used by YamlDict when reload
         self.setdefault("bt_uid", new_short_uid())
+        _BEAMTIME_REGISTRY[self["bt_uid"]] = self
         self.robot_info = {}
 
     @property
@@ -700,44 +1556,30 @@ class Beamtime(ValidatedDictLike, YamlDict):
         return os.path.join(glbl["yaml_dir"], "bt_bt.yml").format(**self)
 
     def register_scanplan(self, scanplan):
-        # Notify this Beamtime about an ScanPlan that should be re-synced
-        # whenever the contents of the Beamtime are edited.
+        # Notify this Beamtime about an ScanPlan. The ScanPlan yaml only
+        # refers to this Beamtime by uid, so it doesn't need to be re-synced
+        # when the contents of the Beamtime are edited.
         scanplan_name = scanplan.short_summary()
+        is_new = scanplan_name not in self.scanplans
         self.scanplans.update({scanplan_name: scanplan})
-        # yaml sync list
-        self._referenced_by.append(scanplan)
         # save order
-        with open(
-            os.path.join(glbl["config_base"], ".scanplan_order.yml"), "w+"
-        ) as f:
-            scanplan_order = {}
-            for i, name in enumerate(self.scanplans.keys()):
-                scanplan_order.update({i: name + ".yml"})
-            # debug line
-            self._scanplan_order = scanplan_order
-            yaml.dump(scanplan_order, f)
+        if is_new:
+            flush_engine.mark_dirty(self._scanplan_order)
 
     def register_sample(self, sample):
-        # Notify this Beamtime about an Sample that should be re-synced
-        # whenever the contents of the Beamtime are edited.
+        # Notify this Beamtime about an Sample. The Sample yaml only refers
+        # to this Beamtime by uid, so it doesn't need to be re-synced when
+        # the contents of the Beamtime are edited.
         sample_name = sample.get("sample_name", None)
+        is_new = sample_name not in self.samples
         self.samples.update({sample_name: sample})
-        # yaml sync list
-        self._referenced_by.append(sample)
         # save order
-        with open(
-            os.path.join(glbl["config_base"], ".sample_order.yml"), "w+"
-        ) as f:
-            sample_order = {}
-            for i, name in enumerate(self.samples.keys()):
-                sample_order.update({i: name + ".yml"})
-            # debug line
-            self._sample_order = sample_order
-            yaml.dump(sample_order, f)
+        if is_new:
+            flush_engine.mark_dirty(self._sample_order)
 
     @classmethod
     def from_yaml(cls, f):
-        d = yaml.unsafe_load(f)
+        d = yaml_load(f)
         instance = cls.from_dict(d)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -885,9 +1727,12 @@ class Sample(ValidatedDictLike, YamlChainMap):
             glbl["yaml_dir"], "samples", "{sample_name}.yml"
         ).format(**self)
 
+    def to_yaml(self, f=None):
+        return _dump_linked_maps(self, f)
+
     @classmethod
     def from_yaml(cls, f, beamtime=None):
-        map1, map2 = yaml.unsafe_load(f)
+        map1, map2 = yaml_load(f)
         instance = cls.from_dicts(map1, map2, beamtime=beamtime)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -896,7 +1741,7 @@ class Sample(ValidatedDictLike, YamlChainMap):
     @classmethod
     def from_dicts(cls, map1, map2, beamtime=None):
         if beamtime is None:
-            beamtime = Beamtime.from_dict(map2)
+            beamtime = _resolve_beamtime(map2)
         # uid = map1.pop('sa_uid')
         return cls(
             beamtime,
@@ -1007,9 +1852,12 @@ class ScanPlan(ValidatedDictLike, YamlChainMap):
     def __eq__(self, other):
         return self.to_yaml() == other.to_yaml()
 
+    def to_yaml(self, f=None):
+        return _dump_linked_maps(self, f)
+
     @classmethod
     def from_yaml(cls, f, beamtime=None):
-        map1, map2 = yaml.unsafe_load(f)
+        map1, map2 = yaml_load(f)
         instance = cls.from_dicts(map1, map2, beamtime=beamtime)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
@@ -1018,7 +1866,7 @@ class ScanPlan(ValidatedDictLike, YamlChainMap):
     @classmethod
     def from_dicts(cls, map1, map2, beamtime=None):
         if beamtime is None:
-            beamtime = Beamtime.from_dict(map2)
+            beamtime = _resolve_beamtime(map2)
         plan_name = map1.pop("sp_plan_name")
         plan_func = _PLAN_REGISTRY[plan_name]
         plan_uid = map1.pop("sp_uid")
@@ -15,7 +15,8 @@
 ##############################################################################
 import os
 import sys
-import yaml
+import functools
+import contextlib
 import shutil
 import subprocess
 from time import strftime
@@ -25,6 +26,9 @@ from pkg_resources import resource_filename as rs_fn
 
 from .beamtime import *
 from .tools import _graceful_exit, xpdAcqError
+from .yamldict import _atomic_write, flush_engine
+from .yamlindex import YamlIndex
+from .serialization import yaml_load, yaml_dump
 from .xpdacq_conf import (glbl_dict, _load_beamline_config,
                           xpd_configuration)
 from .glbl import glbl
@@ -101,8 +105,18 @@ def _make_clean_env():
     return out
 
 
-def start_xpdacq():
-    """ function to reload beamtime """
+def start_xpdacq(lazy=True, index=True):
+    """ function to reload beamtime
+
+    Parameters
+    ----------
+    lazy : bool, optional
+        option to build Sample and ScanPlan objects on first access,
+        see ``load_beamtime``. default to True.
+    index : bool, optional
+        option to read yaml files through the index under
+        glbl['yaml_dir'], see ``load_beamtime``. default to True.
+    """
     try:
         bt_list = [
             f
@@ -114,8 +128,7 @@ def start_xpdacq():
         return _no_beamtime()
 
     if len(bt_list) == 1:
-        bt_f = bt_list[-1]
-        bt = load_beamtime()
+        bt = load_beamtime(lazy=lazy, index=index)
         return bt
 
     elif len(bt_list) > 1:
@@ -138,7 +151,7 @@ def _no_beamtime():
     )
 
 
-def load_beamtime(directory=None):
+def load_beamtime(directory=None, lazy=False, index=False):
     """
     Load a Beamtime and associated objects.
 
@@ -149,73 +162,189 @@ def load_beamtime(directory=None):
       glbl.yml
       samples/
       scanplans/
+
+    Sample and ScanPlan files refer to the Beamtime by its ``bt_uid``
+    and are re-linked to the Beamtime loaded from ``bt_bt.yml``. Files
+    in the older format, carrying a full copy of the Beamtime, are
+    rewritten in the new format as they are loaded.
+
+    Objects are ordered as in ``.sample_order.yml`` and
+    ``.scanplan_order.yml``, files missing from these are put last.
+
+    Parameters
+    ----------
+    directory : str, optional
+        directory to load from. default to glbl['yaml_dir'].
+    lazy : bool, optional
+        option to only list the files and build each Sample or ScanPlan
+        on its first access through ``bt.samples`` or ``bt.scanplans``.
+        Objects are then listed under their file name. default to False.
+    index : bool, optional
+        option to keep the parsed files in a sqlite index under
+        ``directory`` and to only parse again the files changed since
+        they were indexed, see ``xpdacq.yamlindex.YamlIndex``. default to
+        False.
+
+    Returns
+    -------
+    bt : xpdacq.beamtime.Beamtime
     """
     if directory is None:
         directory = glbl_dict["yaml_dir"]  # leave room for multi-beamtime
     known_uids = {}
     beamtime_fn = os.path.join(directory, "bt_bt.yml")
-    sample_fns = [fn for fn in os.listdir(os.path.join(directory, "samples"))]
-    scanplan_fns = [
-        fn for fn in os.listdir(os.path.join(directory, "scanplans"))
-    ]
-
-    with open(beamtime_fn, "r") as f:
-        bt = load_yaml(f, known_uids)
-
-    # most recent scanplan order
-    scanplan_order_fn = os.path.join(
-        glbl_dict["config_base"], ".scanplan_order.yml"
-    )
-    if os.path.isfile(scanplan_order_fn):
-        with open(scanplan_order_fn) as f:
-            scanplan_order = yaml.unsafe_load(f)
-        for fn in sorted(
-            scanplan_fns, key=list(scanplan_order.values()).index
+    yaml_index = YamlIndex(directory) if index else None
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(flush_engine.deferred())
+        if yaml_index is not None:
+            stack.enter_context(yaml_index)
+        bt = _load_yaml_path(beamtime_fn, known_uids, yaml_index)
+        for sub_dir, order_file, mapping in (
+            ("scanplans", bt._scanplan_order, bt.scanplans),
+            ("samples", bt._sample_order, bt.samples),
         ):
-            with open(os.path.join(directory, "scanplans", fn), "r") as f:
-                load_yaml(f, known_uids)
-    # most recent sample order
-    sample_order_fn = os.path.join(
-        glbl_dict["config_base"], ".sample_order.yml"
-    )
-    if os.path.isfile(sample_order_fn):
-        with open(sample_order_fn) as f:
-            sample_order = yaml.unsafe_load(f)
-        for fn in sorted(sample_fns, key=list(sample_order.values()).index):
-            with open(os.path.join(directory, "samples", fn), "r") as f:
-                load_yaml(f, known_uids)
+            full_dir = os.path.join(directory, sub_dir)
+            for fn in _ordered_yaml_fns(full_dir, order_file):
+                loader = functools.partial(
+                    _load_yaml_path,
+                    os.path.join(full_dir, fn),
+                    known_uids,
+                    yaml_index,
+                )
+                if lazy:
+                    mapping.add_lazy(os.path.splitext(fn)[0], loader)
+                else:
+                    loader()
+        if yaml_index is not None and not lazy:
+            yaml_index.prune()
 
     return bt
 
 
+def _ordered_yaml_fns(full_dir, order_file):
+    """yaml files of full_dir in the order recorded by order_file
+
+    The content of the order file is recorded as last written, so that it
+    is not rewritten if the order doesn't change.
+    """
+    fns = [fn for fn in os.listdir(full_dir) if _is_yaml_file(fn)]
+    order = {}
+    if os.path.isfile(order_file.filepath):
+        with open(order_file.filepath) as f:
+            text = f.read()
+        order = yaml_load(text) or {}
+        order_file._last_dump = (order_file.filepath, text)
+    # file name -> position, missing files go last by name
+    index = {fn: i for i, fn in order.items()}
+    return sorted(fns, key=lambda fn: (index.get(fn, len(index)), fn))
+
+
+def _load_yaml_path(fpath, known_uids, yaml_index=None):
+    if yaml_index is None:
+        with open(fpath, "r") as f:
+            return load_yaml(f, known_uids)
+    with yaml_index:
+        text, data = yaml_index.read(fpath)
+    return _build_from_yaml(data, text, os.path.abspath(fpath), known_uids)
+
+
+def _is_yaml_file(fn):
+    """skip hidden files, e.g. temporary files of an interrupted write"""
+    return fn.endswith(".yml") and not fn.startswith(".")
+
+
+def migrate_beamtime_yaml(directory=None):
+    """
+    Rewrite Sample and ScanPlan yaml files to refer to their Beamtime by uid
+
+    Files written by older versions of xpdAcq embed a full copy of the
+    Beamtime metadata. ``load_beamtime`` reads both formats; this function
+    converts a directory in place without creating any xpdAcq object.
+
+    Parameters
+    ----------
+    directory : str, optional
+        directory holding ``samples/`` and ``scanplans/``. default to
+        glbl['yaml_dir'].
+
+    Returns
+    -------
+    migrated : list
+        paths of the files that have been rewritten
+    """
+    if directory is None:
+        directory = glbl_dict["yaml_dir"]
+    migrated = []
+    for sub_dir in ("samples", "scanplans"):
+        full_dir = os.path.join(directory, sub_dir)
+        if not os.path.isdir(full_dir):
+            continue
+        for fn in sorted(filter(_is_yaml_file, os.listdir(full_dir))):
+            fpath = os.path.join(full_dir, fn)
+            with open(fpath, "r") as f:
+                data = yaml_load(f)
+            if not (
+                isinstance(data, list)
+                and len(data) == 2
+                and isinstance(data[1], dict)
+            ):
+                continue
+            map1, bt_md = data
+            if not set(bt_md) - {"bt_uid"}:
+                continue  # already migrated
+            _atomic_write(
+                fpath,
+                yaml_dump(
+                    [map1, {"bt_uid": bt_md["bt_uid"]}],
+                    default_flow_style=False,
+                ),
+            )
+            migrated.append(fpath)
+    return migrated
+
+
 def load_yaml(f, known_uids=None):
     """
     Recreate a ScanPlan, Experiment, or Beamtime object from a YAML file.
 
     If its linked objects have already been created, re-link to them.
     If they have not yet been created, create them now.
+
+    The file is parsed once. An object loaded from a file handle is not
+    written back unless its yaml representation differs from the file.
     """
     if known_uids is None:
         known_uids = {}
-    data = yaml.unsafe_load(f)
-    # If f is a file handle, 'rewind' it so we can read it again.
-    if not isinstance(f, str):
-        f.seek(0)
-    if isinstance(data, dict) and "bt_uid" in data:
-        obj = Beamtime.from_yaml(f)
-        known_uids[obj["bt_uid"]] = obj
-        return obj
-    elif isinstance(data, list) and "sa_uid" in data[0]:
-        beamtime = known_uids.get(data[1]["bt_uid"])
-        obj = Sample.from_yaml(f, beamtime=beamtime)
-        known_uids[obj["sa_uid"]] = obj
-    elif isinstance(data, list) and len(data) == 2:
-        # elif isinstance(data, list) and 'sp_uid' in data[0]:
-        beamtime = known_uids.get(data[1]["bt_uid"])
-        obj = ScanPlan.from_yaml(f, beamtime=beamtime)
-        known_uids[obj["sp_uid"]] = obj
-    else:
-        raise ValueError("File does not match a recognized specification.")
+    text = f if isinstance(f, str) else f.read()
+    fpath = None if isinstance(f, str) else os.path.abspath(f.name)
+    return _build_from_yaml(yaml_load(text), text, fpath, known_uids)
+
+
+def _build_from_yaml(data, text, fpath, known_uids):
+    """build the object from the parsed yaml ``data`` of file ``fpath``
+
+    The object is marked as in sync with ``text``, the contents of the
+    file, so it is only written back if its yaml representation differs.
+    """
+    with flush_engine.deferred():
+        if isinstance(data, dict) and "bt_uid" in data:
+            obj = Beamtime.from_dict(data)
+            uid_key = "bt_uid"
+        elif isinstance(data, list) and "sa_uid" in data[0]:
+            beamtime = known_uids.get(data[1]["bt_uid"])
+            obj = Sample.from_dicts(*data, beamtime=beamtime)
+            uid_key = "sa_uid"
+        elif isinstance(data, list) and len(data) == 2:
+            # elif isinstance(data, list) and 'sp_uid' in data[0]:
+            beamtime = known_uids.get(data[1]["bt_uid"])
+            obj = ScanPlan.from_dicts(*data, beamtime=beamtime)
+            uid_key = "sp_uid"
+        else:
+            raise ValueError("File does not match a recognized specification.")
+        if fpath is not None:
+            obj.filepath = fpath
+            obj._last_dump = (obj.filepath, text)
+    known_uids[obj[uid_key]] = obj
     return obj
 
 
@@ -334,7 +463,7 @@ def _load_bt(bt_yaml_path):
             )
         )
     with open(btoname, "r") as f:
-        bto = yaml.unsafe_load(f)
+        bto = yaml_load(f)
     return bto
 
 
@@ -29,7 +29,10 @@ from .xpdacq_conf import xpd_configuration
 from .beamtime import Beamtime, ScanPlan, Sample, ct
 from .tools import _timestampstr, _check_obj, xpdAcqException
 from .utils import ExceltoYaml
-from .xpdacq import _auto_load_calibration_file
+from .xpdacq import (
+    _auto_load_calibration_file,
+    invalidate_calibration_cache,
+)
 
 from xpdtools.calib import _save_calib_param, _calibration
 
@@ -195,6 +198,8 @@ def run_calibration(
                 break
             else:
                 time.sleep(1)
+    # a new calibration file is (being) written
+    invalidate_calibration_cache()
     """
     if not parallel:  # backup when pipeline fails
         # get wavelength from bt
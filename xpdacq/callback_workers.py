@@ -0,0 +1,388 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import queue
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+
+import numpy as np
+from bluesky.callbacks import LiveTable
+from bluesky.callbacks.core import get_obj_fields
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8, arrays go through the queue
+    shared_memory = None
+
+DROP_POLICIES = ("oldest", "newest", None)
+_EVENTS = ("event", "event_page")
+# name of the items carrying the fields of the next live table
+LIVE_TABLE_FIELDS = "live_table_fields"
+
+
+class _SharedArray:
+    """reference to an array copied into a shared memory block"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _share(value, threshold):
+    if not (
+        shared_memory is not None
+        and isinstance(value, np.ndarray)
+        and value.nbytes >= threshold
+        and value.nbytes > 0
+        and not value.dtype.hasobject
+    ):
+        return value
+    shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+    np.ndarray(value.shape, value.dtype, buffer=shm.buf)[...] = value
+    ref = _SharedArray(shm.name, value.shape, value.dtype.str)
+    # the worker unlinks the block once it has copied it out
+    shm.close()
+    return ref
+
+
+def _unshare(value):
+    if not isinstance(value, _SharedArray):
+        return value
+    shm = shared_memory.SharedMemory(name=value.name)
+    try:
+        return np.ndarray(value.shape, value.dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _encode(name, doc, threshold):
+    """event with its large arrays moved to shared memory"""
+    if name == "event":
+        data = {k: _share(v, threshold) for k, v in doc["data"].items()}
+    elif name == "event_page":
+        data = {
+            k: [_share(v, threshold) for v in values]
+            for k, values in doc["data"].items()
+        }
+    else:
+        return name, doc
+    return name, dict(doc, data=data)
+
+
+def _release(item):
+    """free the shared memory of an item the worker never got"""
+    name, doc = item
+    if name == "event":
+        values = doc["data"].values()
+    elif name == "event_page":
+        values = [v for vs in doc["data"].values() for v in vs]
+    else:
+        return
+    for value in values:
+        if isinstance(value, _SharedArray):
+            shm = shared_memory.SharedMemory(name=value.name)
+            shm.close()
+            shm.unlink()
+
+
+def _decode(name, doc):
+    if name == "event":
+        data = {k: _unshare(v) for k, v in doc["data"].items()}
+    elif name == "event_page":
+        data = {
+            k: [_unshare(v) for v in values]
+            for k, values in doc["data"].items()
+        }
+    else:
+        return name, doc
+    return name, dict(doc, data=data)
+
+
+def _run_worker(factory, doc_queue, errors):
+    callback = factory()
+    while True:
+        item = doc_queue.get()
+        if item is None:
+            return
+        try:
+            callback(*_decode(*item))
+        except Exception:
+            with errors.get_lock():
+                errors.value += 1
+            print(
+                "WARNING: callback {!r} failed on a {} document\n{}".format(
+                    callback, item[0], traceback.format_exc()
+                )
+            )
+
+
+class ProcessCallback:
+    """
+    run a callback in a worker process, out of the way of the RunEngine
+
+    Subscribed to a RunEngine, this forwards the documents to a callback
+    made by ``factory`` in a worker process. Calling it only puts the
+    document in a buffer; a sender thread moves the documents from the
+    buffer to the worker through a queue, copying the large arrays of
+    the events into shared memory on the way. A slow or failing
+    callback then never holds up the acquisition.
+
+    When the worker lags ``maxsize`` documents behind, events are
+    dropped from the buffer according to ``drop``: 'oldest' keeps the
+    latest readings, which suits live displays, 'newest' keeps the
+    readings in order up to the backlog, and None keeps them all,
+    which suits analysis that needs every event. The other documents
+    are never dropped.
+
+    The worker is started with the first document and runs, across
+    runs, until ``close``. Keep one per callback, e.g. from
+    ``xrun.process_callback``, rather than one per run, as starting a
+    worker takes a new interpreter.
+
+    Parameters
+    ----------
+    factory : callable
+        function, or class, returning the callback. It is called in the
+        worker and must be picklable, e.g.
+        ``functools.partial(LiveTable, ['temperature'])``.
+    maxsize : int, optional
+        number of documents waiting for the worker above which events
+        are dropped. default to 1000.
+    drop : {'oldest', 'newest', None}, optional
+        events to drop when the worker lags behind. default to
+        'oldest'.
+    shm_threshold : int, optional
+        size, in bytes, from which an array of an event goes through
+        shared memory rather than the queue. default to 1 MiB.
+    mp_context : multiprocessing context, optional
+        context starting the worker. default to 'spawn', as forking a
+        process running the threads of ophyd and the RunEngine can
+        deadlock.
+
+    Examples
+    --------
+    >>> from functools import partial
+    >>> from bluesky.callbacks import LiveTable
+    >>> cb = ProcessCallback(partial(LiveTable, []))
+    >>> xrun(0, 0, subs=cb)
+    >>> xrun(1, 0, subs=cb)  # same worker
+    >>> cb.close()
+    """
+
+    def __init__(
+        self,
+        factory,
+        maxsize=1000,
+        drop="oldest",
+        shm_threshold=2 ** 20,
+        mp_context=None,
+    ):
+        if drop not in DROP_POLICIES:
+            raise ValueError(
+                "drop must be one of {}, not {!r}".format(DROP_POLICIES, drop)
+            )
+        self.factory = factory
+        self.maxsize = maxsize
+        self.drop = drop
+        self.shm_threshold = shm_threshold
+        self._ctx = mp_context or multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._buffer = deque()
+        self._sender = None
+        self._process = None
+        self._closing = False
+        self._errors = self._ctx.Value("i", 0)
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def metrics(self):
+        """documents sent to the worker, events dropped, documents
+        waiting and failures of the callback
+        """
+        with self._cond:
+            return {
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "pending": len(self._buffer),
+                "errors": self._errors.value,
+            }
+
+    def __call__(self, name, doc):
+        with self._cond:
+            if self._closing:
+                return
+            if self._sender is None:
+                self._sender = threading.Thread(
+                    target=self._send, name="xpdacq-callback-sender"
+                )
+                self._sender.daemon = True
+                self._sender.start()
+            if (
+                name in _EVENTS
+                and self.drop is not None
+                and len(self._buffer) >= self.maxsize
+            ):
+                if self.drop == "newest" or not self._drop_oldest():
+                    self.dropped += 1
+                    return
+            self._buffer.append((name, doc))
+            self._cond.notify()
+
+    def _drop_oldest(self):
+        for i, (name, _) in enumerate(self._buffer):
+            if name in _EVENTS:
+                del self._buffer[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def _send(self):
+        doc_queue = self._ctx.Queue(maxsize=2)
+        self._process = self._ctx.Process(
+            target=_run_worker,
+            args=(self.factory, doc_queue, self._errors),
+            name="xpdacq-callback-worker",
+        )
+        self._process.daemon = True
+        try:
+            self._process.start()
+        except Exception as e:
+            self._give_up("couldn't be started ({})".format(e))
+            return
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if not self._buffer:
+                    break
+                name, doc = self._buffer.popleft()
+            item = _encode(name, doc, self.shm_threshold)
+            if not self._put(doc_queue, item):
+                _release(item)
+                self._drain(doc_queue)
+                self._give_up("is gone")
+                return
+            with self._cond:
+                self.sent += 1
+        self._put(doc_queue, None)
+        self._process.join()
+
+    def _give_up(self, reason):
+        print(
+            "WARNING: worker of {!r} {}, no more documents are sent "
+            "to it".format(self.factory, reason)
+        )
+        with self._cond:
+            self._closing = True
+            self._buffer.clear()
+
+    @staticmethod
+    def _drain(doc_queue):
+        """free the items left in the queue of a dead worker"""
+        while True:
+            try:
+                item = doc_queue.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if item is not None:
+                _release(item)
+
+    def _put(self, doc_queue, item):
+        while self._process.is_alive():
+            try:
+                doc_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close(self, wait=True):
+        """send the documents left to the worker and stop it
+
+        Parameters
+        ----------
+        wait : bool, optional
+            wait until the worker is done. default to True. Otherwise
+            the sender thread still joins the worker once done.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            sender = self._sender
+        if wait and sender is not None:
+            sender.join()
+
+
+class LiveTableRouter:
+    """
+    callback of the persistent live table worker
+
+    Prints a ``LiveTable`` per run, of the fields sent by a
+    ``LiveTableFeed`` ahead of the start document of the run.
+    """
+
+    def __init__(self):
+        self.fields = []
+        self._table = None
+
+    def __call__(self, name, doc):
+        if name == LIVE_TABLE_FIELDS:
+            self.fields = doc
+            return
+        if name == "start":
+            self._table = LiveTable(self.fields)
+        if self._table is not None:
+            self._table(name, doc)
+
+
+class LiveTableFeed:
+    """
+    subscription of a plan to the persistent live table worker
+
+    Forwards the documents of the plan to the worker returned by
+    ``worker_hook``, a ``ProcessCallback`` of ``LiveTableRouter`` that
+    xrun sets for the duration of its plans, with the fields of the
+    table ahead of each start document. Without a hook, e.g. with a
+    plain RunEngine, the table is printed from this process.
+
+    Parameters
+    ----------
+    fields : list
+        fields, or objects, to print, as for ``LiveTable``
+    """
+
+    # function returning the worker, looked up with the first document
+    worker_hook = None
+
+    def __init__(self, fields):
+        self.fields = get_obj_fields(fields)
+        self.worker = None
+        self._table = None
+
+    def __call__(self, name, doc):
+        if self.worker is None and self._table is None:
+            hook = LiveTableFeed.worker_hook
+            if hook is None:
+                self._table = LiveTable(self.fields)
+            else:
+                self.worker = hook()
+        if self._table is not None:
+            self._table(name, doc)
+            return
+        if name == "start":
+            self.worker(LIVE_TABLE_FIELDS, self.fields)
+        self.worker(name, doc)
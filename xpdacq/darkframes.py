@@ -0,0 +1,229 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import os
+import json
+import math
+import time
+import bisect
+
+from .glbl import glbl
+from .yamldict import _atomic_write
+
+DARK_LOG_FNAME = ".dark_frames.jsonl"
+
+
+class DarkFrameRegistry:
+    """
+    index of the dark frames listed in glbl['_dark_dict_list']
+
+    Dark frames are grouped by ``(acq_time, exposure bucket)``, a bucket
+    being ``acq_time`` wide, and kept sorted by timestamp within a group.
+    Finding the freshest dark frame matching a light exposure only looks
+    at the entries around the current time in a few groups.
+
+    glbl['_dark_dict_list'] stays the list of record: new dark frames are
+    appended to it in place, without rewriting glbl.yml, and to an
+    append-only log under glbl['config_base']. Assigning a new list to
+    glbl['_dark_dict_list'] resets the registry to it. When the registry
+    is first used in a session, dark frames from the log missing in the
+    reloaded glbl are put back.
+
+    Examples
+    --------
+    >>> dark_registry.best(acq_time=0.1, exposure=5, max_age=3600)
+    '0f1e...'
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._source = None
+        self._source_len = 0
+        self._seq = 0
+        self._restored = False
+
+    @property
+    def log_path(self):
+        return os.path.join(glbl["config_base"], DARK_LOG_FNAME)
+
+    @staticmethod
+    def _key(acq_time, exposure):
+        return acq_time, math.floor(exposure / acq_time)
+
+    def _index(self, dark_dict):
+        group = self._groups.setdefault(
+            self._key(dark_dict["acq_time"], dark_dict["exposure"]),
+            ([], []),
+        )
+        times, entries = group
+        ts = dark_dict["timestamp"]
+        # equal timestamps keep insertion order
+        i = bisect.bisect_right(times, ts)
+        times.insert(i, ts)
+        entries.insert(i, (self._seq, dark_dict))
+        self._seq += 1
+
+    def _read_log(self):
+        if not os.path.isfile(self.log_path):
+            return []
+        with open(self.log_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _sync(self):
+        """follow the list currently stored in glbl"""
+        dark_dict_list = glbl["_dark_dict_list"]
+        if dark_dict_list is None:
+            dark_dict_list = []
+            glbl["_dark_dict_list"] = dark_dict_list
+        if (
+            dark_dict_list is self._source
+            and len(dark_dict_list) == self._source_len
+        ):
+            return dark_dict_list
+        if not self._restored:
+            # first use: glbl.yml may miss the latest dark frames
+            self._restored = True
+            known = set(el.get("uid") for el in dark_dict_list)
+            dark_dict_list.extend(
+                el for el in self._read_log() if el.get("uid") not in known
+            )
+        elif dark_dict_list is not self._source:
+            # a new list has been assigned and written to glbl.yml
+            if os.path.isfile(self.log_path):
+                os.remove(self.log_path)
+        self._groups = {}
+        self._seq = 0
+        for el in dark_dict_list:
+            self._index(el)
+        self._source = dark_dict_list
+        self._source_len = len(dark_dict_list)
+        return dark_dict_list
+
+    def add(self, dark_dict, max_age=None):
+        """record a new dark frame
+
+        Parameters
+        ----------
+        dark_dict : dict
+            dictionary with 'acq_time', 'exposure', 'timestamp' and 'uid'
+            keys.
+        max_age : float, optional
+            dark frames older than ``max_age`` seconds are dropped.
+            default to glbl['dk_window'] minutes.
+        """
+        dark_dict_list = self._sync()
+        dark_dict_list.append(dark_dict)
+        self._source_len += 1
+        self._index(dark_dict)
+        os.makedirs(glbl["config_base"], exist_ok=True)
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(dark_dict) + "\n")
+        self.prune(max_age)
+
+    def prune(self, max_age=None, now=None):
+        """drop dark frames older than ``max_age`` seconds
+
+        Returns
+        -------
+        n_pruned : int
+            number of dark frames dropped
+        """
+        if max_age is None:
+            max_age = glbl["dk_window"] * 60
+        if now is None:
+            now = time.time()
+        dark_dict_list = self._sync()
+        oldest = now - max_age
+        n_pruned = 0
+        for times, entries in self._groups.values():
+            i = bisect.bisect_left(times, oldest)
+            n_pruned += i
+            del times[:i], entries[:i]
+        if n_pruned:
+            dark_dict_list[:] = [
+                el for el in dark_dict_list if el["timestamp"] >= oldest
+            ]
+            self._source_len = len(dark_dict_list)
+            kept = [el for el in self._read_log() if el["timestamp"] >= oldest]
+            _atomic_write(
+                self.log_path, "".join(json.dumps(el) + "\n" for el in kept)
+            )
+        return n_pruned
+
+    def best(self, acq_time, exposure, max_age, now=None):
+        """uid of the freshest dark frame matching a light exposure
+
+        A dark frame matches if it was taken with the same ``acq_time``,
+        its exposure is within ``acq_time`` of ``exposure`` and it is
+        less than ``max_age`` seconds away from ``now``.
+
+        Parameters
+        ----------
+        acq_time : float
+            acquisition time per frame of the detector, in seconds
+        exposure : float
+            total exposure of the light frame, in seconds
+        max_age : float
+            maximum age of the dark frame, in seconds
+        now : float, optional
+            reference time. default to the current time.
+
+        Returns
+        -------
+        uid : str or None
+            uid of the dark frame run, None if there is no match
+        """
+        self._sync()
+        if not acq_time or acq_time <= 0:
+            return None
+        if now is None:
+            now = time.time()
+        best = None  # ((time_diff, seq), uid)
+        # one more bucket on each side against rounding at the edges
+        lo = self._key(acq_time, exposure - acq_time)[1] - 1
+        hi = self._key(acq_time, exposure + acq_time)[1] + 1
+        for bucket in range(lo, hi + 1):
+            group = self._groups.get((acq_time, bucket))
+            if not group:
+                continue
+            found = _freshest_match(
+                group, acq_time, exposure, max_age, now
+            )
+            if found is not None and (best is None or found[0] < best[0]):
+                best = found
+        return None if best is None else best[1]
+
+
+def _freshest_match(group, acq_time, exposure, max_age, now):
+    """rank, (time_diff, seq), and uid of the dark frame of ``group``
+    closest to ``now`` matching ``exposure``, None if there is none
+    """
+    times, entries = group
+    p = bisect.bisect_left(times, now)
+    best = None
+    # walk away from now on both sides, stop at the first match
+    for indices in (range(p - 1, -1, -1), range(p, len(times))):
+        for i in indices:
+            time_diff = abs(times[i] - now)
+            if time_diff >= max_age or (
+                best is not None and time_diff > best[0][0]
+            ):
+                break
+            seq, el = entries[i]
+            if abs(el["exposure"] - exposure) < acq_time:
+                rank = (time_diff, seq)
+                if best is None or rank < best[0]:
+                    best = (rank, el.get("uid"))
+    return best
+
+
+dark_registry = DarkFrameRegistry()
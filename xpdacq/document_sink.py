@@ -0,0 +1,193 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import time
+import queue
+import threading
+
+from event_model import pack_event_page
+
+_CLOSE = object()
+
+
+def _pack_events(batch):
+    """documents of ``batch`` with consecutive events packed in pages"""
+    events = []
+    for name, doc in batch:
+        if name == "event" and (
+            not events or events[-1]["descriptor"] == doc["descriptor"]
+        ):
+            events.append(doc)
+            continue
+        if events:
+            yield _events_doc(events)
+        if name == "event":
+            events = [doc]
+        else:
+            events = []
+            yield name, doc
+    if events:
+        yield _events_doc(events)
+
+
+def _events_doc(events):
+    if len(events) == 1:
+        return "event", events[0]
+    return "event_page", pack_event_page(*events)
+
+
+class BufferedDocumentSink:
+    """
+    insert documents into a database from a background thread
+
+    Subscribed to a RunEngine, the sink puts each document in a queue
+    and returns at once; a writer thread takes the documents out of the
+    queue and inserts them. The events waiting in the queue are
+    inserted as event pages, ``batch_size`` documents at a time at
+    most. When the queue is full, the RunEngine waits for room in it.
+
+    The stop document of a run is only returned from once everything
+    up to it has been inserted, so a run is complete in the database
+    as soon as it is over. An error of the insertion is raised then.
+
+    Parameters
+    ----------
+    insert : callable
+        function inserting a document, called as ``insert(name, doc)``,
+        e.g. ``db.insert``.
+    maxsize : int, optional
+        largest number of documents waiting in the queue. default to
+        10000.
+    batch_size : int, optional
+        largest number of documents taken out of the queue at once.
+        default to 500.
+
+    Examples
+    --------
+    >>> xrun.install_document_sink(db.insert)
+    >>> xrun.document_sink.metrics
+    {'queue_depth': 0, 'max_queue_depth': 12, 'documents': 1042, ...}
+    """
+
+    def __init__(self, insert, maxsize=10000, batch_size=500):
+        self.insert = insert
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._error = None
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        with self._lock:
+            self._metrics = {
+                "max_queue_depth": 0,
+                "documents": 0,
+                "inserts": 0,
+                "errors": 0,
+                "write_time": 0.0,
+                "max_write_latency": 0.0,
+                "backpressure_time": 0.0,
+            }
+
+    @property
+    def metrics(self):
+        """queue depth, number of documents and inserts, write latency
+        and time the RunEngine waited for room in the queue, in seconds
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["mean_write_latency"] = (
+            metrics["write_time"] / metrics["inserts"]
+            if metrics["inserts"]
+            else 0.0
+        )
+        return metrics
+
+    def _ensure_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._write, name="xpdacq-document-sink"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __call__(self, name, doc):
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((name, doc))
+        except queue.Full:
+            t0 = time.time()
+            self._queue.put((name, doc))
+            with self._lock:
+                self._metrics["backpressure_time"] += time.time() - t0
+        with self._lock:
+            self._metrics["max_queue_depth"] = max(
+                self._metrics["max_queue_depth"], self._queue.qsize()
+            )
+        if name == "stop":
+            self.flush()
+
+    def _write(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _CLOSE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is _CLOSE
+            docs = batch[:-1] if closing else batch
+            for name, doc in _pack_events(docs):
+                self._insert(name, doc)
+            with self._lock:
+                self._metrics["documents"] += len(docs)
+            for _ in batch:
+                self._queue.task_done()
+            if closing:
+                return
+
+    def _insert(self, name, doc):
+        t0 = time.time()
+        try:
+            self.insert(name, doc)
+        except Exception as e:
+            with self._lock:
+                self._metrics["errors"] += 1
+                self._error = e
+        latency = time.time() - t0
+        with self._lock:
+            self._metrics["inserts"] += 1
+            self._metrics["write_time"] += latency
+            self._metrics["max_write_latency"] = max(
+                self._metrics["max_write_latency"], latency
+            )
+
+    def flush(self):
+        """wait until all documents queued are inserted
+
+        The last error of the insertion since the previous flush, if
+        any, is raised.
+        """
+        self._queue.join()
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """insert the documents queued and stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        self._thread = None
@@ -0,0 +1,250 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import json
+import itertools
+
+import numpy as np
+from bluesky.callbacks.core import CallbackBase
+
+TIMING_LOG_FNAME = ".tseries_timing.jsonl"
+
+
+def _interval_stats(times, period):
+    """statistics of the intervals between ``times`` against ``period``"""
+    intervals = np.diff(np.asarray(times, dtype=float))
+    return {
+        "n_intervals": len(intervals),
+        "period_mean": float(intervals.mean()),
+        "period_std": float(intervals.std()),
+        "period_min": float(intervals.min()),
+        "period_max": float(intervals.max()),
+        "jitter_max": float(np.abs(intervals - period).max()),
+    }
+
+
+class CadenceController(CallbackBase):
+    """keep the readings of a time series on a fixed cadence
+
+    Subscribed to the documents of the run, the controller tracks the
+    time of each event of ``stream_name`` in the last run started. The
+    delays it hands out to ``bluesky.plan_stubs.repeat`` are shortened
+    by how late the last reading came with respect to a schedule of one
+    reading every ``period`` seconds, anchored at the first reading.
+    Readout, shutter and message overheads then don't accumulate over
+    the run. A reading that comes more than one period late re-anchors
+    the schedule, so the missed readings are not made up back to back.
+
+    At the end of the run, the jitter statistics are appended to
+    ``log_path``, if any, as a json line along with the uid of the run.
+
+    Parameters
+    ----------
+    period : float
+        requested time between the start of two readings, in seconds
+    stream_name : str, optional
+        name of the event stream to track. default to 'primary'.
+    log_path : str, optional
+        path of the file to log the jitter statistics to. default to
+        no log.
+    """
+
+    def __init__(self, period, stream_name="primary", log_path=None):
+        super().__init__()
+        self.period = period
+        self.stream_name = stream_name
+        self.log_path = log_path
+        self._run_uid = None
+        self._reset()
+
+    def _reset(self):
+        self.times = []
+        self.slips = 0
+        self._descriptors = set()
+        self._anchor = None
+
+    def start(self, doc):
+        # only the last run counts, not the dark run coming before
+        self._reset()
+        self._run_uid = doc["uid"]
+
+    def stop(self, doc):
+        if doc["run_start"] == self._run_uid:
+            self._log_stats()
+
+    def descriptor(self, doc):
+        if doc.get("name") == self.stream_name:
+            self._descriptors.add(doc["uid"])
+
+    def event(self, doc):
+        # event pages are unpacked by CallbackBase
+        if doc["descriptor"] in self._descriptors:
+            self._tick(doc["time"])
+
+    def _tick(self, t):
+        n = len(self.times)
+        if self._anchor is None or self._lateness(t, n) > self.period:
+            if self._anchor is not None:
+                self.slips += 1
+            self._anchor = (t, n)
+        self.times.append(t)
+
+    def _lateness(self, t, n):
+        """seconds reading ``n``, at time ``t``, comes after its scheduled
+        time
+        """
+        t0, i0 = self._anchor
+        return t - (t0 + (n - i0) * self.period)
+
+    @property
+    def lateness(self):
+        """seconds the last reading came after its scheduled time"""
+        if not self.times:
+            return 0.0
+        return self._lateness(self.times[-1], len(self.times) - 1)
+
+    def delays(self, num=None):
+        """iterator over the delays to pass to ``bp.count``
+
+        Parameters
+        ----------
+        num : int, optional
+            number of readings. There is no delay after the last one.
+            default to an endless iterator.
+        """
+        steps = itertools.count() if num is None else range(num - 1)
+        for _ in steps:
+            yield max(0.0, self.period - self.lateness)
+
+    def stats(self):
+        """jitter statistics of the readings so far, None if less than two"""
+        if len(self.times) < 2:
+            return None
+        stats = _interval_stats(self.times, self.period)
+        stats["requested_period"] = self.period
+        stats["slips"] = self.slips
+        return stats
+
+    def _log_stats(self):
+        stats = self.stats()
+        if self.log_path is None or stats is None:
+            return
+        stats["uid"] = self._run_uid
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(stats) + "\n")
+
+
+def _documents(run):
+    documents = getattr(run, "documents", None)
+    if documents is not None:
+        return documents(fill=False)
+    return iter(run)
+
+
+def _reading_times(run, stream_name):
+    """start and stop documents of a run, and the sorted times of the
+    events of ``stream_name``
+    """
+    start = stop = None
+    descriptors = set()
+    times = []
+    for name, doc in _documents(run):
+        if name == "start":
+            start = doc
+        elif name == "stop":
+            stop = doc
+        elif name == "descriptor" and doc.get("name") == stream_name:
+            descriptors.add(doc["uid"])
+        elif name == "event" and doc["descriptor"] in descriptors:
+            times.append(doc["time"])
+        elif name == "event_page" and doc["descriptor"] in descriptors:
+            times.extend(doc["time"])
+    if start is None:
+        raise ValueError("no start document in run")
+    return start, stop, sorted(times)
+
+
+def _timing_report(start, stop, times):
+    report = {"uid": start["uid"], "num_readings": len(times)}
+    if not times:
+        return report
+    report["startup"] = times[0] - start["time"]
+    if stop is not None:
+        report["duration"] = stop["time"] - start["time"]
+        report["teardown"] = stop["time"] - times[-1]
+    exposure = start.get("sp_computed_exposure")
+    delay = start.get("sp_requested_delay", 0)
+    period = None
+    if exposure is not None:
+        period = max(exposure, delay or 0)
+        report["exposure"] = exposure
+        report["requested_period"] = period
+        report["idle"] = period - exposure
+    if len(times) > 1:
+        report.update(_interval_stats(times, period or 0))
+        if period is None:
+            del report["jitter_max"]
+        else:
+            report["overhead"] = report["period_mean"] - period
+    return report
+
+
+def analyze_run_timing(run, stream_name="primary"):
+    """report the timing of the readings of a finished run
+
+    Parameters
+    ----------
+    run : Header or iterable
+        databroker header of the run, or the (name, doc) pairs of its
+        documents.
+    stream_name : str, optional
+        name of the event stream to analyze. default to 'primary'.
+
+    Returns
+    -------
+    report : dict
+        achieved period and jitter of the readings, along with the time
+        spent before the first reading ('startup'), after the last one
+        ('teardown') and, for runs of xpdAcq scan plans, the exposure,
+        the requested idle time and the remaining overhead per reading,
+        all in seconds.
+    """
+    start, stop, times = _reading_times(run, stream_name)
+    report = _timing_report(start, stop, times)
+    print(_format_report(report))
+    return report
+
+
+def _format_report(report):
+    lines = [
+        "INFO: run {} took {} readings".format(
+            report["uid"], report["num_readings"]
+        )
+    ]
+    if "period_mean" in report:
+        lines.append(
+            "INFO: achieved period {:.4f}s (std {:.4f}s)".format(
+                report["period_mean"], report["period_std"]
+            )
+        )
+    if "overhead" in report:
+        lines.append(
+            "INFO: requested period {:.4f}s = exposure {:.4f}s + idle "
+            "{:.4f}s, overhead {:.4f}s per reading, max jitter {:.4f}s".format(
+                report["requested_period"],
+                report["exposure"],
+                report["idle"],
+                report["overhead"],
+                report["jitter_max"],
+            )
+        )
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+"""yaml loading and dumping used by every xpdAcq yaml file
+
+The loader and dumper are built on the safe libyaml classes when PyYAML
+is compiled against libyaml, and on the pure-Python safe classes
+otherwise. On top of the standard yaml types they know about the few
+types xpdAcq stores:
+
+* tuples, e.g. ``sp_args`` of a ScanPlan, as ``!!python/tuple``
+* numpy scalars and arrays, dumped as plain numbers and lists
+* plan helpers, e.g. ``per_step=shutter_step``, as ``!!python/name``
+
+Files written by ``yaml.dump`` in earlier versions may contain numpy
+objects tagged with ``!!python/object/apply``; only these numpy tags are
+constructed, any other python object tag raises a ``ConstructorError``.
+"""
+import types
+import importlib
+
+import yaml
+import numpy as np
+from yaml.constructor import ConstructorError
+from yaml.nodes import SequenceNode
+
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+_TUPLE_TAG = "tag:yaml.org,2002:python/tuple"
+_NAME_TAG = "tag:yaml.org,2002:python/name:"
+_APPLY_TAG = "tag:yaml.org,2002:python/object/apply:"
+
+# python/name objects that can be loaded
+_TRUSTED_NAME_PACKAGES = ("xpdacq", "bluesky")
+_TRUSTED_NAMES = ("numpy.ndarray",)
+
+
+class Loader(_SafeLoader):
+    """safe yaml loader knowing about the types stored by xpdAcq"""
+
+
+class Dumper(_SafeDumper):
+    """safe yaml dumper knowing about the types stored by xpdAcq"""
+
+
+def _construct_tuple(loader, node):
+    return tuple(loader.construct_sequence(node, deep=True))
+
+
+def _construct_name(loader, suffix, node):
+    module_name, _, name = suffix.rpartition(".")
+    if not (
+        suffix in _TRUSTED_NAMES
+        or module_name.split(".")[0] in _TRUSTED_NAME_PACKAGES
+    ):
+        raise ConstructorError(
+            None,
+            None,
+            "refusing to load python object {}".format(suffix),
+            node.start_mark,
+        )
+    try:
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError) as e:
+        raise ConstructorError(
+            None, None, "can't find {}: {}".format(suffix, e), node.start_mark
+        )
+
+
+def _numpy_dtype(args, state):
+    dtype = np.dtype(args[0])
+    if state is not None and len(state) > 1 and state[1] in "<>":
+        dtype = dtype.newbyteorder(state[1])
+    return dtype
+
+
+def _numpy_scalar(args, state):
+    dtype, raw = args
+    return np.frombuffer(raw, dtype=dtype)[0]
+
+
+def _numpy_array(args, state):
+    _, shape, dtype, is_fortran, raw = state
+    order = "F" if is_fortran else "C"
+    return np.frombuffer(raw, dtype=dtype).reshape(shape, order=order).copy()
+
+
+# numpy pickle helpers written by yaml.dump, for both numpy.core and
+# numpy._core (numpy >= 2)
+_LEGACY_NUMPY_APPLY = {"numpy.dtype": _numpy_dtype}
+for _core in ("numpy.core", "numpy._core"):
+    _LEGACY_NUMPY_APPLY[_core + ".multiarray.scalar"] = _numpy_scalar
+    _LEGACY_NUMPY_APPLY[_core + ".multiarray._reconstruct"] = _numpy_array
+
+
+def _construct_legacy_numpy(loader, suffix, node):
+    if suffix not in _LEGACY_NUMPY_APPLY:
+        raise ConstructorError(
+            None,
+            None,
+            "refusing to load python object {}".format(suffix),
+            node.start_mark,
+        )
+    if isinstance(node, SequenceNode):
+        args = loader.construct_sequence(node, deep=True)
+        state = None
+    else:
+        value = loader.construct_mapping(node, deep=True)
+        args = value.get("args", [])
+        state = value.get("state")
+    return _LEGACY_NUMPY_APPLY[suffix](args, state)
+
+
+def _represent_tuple(dumper, data):
+    return dumper.represent_sequence(_TUPLE_TAG, data)
+
+
+def _represent_numpy_scalar(dumper, data):
+    return dumper.represent_data(data.item())
+
+
+def _represent_numpy_array(dumper, data):
+    return dumper.represent_data(data.tolist())
+
+
+def _represent_function(dumper, data):
+    name = "{}.{}".format(data.__module__, data.__name__)
+    return dumper.represent_scalar(_NAME_TAG + name, "")
+
+
+Loader.add_constructor(_TUPLE_TAG, _construct_tuple)
+Loader.add_multi_constructor(_NAME_TAG, _construct_name)
+Loader.add_multi_constructor(_APPLY_TAG, _construct_legacy_numpy)
+Dumper.add_representer(tuple, _represent_tuple)
+Dumper.add_multi_representer(np.generic, _represent_numpy_scalar)
+Dumper.add_representer(np.ndarray, _represent_numpy_array)
+Dumper.add_representer(types.FunctionType, _represent_function)
+
+
+def yaml_load(stream):
+    """load a yaml document from a string or a file
+
+    Parameters
+    ----------
+    stream : str or file
+        yaml text or file opened for reading
+
+    Returns
+    -------
+    data : object
+        the loaded document
+    """
+    return yaml.load(stream, Loader=Loader)
+
+
+def yaml_dump(data, stream=None, **kwargs):
+    """dump ``data`` as yaml
+
+    Parameters
+    ----------
+    data : object
+        object to be dumped
+    stream : file, optional
+        file opened for writing. If None, the yaml text is returned.
+    kwargs :
+        keyword arguments passed to ``yaml.dump``, e.g.
+        ``default_flow_style``.
+
+    Returns
+    -------
+    text : str or None
+        the yaml text if ``stream`` is None
+    """
+    return yaml.dump(data, stream, Dumper=Dumper, **kwargs)
@@ -0,0 +1,264 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import bluesky.plan_stubs as bps
+from bluesky.utils import short_uid
+from ophyd import Device, Component as Cpt, Signal
+from ophyd.status import Status
+
+
+class SettleMonitor(Device):
+    """
+    tell when the readback of a temperature controller has settled
+
+    Setting the monitor to a setpoint subscribes to the readback of
+    ``controller`` and returns a status finished once the readbacks of
+    the last ``window`` seconds have a mean within ``tolerance`` of the
+    setpoint, a slope below ``max_slope`` and a standard deviation
+    below ``max_std``. The status is finished anyway after ``max_wait``
+    seconds. The readback is held between two updates, so a readback
+    that doesn't change at all settles after ``window`` seconds.
+
+    Reading the monitor gives the time it took to settle, as
+    ``<controller>_settle_time``, and whether it settled or gave up,
+    as ``<controller>_settled``.
+
+    Parameters
+    ----------
+    controller : ophyd.Device
+        temperature controller to monitor
+    tolerance : float, optional
+        largest difference between the mean readback and the setpoint.
+        default to 1 degree.
+    max_slope : float, optional
+        largest drift of the readback, in degrees per minute. default
+        to 0.5.
+    max_std : float, optional
+        largest standard deviation of the readback. default to 0.2.
+    window : float, optional
+        length of the rolling window, in seconds. default to 10.
+    max_wait : float, optional
+        longest time to wait for the readback to settle, in seconds.
+        default to 600.
+    """
+
+    settle_time = Cpt(Signal, value=0.0, kind="hinted")
+    settled = Cpt(Signal, value=True)
+
+    def __init__(
+        self,
+        controller,
+        *,
+        tolerance=1.0,
+        max_slope=0.5,
+        max_std=0.2,
+        window=10.0,
+        max_wait=600.0,
+        **kwargs
+    ):
+        kwargs.setdefault("name", controller.name)
+        super().__init__(**kwargs)
+        self.controller = controller
+        self.tolerance = tolerance
+        self.max_slope = max_slope
+        self.max_std = max_std
+        self.window = window
+        self.max_wait = max_wait
+        self._lock = threading.RLock()
+        self._samples = deque()
+        self._status = None
+        self._setpoint = None
+        self._t_set = None
+        self._cid = None
+
+    @property
+    def criteria(self):
+        """the settle criteria, to save in the metadata"""
+        return {
+            "tolerance": self.tolerance,
+            "max_slope": self.max_slope,
+            "max_std": self.max_std,
+            "window": self.window,
+            "max_wait": self.max_wait,
+        }
+
+    def _on_readback(self, value=None, timestamp=None, **kwargs):
+        with self._lock:
+            self._samples.append((time.time(), value))
+        self._check()
+
+    def _held_samples(self, now):
+        """readbacks of the window, the last one held until now"""
+        with self._lock:
+            while len(self._samples) > 1 and self._samples[1][0] <= (
+                now - self.window
+            ):
+                self._samples.popleft()
+            samples = list(self._samples)
+        samples.append((now, samples[-1][1]))
+        return samples
+
+    def is_settled(self, now=None):
+        """whether the readbacks of the window meet all criteria"""
+        if now is None:
+            now = time.time()
+        if now - self._t_set < self.window:
+            return False
+        t, values = np.asarray(self._held_samples(now), dtype=float).T
+        t = np.clip(t, now - self.window, None)
+        if abs(values.mean() - self._setpoint) > self.tolerance:
+            return False
+        if values.std() > self.max_std:
+            return False
+        if np.ptp(t) > 0 and np.ptp(values) > 0:
+            slope = np.polyfit(t - now, values, 1)[0] * 60
+            if abs(slope) > self.max_slope:
+                return False
+        return True
+
+    def _check(self):
+        with self._lock:
+            status = self._status
+            if status is None or status.done:
+                return
+            now = time.time()
+            if self.is_settled(now):
+                self._finish(now, True)
+            elif now - self._t_set >= self.max_wait:
+                print(
+                    "WARNING: {} didn't settle at {} within {} s, "
+                    "going on".format(
+                        self.controller.name, self._setpoint, self.max_wait
+                    )
+                )
+                self._finish(now, False)
+
+    def _finish(self, now, settled):
+        self.settle_time.put(now - self._t_set)
+        self.settled.put(settled)
+        self._unsubscribe()
+        self._status.set_finished()
+
+    def _unsubscribe(self):
+        if self._cid is not None:
+            self.controller.unsubscribe(self._cid)
+            self._cid = None
+
+    def _poll(self, status):
+        # readbacks only come on change, check regularly as well
+        poll_period = min(self.window / 10, 1.0)
+        while not status.done:
+            time.sleep(poll_period)
+            self._check()
+
+    def set(self, setpoint):
+        self.stop()
+        self._setpoint = setpoint
+        self._t_set = time.time()
+        with self._lock:
+            self._samples = deque([(self._t_set, self.controller.position)])
+        self._status = status = Status(obj=self)
+        self._cid = self.controller.subscribe(self._on_readback, run=False)
+        poll = threading.Thread(target=self._poll, args=(status,))
+        poll.daemon = True
+        poll.start()
+        return status
+
+    def stop(self, *, success=False):
+        """stop waiting, the status fails if it wasn't finished"""
+        self._unsubscribe()
+        if self._status is not None and not self._status.done:
+            self._status.set_exception(
+                RuntimeError(
+                    "settle detection of {} stopped".format(self.name)
+                )
+            )
+
+
+def settle_stub(monitor, setpoint, *, group=None, wait=True):
+    """
+    move the controller of ``monitor`` and wait until it settles
+
+    The settle time, measured from the move, can then be read from
+    ``monitor``.
+
+    Parameters
+    ----------
+    monitor : SettleMonitor
+        monitor of the temperature controller
+    setpoint : float
+        temperature to move to
+    group : str, optional
+        identifier used by 'wait'. default to a new one.
+    wait : bool, optional
+        wait until it settles. If False, the caller waits for ``group``
+        later on. default to True.
+    """
+    if group is None:
+        group = short_uid("settle")
+    yield from bps.abs_set(monitor.controller, setpoint, group=group)
+    yield from bps.abs_set(monitor, setpoint, group=group)
+    if wait:
+        yield from bps.wait(group=group)
+
+
+def settle_step(monitor, per_step=None):
+    """
+    per_step of a scan waiting for the temperature to settle
+
+    The step moves the temperature controller, waits until it settles
+    then hands over to ``per_step`` and records the settle time along
+    with the detectors.
+
+    Parameters
+    ----------
+    monitor : SettleMonitor
+        monitor of the temperature controller scanned
+    per_step : callable, optional
+        per_step to run once settled. default to
+        ``bluesky.plan_stubs.one_1d_step``.
+    """
+    if per_step is None:
+        per_step = bps.one_1d_step
+
+    def settle_then_step(detectors, motor, step):
+        yield from bps.checkpoint()
+        yield from settle_stub(monitor, step)
+        return (yield from per_step(list(detectors) + [monitor], motor, step))
+
+    return settle_then_step
+
+
+def make_settle_monitor(controller, settle):
+    """the SettleMonitor asked for by the ``settle`` option of a plan
+
+    Parameters
+    ----------
+    controller : ophyd.Device
+        temperature controller
+    settle : bool, dict or SettleMonitor
+        True for the default criteria, a dict of the criteria to pass
+        to SettleMonitor, or the monitor to use. None or False for no
+        monitor.
+    """
+    if settle is None or settle is False:
+        return None
+    if isinstance(settle, SettleMonitor):
+        return settle
+    if settle is True:
+        settle = {}
+    return SettleMonitor(controller, **settle)
@@ -0,0 +1,180 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import os
+import time
+import threading
+
+import numpy as np
+from ophyd.status import wait as status_wait
+from xpdconf.conf import XPD_SHUTTER_CONF
+
+from .glbl import glbl
+from .xpdacq_conf import xpd_configuration
+from .serialization import yaml_load, yaml_dump
+from .yamldict import _atomic_write
+from .tools import xpdAcqException
+
+SHUTTER_LATENCY_FNAME = "shutter_latency.yml"
+
+
+def _latency_fpath():
+    return os.path.join(glbl["config_base"], SHUTTER_LATENCY_FNAME)
+
+
+def _stats(values):
+    values = np.asarray(values, dtype=float)
+    return {
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "max": float(values.max()),
+    }
+
+
+def _time_move(shutter, value, timeout):
+    """seconds until the set status and the readback report ``value``"""
+    target = value
+    arrived = threading.Event()
+    arrival = []
+
+    def on_readback(value=None, **kwargs):
+        if value == target and not arrived.is_set():
+            arrival.append(time.monotonic())
+            arrived.set()
+
+    cid = shutter.subscribe(on_readback, run=False)
+    try:
+        t0 = time.monotonic()
+        status_wait(shutter.set(value), timeout=timeout)
+        t_status = time.monotonic() - t0
+        if not arrived.wait(timeout):
+            raise xpdAcqException(
+                "WARNING: the readback of shutter {} didn't reach {} "
+                "within {}s".format(shutter.name, value, timeout)
+            )
+    finally:
+        shutter.unsubscribe(cid)
+    t_readback = arrival[0] - t0
+    return t_status, max(t_status, t_readback)
+
+
+def calibrate_shutter_latency(
+    n_cycles=5, margin=0.5, min_settle=0.05, timeout=10
+):
+    """measure how fast the shutter opens and closes
+
+    The shutter, xpd_configuration['shutter'], is opened and closed
+    ``n_cycles`` times. For each move, the time for the set to complete
+    and the time for the readback to reach the new position are
+    measured. The statistics are saved in config_base, and from then on
+    the shutter stubs wait, after opening, the longest time the
+    readback took to report the shutter open, increased by ``margin``,
+    instead of glbl['shutter_sleep']. The settle time is never shorter
+    than ``min_settle``, as the readback may report the shutter open
+    before the beam is steady, and the set status of many shutters
+    only completes on the readback anyway.
+
+    Parameters
+    ----------
+    n_cycles : int, optional
+        number of open-close cycles. default to 5.
+    margin : float, optional
+        relative safety margin on the settle time. default to 0.5.
+    min_settle : float, optional
+        shortest settle time, in seconds. default to 0.05.
+    timeout : float, optional
+        maximum time for one move, in seconds. default to 10.
+
+    Returns
+    -------
+    record : dict
+        latency statistics of the shutter, in seconds
+    """
+    if n_cycles < 1:
+        raise ValueError("n_cycles must be at least 1")
+    shutter = xpd_configuration["shutter"]
+    times = {"open": [], "close": []}
+    print("INFO: measuring latency of shutter {}...".format(shutter.name))
+    for _ in range(n_cycles):
+        for state in ("open", "close"):
+            times[state].append(
+                _time_move(shutter, XPD_SHUTTER_CONF[state], timeout)
+            )
+    record = {
+        "timestamp": time.time(),
+        "n_cycles": n_cycles,
+        "margin": margin,
+        "min_settle": min_settle,
+    }
+    for state, state_times in times.items():
+        status_times, readback_times = zip(*state_times)
+        record[state] = {
+            "status": _stats(status_times),
+            "readback": _stats(readback_times),
+            "settle_time": max(
+                min_settle, max(readback_times) * (1 + margin)
+            ),
+        }
+    record["settle_time"] = record["open"]["settle_time"]
+    records = load_shutter_latency()
+    records[shutter.name] = record
+    # read on every shutter opening, never leave a truncated file
+    _atomic_write(
+        _latency_fpath(), yaml_dump(records, default_flow_style=False)
+    )
+    print(
+        "INFO: shutter {} opens in {:.3f}s on average, settle time after "
+        "opening is now {:.3f}s".format(
+            shutter.name,
+            record["open"]["readback"]["mean"],
+            record["settle_time"],
+        )
+    )
+    return record
+
+
+# (path, mtime, size) and contents of the last latency file read
+_latency_cache = [None, {}]
+
+
+def load_shutter_latency():
+    """latency statistics of the calibrated shutters, by shutter name"""
+    fpath = _latency_fpath()
+    try:
+        st = os.stat(fpath)
+    except FileNotFoundError:
+        return {}
+    key = (fpath, st.st_mtime_ns, st.st_size)
+    if key != _latency_cache[0]:
+        with open(fpath) as f:
+            _latency_cache[:] = [key, yaml_load(f) or {}]
+    return dict(_latency_cache[1])
+
+
+def clear_shutter_latency():
+    """go back to glbl['shutter_sleep'] as settle time for all shutters"""
+    fpath = _latency_fpath()
+    if os.path.isfile(fpath):
+        os.remove(fpath)
+
+
+def shutter_settle_time():
+    """seconds to wait after opening xpd_configuration['shutter']
+
+    The settle time measured by ``calibrate_shutter_latency`` for this
+    shutter if any, glbl['shutter_sleep'] otherwise.
+    """
+    name = getattr(xpd_configuration["shutter"], "name", None)
+    record = load_shutter_latency().get(name)
+    if record is None:
+        return glbl["shutter_sleep"]
+    return record["settle_time"]
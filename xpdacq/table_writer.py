@@ -0,0 +1,109 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import os
+import csv
+
+from bluesky.callbacks.core import CallbackBase
+
+
+class SampleTableWriter(CallbackBase):
+    """
+    append the scalar readings of runs to a csv file as they come
+
+    Each event of ``stream_name`` becomes a row with the uid of its run,
+    the time of the event, and the value and timestamp of every scalar
+    reading, e.g. temperature, motor position and ring current. Images
+    and other array or external readings are left out. The columns are
+    set by the first run written to the file; later runs with readings
+    the file doesn't have lose them.
+
+    Rows are written every ``flush_every`` events and at the end of
+    each run, even if it was aborted, so what was measured is on disk
+    whatever happens to the rest of the plan.
+
+    Parameters
+    ----------
+    fpath : str
+        path of the csv file, appended to if it already exists
+    stream_name : str, optional
+        name of the event stream to write. default to 'primary'.
+    flush_every : int, optional
+        number of rows kept in memory before writing them. default to
+        100.
+    """
+
+    def __init__(self, fpath, stream_name="primary", flush_every=100):
+        super().__init__()
+        self.fpath = fpath
+        self.stream_name = stream_name
+        self.flush_every = flush_every
+        self._run_uid = None
+        self._keys = {}
+        self._columns = None
+        self._rows = []
+
+    def start(self, doc):
+        self._run_uid = doc["uid"]
+        self._keys = {}
+
+    def descriptor(self, doc):
+        if doc.get("name") != self.stream_name:
+            return
+        self._keys[doc["uid"]] = sorted(
+            key
+            for key, data_key in doc["data_keys"].items()
+            if not data_key.get("shape") and "external" not in data_key
+        )
+
+    def event(self, doc):
+        keys = self._keys.get(doc["descriptor"])
+        if keys is None:
+            return
+        row = {"uid": self._run_uid, "time": doc["time"]}
+        for key in keys:
+            row[key] = doc["data"][key]
+            row[key + "_timestamp"] = doc["timestamps"][key]
+        if self._columns is None:
+            self._columns = self._existing_columns() or (
+                ["uid", "time"]
+                + [c for key in keys for c in (key, key + "_timestamp")]
+            )
+        self._rows.append(row)
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def stop(self, doc):
+        self.flush()
+
+    def _existing_columns(self):
+        try:
+            with open(self.fpath, newline="") as f:
+                return next(csv.reader(f), None)
+        except FileNotFoundError:
+            return None
+
+    def flush(self):
+        """write the rows kept in memory"""
+        if not self._rows:
+            return
+        new = (
+            not os.path.isfile(self.fpath) or os.path.getsize(self.fpath) == 0
+        )
+        with open(self.fpath, "a", newline="") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=self._columns, extrasaction="ignore"
+            )
+            if new:
+                writer.writeheader()
+            writer.writerows(self._rows)
+        self._rows = []
@@ -122,6 +122,30 @@ def fresh_xrun(bt, db):
     loop.run_until_complete(ev.wait())
 
 
+@pytest.fixture(scope="function")
+def user_dirs():
+    # user folders of glbl, removed with the home folder afterwards
+    for d in glbl_dict["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    yield glbl_dict
+    shutil.rmtree(glbl_dict["home"], ignore_errors=True)
+
+
+@pytest.fixture(scope="function")
+def sim_devices(user_dirs):
+    # simulated devices the xrun tests run with
+    from xpdacq.simulation import pe1c, cs700, shctl1, db, fb
+
+    configure_device(
+        db=db,
+        shutter=shctl1,
+        area_det=pe1c,
+        temp_controller=cs700,
+        filter_bank=fb,
+    )
+    yield xpd_configuration
+
+
 @pytest.fixture(scope="function")
 def exp_hash_uid(bt, fresh_xrun, glbl):
     fresh_xrun.beamtime = bt
@@ -140,3 +164,15 @@ def home_dir():
         if os.path.isdir(el):
             print("flush {}".format(el))
             shutil.rmtree(el)
+
+
+@pytest.fixture(scope="function")
+def tmp_cwd(tmpdir, monkeypatch, request):
+    # worker processes are spawned from the current directory, which
+    # tests run before may have removed
+    try:
+        os.getcwd()
+    except FileNotFoundError:
+        os.chdir(str(request.config.rootdir))
+    monkeypatch.chdir(tmpdir)
+    yield tmpdir
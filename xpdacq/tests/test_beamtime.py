@@ -6,7 +6,13 @@ import unittest
 from xpdacq.glbl import glbl
 from pkg_resources import resource_filename as rs_fn
 from xpdacq.xpdacq_conf import configure_device
-from xpdacq.beamtimeSetup import _start_beamtime, _end_beamtime, load_beamtime
+from xpdacq.beamtimeSetup import (
+    _start_beamtime,
+    _end_beamtime,
+    load_beamtime,
+    migrate_beamtime_yaml,
+)
+from xpdacq.yamldict import flush_engine
 from xpdacq.beamtime import (
     _summarize,
     ScanPlan,
@@ -111,7 +117,8 @@ class BeamtimeObjTest(unittest.TestCase):
         self.assertEqual(len(reload_dict), 2)  # bt and sp
         ## contents of chainmap
         self.assertEqual(reload_dict[0], sp.maps[0])
-        self.assertEqual(reload_dict[1], sp.maps[1])
+        # beamtime is referred to by uid
+        self.assertEqual(reload_dict[1], {"bt_uid": self.bt["bt_uid"]})
 
         # equality
         reload_scanplan = ScanPlan.from_yaml(sp.to_yaml())
@@ -253,6 +260,22 @@ class BeamtimeObjTest(unittest.TestCase):
                 reloaded_sa = el.from_yaml(f)
             self.assertTrue("new_bt_field" in reloaded_sa)
 
+    def test_beamtime_change_single_write(self):
+        """Editing a Beamtime doesn't rewrite its Samples and ScanPlans"""
+        sa_dict = {"sample_name": "Ni", "sample_composition": {"Ni": 1}}
+        sa = Sample(self.bt, sa_dict)
+        with open(sa.filepath, "r") as f:
+            sa_yaml = f.read()
+        before = flush_engine.write_count
+        self.bt["new_bt_field"] = "test"
+        self.assertEqual(flush_engine.write_count - before, 1)
+        with open(sa.filepath, "r") as f:
+            self.assertEqual(f.read(), sa_yaml)
+        # the link is rebuilt from the uid
+        with open(sa.filepath, "r") as f:
+            reloaded_sa = Sample.from_yaml(f)
+        self.assertEqual(reloaded_sa["new_bt_field"], "test")
+
     def test_chaining(self):
         """All contents of Beamtime and Experiment should propagate into
         Sample."""
@@ -293,3 +316,62 @@ class BeamtimeObjTest(unittest.TestCase):
         glbl["frame_acq_time"] = 0.5
         self.assertRaises(ValueError, lambda: xrun({}, ScanPlan(bt, ct, 0.2)))
         glbl["frame_acq_time"] = 0.1  # reset after test
+
+
+def test_migrate_beamtime_yaml(tmpdir):
+    bt_md = {"bt_piLast": "Simon", "bt_safN": "123", "bt_uid": "abcd1234"}
+    for sub_dir, map1 in [
+        ("samples", {"sample_name": "Ni", "sa_uid": "1234abcd"}),
+        ("scanplans", {"sp_plan_name": "ct", "sp_args": [1]}),
+    ]:
+        tmpdir.mkdir(sub_dir).join("obj.yml").write(yaml.dump([map1, bt_md]))
+    migrated = migrate_beamtime_yaml(str(tmpdir))
+    assert len(migrated) == 2
+    for fpath in migrated:
+        with open(fpath, "r") as f:
+            _, bt_link = yaml.unsafe_load(f)
+        assert bt_link == {"bt_uid": "abcd1234"}
+    # second pass is a no-op
+    assert migrate_beamtime_yaml(str(tmpdir)) == []
+
+
+def test_load_beamtime_lazy():
+    for d in glbl["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    try:
+        bt = Beamtime("Simon", 123, [], wavelength=0.1828)
+        with bt.deferred_flush():
+            for name in ["Ni", "TiO2", "kapton", "Au"]:
+                Sample(bt, {"sample_name": name, "sample_composition": {}})
+        # Au is not recorded in the order file -> listed last
+        with open(bt._sample_order.filepath, "w") as f:
+            yaml.dump({0: "kapton.yml", 1: "Ni.yml", 2: "TiO2.yml"}, f)
+        before = flush_engine.write_count
+        bt2 = load_beamtime(lazy=True)
+        # nothing is rewritten and nothing is built yet
+        assert flush_engine.write_count == before
+        assert list(bt2.samples) == ["kapton", "Ni", "TiO2", "Au"]
+        assert not any(bt2.samples.is_loaded(k) for k in bt2.samples)
+        sa = bt2.samples.by_index(1)
+        assert sa["sample_name"] == "Ni"
+        assert sa is bt2.samples["Ni"]
+        assert [bt2.samples.is_loaded(k) for k in bt2.samples] == [
+            False,
+            True,
+            False,
+            False,
+        ]
+        assert bt2.samples.get_md(-1) == dict(bt.samples["Au"])
+        assert dict(bt2.samples.items()) == dict(bt.samples.items())
+        assert flush_engine.write_count == before
+        bt3 = load_beamtime()
+        assert all(bt3.samples.is_loaded(k) for k in bt3.samples)
+        assert list(bt3.samples) == list(bt2.samples)
+        # only the order file is brought up to date
+        assert flush_engine.write_count == before + 1
+        with open(bt._sample_order.filepath) as f:
+            assert yaml.unsafe_load(f)[3] == "Au.yml"
+    finally:
+        shutil.rmtree(glbl["home"])
+        if os.path.isdir(glbl["xpdconfig"]):
+            shutil.rmtree(glbl["xpdconfig"])
@@ -0,0 +1,62 @@
+import os
+import json
+import time
+import uuid
+import shutil
+
+from xpdacq.glbl import glbl
+from xpdacq.darkframes import DarkFrameRegistry
+
+
+def _dark(exposure, timestamp, acq_time=0.1):
+    return {
+        "uid": str(uuid.uuid4()),
+        "acq_time": acq_time,
+        "exposure": exposure,
+        "timestamp": timestamp,
+    }
+
+
+def test_dark_registry():
+    for d in glbl["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    try:
+        now = time.time()
+        registry = DarkFrameRegistry()
+        darks = [_dark((i + 1) * 0.1, now) for i in range(5)]
+        glbl["_dark_dict_list"] = darks
+        # same timestamp -> first one in the list wins
+        assert registry.best(0.1, 0.5, 600) == darks[3]["uid"]
+        # acq_time must match
+        assert registry.best(0.2, 0.5, 600) is None
+        assert registry.best(0.1, 5, 600) is None
+
+        darks = [_dark(0.5, now - (i + 1) * 60) for i in range(5)]
+        glbl["_dark_dict_list"] = darks
+        assert registry.best(0.1, 0.5, 3600) == darks[0]["uid"]
+        assert registry.best(0.1, 0.5, 6) is None
+        assert registry.best(0.1, 0.5, 90) == darks[0]["uid"]
+
+        # new darks are appended in place and logged, old ones are pruned
+        fresh = _dark(0.5, now)
+        registry.add(fresh, max_age=150)
+        assert glbl["_dark_dict_list"] is darks
+        assert [el["uid"] for el in darks] == [
+            el["uid"] for el in (darks[0], darks[1], fresh)
+        ]
+        assert registry.best(0.1, 0.5, 3600) == fresh["uid"]
+        assert registry.best(0.1, 0.5, 3600, now=now - 110) == darks[1]["uid"]
+
+        # a new session puts back darks missing from glbl.yml
+        glbl["_dark_dict_list"] = []
+        assert DarkFrameRegistry().best(0.1, 0.5, 600) == fresh["uid"]
+        assert glbl["_dark_dict_list"][-1] == fresh
+        # assigning a list resets the registry and its log
+        glbl["_dark_dict_list"] = []
+        assert registry.best(0.1, 0.5, 600) is None
+        assert not os.path.exists(registry.log_path)
+        registry.add(fresh)
+        with open(registry.log_path) as f:
+            assert [json.loads(line) for line in f] == [fresh]
+    finally:
+        shutil.rmtree(glbl["home"])
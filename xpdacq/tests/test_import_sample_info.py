@@ -3,6 +3,9 @@ import yaml
 import shutil
 import warnings
 import unittest
+import pytest
+import numpy as np
+import pandas as pd
 from pkg_resources import resource_filename as rs_fn
 
 from xpdacq.glbl import glbl
@@ -16,7 +19,8 @@ from xpdacq.beamtime import (
     Beamtime,
     Sample,
 )
-from xpdacq.utils import import_sample_info, _import_sample_info
+from xpdacq.utils import import_sample_info, _import_sample_info, ExceltoYaml
+from xpdacq.yamldict import flush_engine
 
 
 # print messages for debugging
@@ -105,3 +109,87 @@ class ImportSamplTest(unittest.TestCase):
         sample_obj_list = [el for el in self.bt.samples.values()]
         for i, el in enumerate(sample_obj_list):
             self.assertEqual(dict(el), self.bt.samples.get_md(i))
+
+    def test_import_sample_info_bulk(self):
+        pytest_dir = rs_fn("xpdacq", "tests/")
+        config = "XPD_beamline_config.yml"
+        configsrc = os.path.join(pytest_dir, config)
+        shutil.copyfile(configsrc, os.path.join(self.config_dir, config))
+        self.bt = _start_beamtime(
+            self.PI_name,
+            self.saf_num,
+            self.experimenters,
+            wavelength=self.wavelength,
+            test=True,
+        )
+        xlf = "300000_sample.xlsx"
+        src = os.path.join(self.pkg_rs, xlf)
+        shutil.copyfile(src, os.path.join(glbl["import_dir"], xlf))
+        before = flush_engine.write_count
+        excel_to_yaml = _import_sample_info(300000, self.bt, bulk=True)
+        n_samples = len(excel_to_yaml.parsed_sa_md_list)
+        self.assertEqual(len(self.bt.samples), n_samples)
+        # one write per sample plus the sample order file
+        self.assertEqual(flush_engine.write_count - before, n_samples + 1)
+        for sample in self.bt.samples.values():
+            with open(sample.filepath, "r") as f:
+                self.assertEqual(Sample.from_yaml(f), sample)
+        with open(
+            os.path.join(glbl["config_base"], ".sample_order.yml")
+        ) as f:
+            sample_order = yaml.unsafe_load(f)
+        self.assertEqual(
+            list(sample_order.values()),
+            [name + ".yml" for name in self.bt.samples],
+        )
+
+
+def test_validate_sa_md_list():
+    excel_to_yaml = ExceltoYaml(".")
+    excel_to_yaml.parsed_sa_md_list = [
+        {"sample_name": "Ni"},
+        {"sample_composition": {"Ni": 1}},
+    ]
+    with pytest.raises(ValueError):
+        excel_to_yaml.validate_sa_md_list()
+    excel_to_yaml.parsed_sa_md_list.pop()
+    excel_to_yaml.validate_sa_md_list()
+
+
+def test_parse_sample_md_columnwise():
+    excel_to_yaml = ExceltoYaml(".")
+    excel_to_yaml.pd_df = pd.DataFrame(
+        {
+            "Sample Name [required]": ["Ni/1", "TiO2 a", np.nan],
+            "Phase Info [required]": ["TiO2:1, C:2"] * 3,
+            "Collaborators": ["Simon Billinge, Max Terban", np.nan, "Tim"],
+            "User supplied tags": ["powder, capillary"] * 3,
+            "Sample-name of sample background": [" kapton tube"] * 3,
+            "Temperature": [300, np.nan, 100.5],
+        }
+    )
+    excel_to_yaml.parse_sample_md()
+    md0, md1, md2 = excel_to_yaml.parsed_sa_md_list
+    assert md0["sample_name"] == "Ni_1"
+    assert md1["sample_name"] == "TiO2_a"
+    assert "sample_name" not in md2
+    assert md0["collaborators"] == ["Simon", "Billinge", "Max", "Terban"]
+    assert "collaborators" not in md1
+    assert md0["user"] == ["powder", "capillary"]
+    assert md0["bkgd_sample_name"] == "kapton_tube"
+    assert md0["sample_phase"] == {"TiO2": 0.33, "C": 0.67}
+    assert md0["temperature"] == "300.0"
+    assert "temperature" not in md1
+    assert list(md1) == [
+        "sample_name",
+        "sample_composition",
+        "sample_phase",
+        "composition_string",
+        "user",
+        "bkgd_sample_name",
+    ]
+    # repeated cells are parsed once but rows don't share containers
+    md0["sample_phase"]["TiO2"] = 1.0
+    md0["user"].append("new_tag")
+    assert md1["sample_phase"] == {"TiO2": 0.33, "C": 0.67}
+    assert md1["user"] == ["powder", "capillary"]
@@ -1,5 +1,9 @@
 import pytest
-from xpdacq.utils import excel_to_yaml
+from xpdacq.utils import (
+    excel_to_yaml,
+    phase_parser_cache_info,
+    clear_phase_parser_cache,
+)
 
 
 @pytest.mark.parametrize(
@@ -50,6 +54,24 @@ def test_phase_str_parser_error():
         excel_to_yaml.phase_parser(test_str)
 
 
+def test_phase_str_parser_cache():
+    clear_phase_parser_cache()
+    rv = excel_to_yaml.phase_parser("TiO2:1, C:2")
+    # same phases with different blanks share the cache entry
+    rv2 = excel_to_yaml.phase_parser(" TiO2:1,C:2 ")
+    info = phase_parser_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+    assert rv == rv2
+    # callers get their own copies
+    rv[0]["Ti"] = 100.0
+    rv[1].clear()
+    assert excel_to_yaml.phase_parser("TiO2:1, C:2") == rv2
+    md = excel_to_yaml.parse_phase_info("TiO2:1, C:2")
+    md["sample_phase"]["C"] = 0
+    assert excel_to_yaml.phase_parser("TiO2:1, C:2")[1] == rv2[1]
+    assert phase_parser_cache_info().hits == 4
+
+
 @pytest.mark.parametrize(
     "input_str, expect_rv",
     [
@@ -0,0 +1,56 @@
+import yaml
+import numpy as np
+import pytest
+from yaml.constructor import ConstructorError
+
+from xpdacq.beamtime import shutter_step
+from xpdacq.serialization import yaml_load, yaml_dump
+
+
+def test_roundtrip_stored_types():
+    d = {
+        "sp_args": (5, [1, 2]),
+        "sp_kwargs": {"per_step": shutter_step},
+        "exposure": np.float64(0.5),
+        "num": np.int64(3),
+        "T_list": np.array([300.0, 350.0]),
+    }
+    reloaded = yaml_load(yaml_dump(d, default_flow_style=False))
+    assert reloaded["sp_args"] == (5, [1, 2])
+    assert reloaded["sp_kwargs"]["per_step"] is shutter_step
+    assert reloaded["exposure"] == 0.5
+    assert type(reloaded["num"]) is int
+    assert reloaded["T_list"] == [300.0, 350.0]
+
+
+def test_tuple_same_text_as_yaml_dump():
+    d = {"sp_args": (5,), "bt_experimenters": [("Max", "Terban", 2)]}
+    assert yaml_dump(d) == yaml.dump(d)
+
+
+def test_load_legacy_numpy_tags():
+    # written by yaml.dump in earlier versions
+    d = {
+        "exposure": np.float64(0.2),
+        "flag": np.bool_(True),
+        "arr": np.arange(6.0).reshape(2, 3),
+        "counts": np.arange(4, dtype=">i4"),
+    }
+    reloaded = yaml_load(yaml.dump(d))
+    assert reloaded["exposure"] == 0.2
+    assert reloaded["flag"]
+    np.testing.assert_array_equal(reloaded["arr"], d["arr"])
+    np.testing.assert_array_equal(reloaded["counts"], d["counts"])
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "!!python/object/apply:os.system ['echo unsafe']",
+        "!!python/name:os.system ''",
+        "!!python/object:xpdacq.beamtime.Beamtime {}",
+    ],
+)
+def test_refuse_arbitrary_objects(text):
+    with pytest.raises(ConstructorError):
+        yaml_load(text)
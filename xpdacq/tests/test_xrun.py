@@ -1,9 +1,14 @@
 import unittest
 import os
 import copy
+import functools
+import csv
+import json
 import shutil
 import time
+import threading
 import yaml
+import pytest
 import uuid
 import warnings
 from pprint import pprint
@@ -14,6 +19,8 @@ from xpdacq.tools import xpdAcqException
 from xpdacq.utils import import_sample_info
 from xpdacq.xpdacq_conf import (
     configure_device,
+    configure_frame_acq_time,
+    configure_frame_acq_time_plan,
     XPDACQ_MD_VERSION,
     _load_beamline_config,
 )
@@ -23,11 +30,44 @@ from xpdacq.xpdacq import (
     CustomizedRunEngine,
     _auto_load_calibration_file,
     set_beamdump_suspender,
+    calibration_cache_info,
+    invalidate_calibration_cache,
 )
+from xpdacq.beamtime import shutter_tracker, MDOrderedDict
+from xpdacq.run_timing import (
+    CadenceController,
+    TIMING_LOG_FNAME,
+    analyze_run_timing,
+)
+from xpdacq.settle import SettleMonitor
+from xpdacq.table_writer import SampleTableWriter
+from xpdacq.document_sink import BufferedDocumentSink
+from xpdacq.write_verification import (
+    load_verification_log,
+    _scan_documents,
+    _check_event_counts,
+    _check_datum,
+)
+from xpdacq.callback_workers import (
+    ProcessCallback,
+    LiveTableFeed,
+    LiveTableRouter,
+    _encode,
+    _decode,
+    shared_memory,
+)
+from xpdacq.shutter_latency import (
+    calibrate_shutter_latency,
+    clear_shutter_latency,
+    load_shutter_latency,
+    shutter_settle_time,
+)
+from xpdconf.conf import XPD_SHUTTER_CONF
 from xpdacq.simulation import pe1c, cs700, shctl1, db, fb
 import ophyd
-from bluesky import Msg
+from bluesky import Msg, RunEngine
 import bluesky.examples as be
+import bluesky.plans as bp
 from bluesky.callbacks import collector
 
 from pkg_resources import resource_filename as rs_fn
@@ -545,3 +585,752 @@ def test_dexela(fresh_xrun):
     xrun.subscribe(lambda *x: L.append(x))
     xrun({}, 0)
     assert L
+
+
+def test_calibration_cache():
+    os.makedirs(glbl["config_base"], exist_ok=True)
+    cfg_dst = os.path.join(glbl["config_base"], glbl["calib_config_name"])
+    try:
+        invalidate_calibration_cache()
+        before = calibration_cache_info()
+        assert _auto_load_calibration_file() is None
+        shutil.copy(os.path.join(pytest_dir, "xpdAcq_calib_info.yml"), cfg_dst)
+        md = _auto_load_calibration_file()
+        md["is_pytest"] = "modified"
+        md2 = _auto_load_calibration_file()
+        # served from the cache, as a copy
+        assert md2["is_pytest"] is True
+        info = calibration_cache_info()
+        assert info["misses"] - before["misses"] == 1
+        assert info["hits"] - before["hits"] == 1
+        # file changed on disk
+        with open(cfg_dst) as f:
+            calib = yaml.unsafe_load(f)
+        calib["new_key"] = 1
+        with open(cfg_dst, "w") as f:
+            yaml.dump(calib, f)
+        assert _auto_load_calibration_file()["new_key"] == 1
+        # explicit invalidation
+        invalidate_calibration_cache()
+        _auto_load_calibration_file()
+        assert calibration_cache_info()["misses"] - before["misses"] == 3
+    finally:
+        shutil.rmtree(glbl["home"])
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_open_run_injectors():
+    xrun = CustomizedRunEngine(None)
+    injectors = xrun.open_run_injectors
+    assert injectors.names == [
+        "_inject_qualified_dark_frame_uid",
+        "_inject_calibration_md",
+        "_inject_xpdacq_md_version",
+        "_inject_analysis_stage",
+        "_inject_filter_positions",
+    ]
+    seen = []
+
+    def inject_operator(msg):
+        seen.append(msg.kwargs.get("xpdacq_md_version"))
+        msg.kwargs["operator"] = "Billinge"
+        return msg
+
+    # after the calibration, before the md version
+    injectors.register(inject_operator, order=250)
+    injectors.register(
+        lambda msg: msg, name="never", condition=lambda: False
+    )
+    assert injectors.names.index("inject_operator") == 3
+    start_docs = []
+    xrun.subscribe(lambda name, doc: start_docs.append(doc), "start")
+    xrun({}, bp.count([xpd_configuration["area_det"]]))
+    assert seen == [None] * len(start_docs)
+    assert all(doc["operator"] == "Billinge" for doc in start_docs)
+    injectors.unregister(inject_operator)
+    injectors.unregister("never")
+    xrun({}, bp.count([xpd_configuration["area_det"]]))
+    assert "operator" not in start_docs[-1]
+    assert start_docs[-1]["analysis_stage"] == "raw"
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_periodic_dark_reads(monkeypatch):
+    glbl["_dark_dict_list"] = []
+    n_reads = []
+
+    def counting(get):
+        def _get(*args, **kwargs):
+            n_reads.append(1)
+            return get(*args, **kwargs)
+
+        return _get
+
+    for sig in (pe1c.cam.acquire_time, pe1c.images_per_set):
+        monkeypatch.setattr(sig, "get", counting(sig.get))
+    start_docs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.subscribe(lambda name, doc: start_docs.append(doc), "start")
+    # number of detector reads per xrun call
+    counts = []
+    for num in (1, 1, 50):
+        del n_reads[:]
+        xrun({}, bp.count([pe1c], num=num))
+        counts.append(len(n_reads))
+    # dark, then light frames reusing it
+    assert start_docs[0]["dark_frame"]
+    first, second, third = start_docs[1:]
+    assert first["sc_dk_decision"]["action"] == "new_dark"
+    assert first["sc_dk_field_uid"] == start_docs[0]["uid"]
+    for doc in (second, third):
+        assert doc["sc_dk_decision"]["action"] == "reuse"
+        assert doc["sc_dk_field_uid"] == start_docs[0]["uid"]
+    # one detector snapshot per run, whatever the number of points
+    assert counts[1] == counts[2]
+    assert counts[1] <= 2
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_area_det_config(monkeypatch):
+    det_sigs = (pe1c.cam.acquire_time, pe1c.images_per_set)
+    sets = []
+
+    def record_sets(msg):
+        if msg.command == "set" and msg.obj in det_sigs:
+            sets.append(msg.obj.name)
+
+    xrun = CustomizedRunEngine(None)
+    xrun.msg_hook = record_sets
+    n_sets = []
+    for _ in range(2):
+        xrun({}, ct([pe1c], 1))
+        n_sets.append(len(sets))
+    assert n_sets[0] > 0
+    # same exposure twice -> nothing to configure the second time
+    assert n_sets[1] == n_sets[0]
+    # changed outside of xpdAcq -> configured again
+    pe1c.images_per_set.put(3)
+    xrun({}, ct([pe1c], 1))
+    assert sets[n_sets[1]:] == [pe1c.images_per_set.name]
+    # iterating a plan without executing it, e.g. to print a ScanPlan
+    n_sets = len(sets)
+    list(ct([pe1c], 2))
+    xrun({}, ct([pe1c], 2))
+    assert sets[n_sets:] == [pe1c.images_per_set.name]
+    # unchanged frame acquisition time -> no restart of the detector
+    restarts = []
+    monkeypatch.setattr(pe1c.cam.acquire, "set", restarts.append)
+    glbl["frame_acq_time"] = glbl["frame_acq_time"]
+    assert not restarts
+
+
+def test_configure_frame_acq_time():
+    configure_device(
+        db=db, shutter=shctl1, area_det=pe1c, temp_controller=cs700,
+    )
+    old_acq_time = pe1c.cam.acquire_time.get()
+    t0 = time.time()
+    configure_frame_acq_time(0.3)
+    # no fixed sleeps with the simulated detector
+    assert time.time() - t0 < 1
+    assert pe1c.cam.acquire_time.get() == 0.3
+    assert pe1c.cam.acquire.get() == 1
+    # as a plan stub
+    msgs = []
+    RE = RunEngine()
+    RE.msg_hook = msgs.append
+    RE(configure_frame_acq_time_plan(old_acq_time))
+    assert pe1c.cam.acquire_time.get() == old_acq_time
+    assert [msg.obj for msg in msgs if msg.command == "set"] == [
+        pe1c.cam.acquire,
+        pe1c.number_of_sets,
+        pe1c.cam.acquire_time,
+        pe1c.cam.acquire,
+    ]
+    # unchanged -> nothing to do
+    del msgs[:]
+    RE(configure_frame_acq_time_plan(old_acq_time))
+    assert not [msg for msg in msgs if msg.command == "set"]
+    # unchanged but stopped -> restarted
+    pe1c.cam.acquire.put(0)
+    RE(configure_frame_acq_time_plan(old_acq_time))
+    assert [msg.obj for msg in msgs if msg.command == "set"] == [
+        pe1c.number_of_sets,
+        pe1c.cam.acquire,
+    ]
+    pe1c.cam.acquire.put(0)
+    configure_frame_acq_time(old_acq_time)
+    assert pe1c.cam.acquire.get() == 1
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_shutter_tracker():
+    msgs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.msg_hook = msgs.append
+
+    def shutter_moves():
+        return [
+            msg.args[0]
+            for msg in msgs
+            if msg.command == "set" and msg.obj is shctl1
+        ]
+
+    plan = bp.list_scan(
+        [pe1c], cs700, [300, 310, 320], per_step=shutter_step
+    )
+    xrun({}, plan)
+    moves = shutter_moves()
+    # no move to the position the shutter already has, but for the
+    # closing move at the end of xrun, which is always done
+    assert all(a != b for a, b in zip(moves[:-1], moves[1:-1]))
+    assert moves[-2:] == [XPD_SHUTTER_CONF["close"]] * 2
+    # one settle time per opening
+    n_open = moves.count(XPD_SHUTTER_CONF["open"])
+    assert len([msg for msg in msgs if msg.command == "sleep"]) == n_open
+    assert shutter_tracker.skipped_moves > 0
+    assert shutter_tracker.state == "close"
+    # without a RunEngine, no move is skipped
+    plan = bp.list_scan([pe1c], cs700, [300, 310], per_step=shutter_step)
+    moves = [msg.args[0] for msg in plan if msg.command == "set"]
+    assert moves.count(XPD_SHUTTER_CONF["open"]) == 2
+    assert moves.count(XPD_SHUTTER_CONF["close"]) == 2
+    # frames of a tseries close enough -> shutter stays open
+    glbl["shutter_keep_open"] = 5
+    try:
+        del msgs[:]
+        xrun({}, tseries([pe1c], 0.1, 0.1, 5))
+        assert shutter_moves().count(XPD_SHUTTER_CONF["open"]) == 1
+        assert shutter_tracker.state == "close"
+    finally:
+        glbl["shutter_keep_open"] = 0
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_shutter_latency():
+    assert shutter_settle_time() == glbl["shutter_sleep"]
+    record = calibrate_shutter_latency(n_cycles=3)
+    assert load_shutter_latency()[shctl1.name] == record
+    for state in ("open", "close"):
+        assert record[state]["readback"]["max"] >= 0
+    assert shutter_settle_time() == record["settle_time"]
+    # the time to open, not the readback lag behind the set status,
+    # which is about 0 for a shutter set on its readback
+    assert record["settle_time"] >= max(
+        0.05, record["open"]["readback"]["max"] * 1.5
+    )
+    # the shutter stubs wait the measured settle time
+    msgs = list(open_shutter_stub())
+    assert [msg.args for msg in msgs if msg.command == "sleep"] == [
+        (record["settle_time"],)
+    ]
+    clear_shutter_latency()
+    assert shutter_settle_time() == glbl["shutter_sleep"]
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_tseries_burst():
+    msgs = []
+    docs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.msg_hook = msgs.append
+    xrun.subscribe(lambda name, doc: docs.append((name, doc)))
+    xrun({}, tseries([pe1c], 0.1, 0.2, 5, burst=True))
+    start = [doc for name, doc in docs if name == "start"][-1]
+    assert start["sp_burst"]
+    # shutter opened once, no trigger message
+    commands = [m.command for m in msgs]
+    light = msgs[
+        len(commands) - commands[::-1].index("open_run"):
+        len(commands) - commands[::-1].index("close_run")
+    ]
+    assert [
+        m.args[0] for m in light if m.command == "set" and m.obj is shctl1
+    ] == [XPD_SHUTTER_CONF["open"], XPD_SHUTTER_CONF["close"]]
+    assert not [m for m in light if m.command == "trigger"]
+    page = [doc for name, doc in docs if name == "event_page"][-1]
+    times = page["data"][pe1c.name + "_frame_start"]
+    assert len(times) == 5
+    assert all(b - a > 0.15 for a, b in zip(times, times[1:]))
+
+
+def test_cadence_controller():
+    cadence = CadenceController(1.0)
+    delays = cadence.delays()
+    assert next(delays) == 1.0
+    cadence("descriptor", {"uid": "d1", "name": "primary"})
+    cadence("descriptor", {"uid": "d2", "name": "baseline"})
+    cadence("event", {"descriptor": "d2", "time": 5.0})
+    cadence("event", {"descriptor": "d1", "time": 10.0})
+    assert next(delays) == 1.0
+    # late reading, the next delay is shortened
+    cadence("event", {"descriptor": "d1", "time": 11.25})
+    assert next(delays) == 0.75
+    page = {"descriptor": "d1", "time": [12.0], "uid": ["e3"], "seq_num": [3]}
+    cadence("event_page", dict(page, data={}, timestamps={}))
+    assert next(delays) == 1.0
+    # more than one period late, the schedule starts over
+    cadence("event", {"descriptor": "d1", "time": 14.5})
+    assert cadence.slips == 1
+    assert next(delays) == 1.0
+    stats = cadence.stats()
+    assert stats["n_intervals"] == 3
+    assert stats["requested_period"] == 1.0
+    assert stats["jitter_max"] == 1.5
+    # no delay after the last of num readings
+    assert len(list(cadence.delays(3))) == 2
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_tseries_cadence():
+    msgs = []
+    docs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.msg_hook = msgs.append
+    xrun.subscribe(lambda name, doc: docs.append((name, doc)))
+    xrun({}, tseries([pe1c], 0.1, 0.3, 5))
+    log_path = os.path.join(glbl["config_base"], TIMING_LOG_FNAME)
+    with open(log_path) as f:
+        timing = [json.loads(line) for line in f]
+    start = [doc for name, doc in docs if name == "start"][-1]
+    docs = docs[docs.index(("start", start)):]
+    assert start["plan_args"]["delay"] == 0.3
+    # the delays are adapted to the readings
+    sleeps = [m.args[0] for m in msgs if m.command == "sleep"]
+    assert any(s < 0.3 for s in sleeps)
+    # nothing to wait for after the last frame
+    commands = [m.command for m in msgs]
+    last_save = len(commands) - 1 - commands[::-1].index("save")
+    assert "sleep" not in commands[last_save:]
+    # jitter statistics logged apart, the runs only hold the frames
+    assert [stats["uid"] for stats in timing] == [start["uid"]]
+    assert timing[0]["n_intervals"] == 4
+    assert not [
+        doc for name, doc in docs
+        if name == "descriptor" and doc["name"] != "primary"
+    ]
+    shutter_sets = [
+        m.args[0] for m in msgs if m.command == "set" and m.obj is shctl1
+    ]
+    assert shutter_sets[-1] == XPD_SHUTTER_CONF["close"]
+    report = analyze_run_timing(docs)
+    assert report["num_readings"] == 5
+    assert report["requested_period"] == 0.3
+    assert abs(report["period_mean"] - 0.3) < 0.05
+    assert np.isclose(report["period_mean"], timing[0]["period_mean"])
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_Tramp_fly():
+    cs700.set(300).wait()
+    msgs = []
+    docs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.msg_hook = msgs.append
+    xrun.subscribe(lambda name, doc: docs.append((name, doc)))
+    # 2 K at 120 K/min, a frame every 0.25 K
+    xrun({}, Tramp([pe1c], 0.1, 300, 302, 0.25, ramp_rate=120))
+    start = [doc for name, doc in docs if name == "start"][-1]
+    assert start["sp_ramp_rate"] == 120
+    assert start["sp_fly_period"] == 0.125
+    assert cs700.position == 302
+    # no step, no settle, the shutter opened once
+    commands = [m.command for m in msgs]
+    light = msgs[
+        len(commands) - commands[::-1].index("open_run"):
+        len(commands) - commands[::-1].index("close_run")
+    ]
+    assert [m.args[0] for m in light if m.command == "set"] == [
+        XPD_SHUTTER_CONF["open"], XPD_SHUTTER_CONF["close"]
+    ]
+    pages = [doc for name, doc in docs if name == "event_page"]
+    temperatures = pages[-1]["data"]["temperature"]
+    frame_starts = pages[-1]["data"][pe1c.name + "_frame_start"]
+    assert len(temperatures) > 4
+    assert all(300 <= t <= 302 for t in temperatures)
+    assert temperatures == sorted(temperatures)
+    # about 2 K/s from the first frame on
+    rate = (temperatures[-1] - temperatures[0]) / (
+        frame_starts[-1] - frame_starts[0]
+    )
+    assert 1 < rate < 3
+
+
+def test_settle_monitor():
+    controller = ophyd.sim.SynAxis(name="T", value=300.0)
+    monitor = SettleMonitor(controller, tolerance=0.5, window=0.2, max_wait=5)
+    # a steady readback settles after one window
+    status = monitor.set(300.2)
+    status.wait(2)
+    assert monitor.settled.get()
+    assert 0.2 <= monitor.settle_time.get() < 1
+    # a drifting readback never settles, give up after max_wait
+    monitor.max_wait = 0.5
+    status = monitor.set(300)
+    stop = threading.Event()
+
+    def drift():
+        while not stop.is_set():
+            controller.set(controller.position + 0.05)
+            time.sleep(0.01)
+
+    threading.Thread(target=drift, daemon=True).start()
+    try:
+        status.wait(2)
+    finally:
+        stop.set()
+    assert not monitor.settled.get()
+    assert monitor.settle_time.get() >= 0.5
+    assert monitor._cid is None
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_Tlist_settle():
+    docs = []
+    xrun = CustomizedRunEngine(None)
+    xrun.subscribe(lambda name, doc: docs.append((name, doc)))
+    settle = {"window": 0.1, "max_wait": 2}
+    xrun({}, Tlist([pe1c], 0.1, [300, 301], settle=settle))
+    start = [doc for name, doc in docs if name == "start"][-1]
+    assert start["sp_settle"]["window"] == 0.1
+    events = [doc for name, doc in docs if name == "event"][-2:]
+    assert [ev["data"]["temperature"] for ev in events] == [300, 301]
+    for ev in events:
+        assert ev["data"]["cs700_settled"]
+        assert ev["data"]["cs700_settle_time"] >= 0.1
+
+
+def test_statTramp_snake():
+    from collections import OrderedDict
+    from types import SimpleNamespace
+    from xpdsim import ring_current
+    from xpdacq.beamtime import _PLAN_REGISTRY
+
+    stage = ophyd.sim.SynAxis(name="stage", value=0.0)
+    configure_device(
+        db=db, shutter=shctl1, area_det=pe1c, temp_controller=cs700,
+        stat_motor=stage, ring_current=ring_current,
+    )
+    bt = SimpleNamespace(
+        samples=OrderedDict((name, {"sample_name": name}) for name in "abc")
+    )
+    assert _PLAN_REGISTRY["statTramp"] is statTramp
+    msgs = list(
+        statTramp(
+            [pe1c], 0.1, 300, 310, 5, {"0": 1.0, "1": 3.0, "2": 2.0},
+            bt=bt, T_tolerance=5,
+        )
+    )
+    sets = [(m.obj, m.args[0]) for m in msgs if m.command == "set"]
+    # one direction, then the other, no flying back
+    assert [pos for obj, pos in sets if obj is stage] == [
+        1, 2, 3, 3, 2, 1, 1, 2, 3
+    ]
+    # the next temperature is set before the last sample is measured
+    moves = [(m.command, m.obj, m.args[:1]) for m in msgs]
+    moves = [
+        (cmd, obj, args) for cmd, obj, args in moves
+        if cmd == "open_run" or (cmd == "set" and obj in (stage, cs700))
+    ]
+    assert moves[:6] == [
+        ("set", cs700, (300,)),
+        ("set", stage, (1.0,)),
+        ("open_run", None, ()),
+        ("set", stage, (2.0,)),
+        ("open_run", None, ()),
+        ("set", stage, (3.0,)),
+    ]
+    assert moves[6:8] == [("set", cs700, (305,)), ("open_run", None, ())]
+
+
+def test_sample_table_writer(tmpdir):
+    fpath = str(tmpdir.join("sample.csv"))
+    writer = SampleTableWriter(fpath, flush_every=2)
+    writer("start", {"uid": "run1", "time": 0})
+    writer(
+        "descriptor",
+        {
+            "uid": "d1",
+            "name": "primary",
+            "run_start": "run1",
+            "data_keys": {
+                "temperature": {"dtype": "number", "shape": [], "source": ""},
+                "pe1_image": {
+                    "dtype": "array", "shape": [5, 5], "source": "",
+                    "external": "FILESTORE:",
+                },
+            },
+        },
+    )
+    event = {
+        "descriptor": "d1", "time": 1.0, "seq_num": 1, "uid": "e1",
+        "data": {"temperature": 300.0, "pe1_image": "datum"},
+        "timestamps": {"temperature": 0.5, "pe1_image": 0.5},
+    }
+    writer("event", event)
+    # buffered
+    assert not os.path.isfile(fpath)
+    # what was measured is written out even if the run is aborted
+    writer("stop", {"uid": "s1", "run_start": "run1", "time": 2,
+                    "exit_status": "abort"})
+    with open(fpath) as f:
+        rows = list(csv.DictReader(f))
+    assert rows == [
+        {
+            "uid": "run1", "time": "1.0", "temperature": "300.0",
+            "temperature_timestamp": "0.5",
+        }
+    ]
+
+
+@pytest.mark.usefixtures("user_dirs")
+def test_statTramp_tables():
+    from types import SimpleNamespace
+    ring_current = ophyd.Signal(name="ring_current", value=300)
+    stage = ophyd.sim.SynAxis(name="stage", value=0.0)
+    configure_device(
+        db=db, shutter=shctl1, area_det=pe1c, temp_controller=cs700,
+        stat_motor=stage, ring_current=ring_current,
+    )
+    samples = MDOrderedDict()
+
+    def loader(name):
+        def load():
+            samples[name] = {"sample_name": name}
+            return samples[name]
+
+        return load
+
+    for name in "abc":
+        samples.add_lazy(name, loader(name))
+    bt = SimpleNamespace(samples=samples)
+    RE = RunEngine()
+    uids = RE(
+        statTramp([pe1c], 0.1, 300, 301, 1, {"0": 1.0, "1": 2.0}, bt=bt)
+    )
+    tables = {}
+    for fn in os.listdir(glbl["tiff_base"]):
+        with open(os.path.join(glbl["tiff_base"], fn)) as f:
+            tables[fn.split("_")[0]] = list(csv.DictReader(f))
+    assert sorted(tables) == ["a", "b"]
+    for name, pos in [("a", 1.0), ("b", 2.0)]:
+        rows = tables[name]
+        assert [float(row["temperature"]) for row in rows] == [300, 301]
+        assert [float(row["stage"]) for row in rows] == [pos, pos]
+        assert "ring_current" in rows[0]
+        assert len({row["uid"] for row in rows}) == 2
+    # only the samples measured are built
+    assert not samples.is_loaded("c")
+
+
+def test_buffered_document_sink():
+    inserted = []
+    release = threading.Event()
+
+    def slow_insert(name, doc):
+        release.wait()
+        inserted.append((name, doc))
+
+    sink = BufferedDocumentSink(slow_insert, maxsize=4)
+    RE = RunEngine()
+    RE.subscribe(sink)
+    # the RunEngine only waits for the database when the queue is full
+    threading.Timer(0.5, release.set).start()
+    uid, = RE(bp.count([ophyd.sim.det], 10))
+    # every document is inserted once the run is over
+    names = [name for name, doc in inserted]
+    assert names[0] == "start" and names[-1] == "stop"
+    n_events = sum(
+        len(doc["seq_num"]) if name == "event_page" else 1
+        for name, doc in inserted
+        if name in ("event", "event_page")
+    )
+    assert n_events == 10
+    metrics = sink.metrics
+    assert metrics["queue_depth"] == 0
+    assert metrics["max_queue_depth"] == 4
+    assert metrics["backpressure_time"] > 0.3
+    assert metrics["documents"] == 13
+    # events waiting in the queue are inserted as pages
+    assert "event_page" in names
+    assert metrics["inserts"] == len(inserted) < 13
+
+    def failing_insert(name, doc):
+        raise RuntimeError("database down")
+
+    sink.insert = failing_insert
+    with pytest.raises(RuntimeError):
+        RE(bp.count([ophyd.sim.det], 1))
+    sink.close()
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_install_document_sink():
+    xrun = CustomizedRunEngine(None)
+    sink = xrun.install_document_sink(db.v1.insert)
+    assert xrun.document_sink is sink
+    uid = xrun({}, tseries([pe1c], 0.1, 0.1, 3))[-1]
+    # in the database as soon as xrun returns
+    hdr = db.v1[uid]
+    assert hdr.stop["num_events"]["primary"] == 3
+    assert "primary" in hdr.stream_names
+    assert sink.metrics["errors"] == 0
+    xrun.install_document_sink(db.v1.insert)
+    assert xrun.document_sink is not sink
+    xrun.document_sink.close()
+
+
+@pytest.mark.usefixtures("sim_devices")
+def test_verify_write():
+    xrun = CustomizedRunEngine(None)
+    xrun.install_document_sink(db.v1.insert)
+    try:
+        uids = xrun({}, tseries([pe1c], 0.1, 0.1, 2), verify_write=True)
+        verifier = xrun.write_verifier
+        results = verifier.wait()
+        assert sorted(r["uid"] for r in results) == sorted(uids)
+        assert all(r["passed"] for r in results)
+        assert verifier.failures == []
+        # a run missing from the database fails and is logged
+        verifier.retries = 0
+        verifier("stop", {"run_start": "not-a-run"})
+        (result,) = verifier.wait()
+        assert not result["passed"]
+        assert verifier.failures == ["not-a-run"]
+        log = load_verification_log()
+        assert set(log) == set(uids) | {"not-a-run"}
+        assert not log["not-a-run"]["passed"]
+        verifier.close()
+    finally:
+        xrun.document_sink.close()
+
+
+def test_verify_run_checks():
+    class Header:
+        def documents(self, fill):
+            yield "descriptor", {
+                "uid": "d",
+                "name": "primary",
+                "data_keys": {"img": {"external": "FILESTORE:"}, "x": {}},
+            }
+            yield "event_page", {
+                "descriptor": "d",
+                "seq_num": [1, 2],
+                "time": [0, 1],
+                "uid": ["e1", "e2"],
+                "timestamps": {"img": [0, 1], "x": [0, 1]},
+                "data": {"img": ["a", "b"], "x": [1, 2]},
+                "filled": {"img": [False, True]},
+            }
+            yield "datum_page", {
+                "resource": "r",
+                "datum_id": ["c"],
+                "datum_kwargs": {},
+            }
+
+    scan = _scan_documents(Header())
+    assert scan.num_events == {"primary": 2}
+    # the filled reading needs no datum
+    assert scan.referenced == {"a"}
+    assert _check_datum(scan.referenced, scan.datum_ids) == [
+        "1 datum missing"
+    ]
+    stop = {"num_events": {"primary": 3}}
+    assert _check_event_counts(stop, scan.num_events) == [
+        "2 events in stream 'primary' instead of 3"
+    ]
+
+
+def _csv_rows(fpath):
+    with open(fpath, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.usefixtures("tmp_cwd")
+def test_process_callback(tmpdir):
+    fpath = str(tmpdir.join("table.csv"))
+    cb = ProcessCallback(functools.partial(SampleTableWriter, fpath))
+    RE = RunEngine()
+    RE(bp.count([ophyd.sim.det], 3), cb)
+    cb.close()
+    rows = _csv_rows(fpath)
+    assert len(rows) == 3
+    assert cb.metrics == {"sent": 6, "dropped": 0, "pending": 0, "errors": 0}
+    # large arrays go through shared memory, freed once read
+    img = np.arange(12.0).reshape(3, 4)
+    name, doc = _encode("event", {"data": {"img": img, "x": 1}}, 0)
+    shm_name = doc["data"]["img"].name
+    name, doc = _decode(name, doc)
+    assert np.array_equal(doc["data"]["img"], img)
+    assert doc["data"]["x"] == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shm_name)
+
+
+@pytest.mark.usefixtures("tmp_cwd")
+def test_process_callback_dead_worker():
+    def blocks():
+        return {f for f in os.listdir("/dev/shm") if f.startswith("psm_")}
+
+    before = blocks()
+    # the worker exits before reading anything
+    cb = ProcessCallback(functools.partial(os._exit, 1), shm_threshold=0)
+    for i in range(10):
+        cb("event", {"data": {"img": np.full(16, i)}})
+    cb.close()
+    assert cb.metrics["sent"] < 10
+    # the arrays the worker never got are freed
+    assert blocks() <= before
+
+
+@pytest.mark.usefixtures("tmp_cwd")
+@pytest.mark.parametrize("drop", ["oldest", "newest"])
+def test_process_callback_drop(tmpdir, drop):
+    fpath = str(tmpdir.join("table.csv"))
+    writer = functools.partial(SampleTableWriter, fpath)
+    cb = ProcessCallback(writer, maxsize=2, drop=drop)
+    motor = ophyd.sim.SynAxis(name="motor")
+    RE = RunEngine()
+    # the documents come faster than the worker starts
+    RE(bp.list_scan([ophyd.sim.det], motor, list(range(20))), cb)
+    cb.close()
+    positions = [float(row["motor"]) for row in _csv_rows(fpath)]
+    assert cb.metrics["dropped"] == 20 - len(positions) > 0
+    if drop == "oldest":
+        assert positions[-1] == 19
+    else:
+        assert positions == list(range(len(positions)))
+    with pytest.raises(ValueError):
+        ProcessCallback(writer, drop="all")
+
+
+@pytest.mark.usefixtures("tmp_cwd", "sim_devices")
+def test_isolate_live_table(tmpdir):
+    xrun = CustomizedRunEngine(None)
+    fpath = str(tmpdir.join("table.csv"))
+    writer = functools.partial(SampleTableWriter, fpath)
+    glbl["isolate_live_table"] = True
+    try:
+        subs = [m.args[0] for m in ct([pe1c], 0.1) if m.command == "subscribe"]
+        assert [type(cb) for cb in subs] == [LiveTableFeed]
+        # printed from this process without xrun
+        RunEngine()(ct([pe1c], 0.1))
+        assert subs[0].worker is None
+        # one worker for the live tables of all runs, and for the subs
+        cb = xrun.process_callback(writer)
+        uids = xrun({}, ct([pe1c], 0.1), subs=cb)
+        uids += xrun({}, ct([pe1c], 0.1), subs=xrun.process_callback(writer))
+        assert set(xrun.process_callbacks) == {LiveTableRouter, writer}
+        assert xrun.process_callbacks[writer] is cb
+        workers = [c._process for c in xrun.process_callbacks.values()]
+        table = xrun.process_callbacks[LiveTableRouter]
+        xrun({}, ct([pe1c], 0.1))
+        assert [c._process for c in xrun.process_callbacks.values()] == workers
+        xrun.close_process_callbacks()
+        assert xrun.process_callbacks == {}
+        assert all(w.exitcode == 0 for w in workers)
+        assert table.metrics["errors"] == 0
+        # one frame per run, dark frames included
+        assert len(_csv_rows(fpath)) == len(uids)
+    finally:
+        glbl["isolate_live_table"] = False
@@ -0,0 +1,108 @@
+import os
+import time
+
+import yaml
+import pytest
+
+from xpdacq.yamldict import YamlDict, YamlChainMap, flush_engine
+
+
+def _yaml_dict(tmpdir, name="d.yml", **kwargs):
+    d = YamlDict(**kwargs)
+    d.filepath = str(tmpdir.join(name))
+    return d
+
+
+def _reload(d):
+    with open(d.filepath) as f:
+        return yaml.unsafe_load(f)
+
+
+def test_write_through(tmpdir):
+    d = _yaml_dict(tmpdir, a=1)
+    d["b"] = 2
+    assert _reload(d) == {"a": 1, "b": 2}
+    del d["a"]
+    assert _reload(d) == {"b": 2}
+    d.update(c=3)
+    d.setdefault("e", 5)
+    assert _reload(d) == {"b": 2, "c": 3, "e": 5}
+
+
+def test_deferred_flush_writes_once(tmpdir):
+    d = _yaml_dict(tmpdir, a=1)
+    before = flush_engine.write_count
+    with d.deferred_flush():
+        for i in range(20):
+            d["key_{}".format(i)] = i
+        # nothing has been written yet
+        assert "key_0" not in _reload(d)
+    assert flush_engine.write_count - before == 1
+    assert _reload(d) == dict(d)
+
+
+def test_nested_deferred_flush(tmpdir):
+    d = _yaml_dict(tmpdir, a=1)
+    with d.deferred_flush():
+        with d.deferred_flush():
+            d["b"] = 2
+        # inner block exit does not commit the batch
+        assert "b" not in _reload(d)
+    assert _reload(d)["b"] == 2
+
+
+def test_unchanged_contents_are_not_rewritten(tmpdir):
+    d = _yaml_dict(tmpdir, a=1)
+    before = flush_engine.write_count
+    d["a"] = 1
+    d.flush()
+    assert flush_engine.write_count == before
+    # file removed behind our back is written again
+    os.remove(d.filepath)
+    d.flush()
+    assert flush_engine.write_count == before + 1
+    assert _reload(d) == {"a": 1}
+
+
+def test_referenced_by_written_in_same_batch(tmpdir):
+    parent = _yaml_dict(tmpdir, "parent.yml", a=1)
+    child = YamlChainMap({"b": 2}, parent)
+    child.filepath = str(tmpdir.join("child.yml"))
+    parent._referenced_by.append(child)
+    before = flush_engine.write_count
+    with parent.deferred_flush():
+        parent["a"] = 10
+        parent["c"] = 3
+    assert flush_engine.write_count - before == 2
+    assert _reload(child) == [{"b": 2}, {"a": 10, "c": 3}]
+
+
+def test_atomic_write_keeps_old_file(tmpdir, monkeypatch):
+    d = _yaml_dict(tmpdir, a=1)
+
+    def broken_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", broken_fsync)
+    with pytest.raises(OSError):
+        d["a"] = 2
+    monkeypatch.undo()
+    # old contents intact and no temporary file left behind
+    assert _reload(d) == {"a": 1}
+    assert os.listdir(str(tmpdir)) == ["d.yml"]
+
+
+def test_background_writer_coalesces(tmpdir):
+    d = _yaml_dict(tmpdir, a=1)
+    flush_engine.start_background_writer(delay=0.1)
+    try:
+        before = flush_engine.write_count
+        for i in range(50):
+            d["a"] = i
+        deadline = time.time() + 5
+        while flush_engine.pending and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        flush_engine.stop_background_writer()
+    assert flush_engine.write_count - before <= 2
+    assert _reload(d) == {"a": 49}
@@ -0,0 +1,108 @@
+import os
+import datetime
+import shutil
+
+import yaml
+
+from xpdacq.glbl import glbl
+from xpdacq.beamtime import Beamtime, Sample
+from xpdacq.beamtimeSetup import load_beamtime
+from xpdacq.yamldict import flush_engine
+from xpdacq.yamlindex import YamlIndex
+
+
+def _write(tmpdir, name, data):
+    fpath = tmpdir.join(name)
+    fpath.write(yaml.dump(data))
+    return str(fpath)
+
+
+def test_read_hit_and_miss(tmpdir):
+    fpath = _write(tmpdir, "Ni.yml", [{"sa_uid": "1", "sample_name": "Ni"}])
+    index = YamlIndex(str(tmpdir))
+    with index:
+        text, data = index.read(fpath)
+        _, data2 = index.read(fpath)
+    assert (index.hits, index.misses) == (1, 1)
+    assert data == data2 and data is not data2
+    with index:
+        assert index.records() == [(fpath, "sample", "1", "Ni")]
+
+
+def test_changed_file_is_parsed_again(tmpdir):
+    fpath = _write(tmpdir, "Ni.yml", [{"sa_uid": "1", "sample_name": "Ni"}])
+    index = YamlIndex(str(tmpdir))
+    with index:
+        index.read(fpath)
+    # same size and inode, different contents and mtime
+    mtime_ns = os.stat(fpath).st_mtime_ns
+    _write(tmpdir, "Ni.yml", [{"sa_uid": "2", "sample_name": "Ni"}])
+    os.utime(fpath, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+    with index:
+        _, data = index.read(fpath)
+    assert data[0]["sa_uid"] == "2"
+    assert index.misses == 2
+    os.remove(fpath)
+    with index:
+        assert index.prune() == 1
+        assert index.records() == []
+
+
+def test_index_holds_no_pickle(tmpdir):
+    # content json can't give back as is is parsed again from its text
+    date = datetime.date(2017, 1, 1)
+    fpath = _write(tmpdir, "bt.yml", {"bt_uid": "1", "bt_date": date})
+    index = YamlIndex(str(tmpdir))
+    with index:
+        index.read(fpath)
+        _, data = index.read(fpath)
+    assert data == {"bt_uid": "1", "bt_date": date}
+    assert index.hits == 1
+    # only text is stored
+    with index:
+        rows = index._connect().execute(
+            "SELECT text, json FROM yaml_records"
+        ).fetchall()
+    assert rows
+    assert all(
+        isinstance(value, str) or value is None
+        for row in rows
+        for value in row
+    )
+
+
+def test_unusable_index_falls_back(tmpdir):
+    fpath = _write(tmpdir, "bt.yml", {"bt_uid": "1"})
+    index = YamlIndex(str(tmpdir.join("missing_dir")))
+    with index:
+        _, data = index.read(fpath)
+    assert data == {"bt_uid": "1"}
+    assert index.disabled
+
+
+def test_load_beamtime_index():
+    for d in glbl["allfolders"]:
+        os.makedirs(d, exist_ok=True)
+    try:
+        bt = Beamtime("Simon", 123, [], wavelength=0.1828)
+        with bt.deferred_flush():
+            for name in ["Ni", "TiO2", "kapton"]:
+                Sample(bt, {"sample_name": name, "sample_composition": {}})
+        before = flush_engine.write_count
+        # first load fills the index, second one reads from it
+        for _ in range(2):
+            bt2 = load_beamtime(index=True)
+            assert bt2 == bt
+            assert list(bt2.samples) == list(bt.samples)
+            for k, v in bt.samples.items():
+                assert dict(bt2.samples[k]) == dict(v)
+        assert flush_engine.write_count == before
+        index = YamlIndex(glbl["yaml_dir"])
+        with index:
+            index.read(bt.samples["Ni"].filepath)
+            assert len(index.records("sample")) == 3
+        assert index.hits == 1
+    finally:
+        shutil.rmtree(glbl["home"])
+        if os.path.isdir(glbl["xpdconfig"]):
+            shutil.rmtree(glbl["xpdconfig"])
@@ -14,11 +14,14 @@
 #
 ##############################################################################
 import os
+import re
+import time
 import yaml
 import shutil
 import tarfile as tar
 import uuid
 import warnings
+from functools import lru_cache
 from itertools import takewhile
 from time import strftime
 from shutil import ReadError
@@ -31,6 +34,13 @@ from .tools import validate_dict_key, _check_obj, _graceful_exit
 from .beamtime import Beamtime, Sample
 
 
+# compiled once, used by composition_analysis
+_BLANK_RE = re.compile(r"\s")
+_ELEMENT_RE = re.compile(r"([A-Z][a-z]?(?:[1-8]?[+-])?)")
+# maximum number of distinct phase strings kept by the phase parser
+PHASE_PARSER_CACHE_SIZE = 1024
+
+
 def composition_analysis(compstring):
     """Pulls out elements and their ratios from the config file.
 
@@ -42,10 +52,8 @@ def composition_analysis(compstring):
 
     Returns a list of atom symbols and a corresponding list of their counts.
     """
-    import re
-
     # remove all blanks
-    compbare = re.sub("\s", "", compstring)
+    compbare = _BLANK_RE.sub("", compstring)
     # reusable error message
     # make sure there is at least one uppercase character in the compstring
     upcasechars = any(str.isupper(c) for c in compbare)
@@ -54,7 +62,7 @@ def composition_analysis(compstring):
         raise ValueError(emsg)
     # split at every upper-case letter, possibly followed by a lower case
     # one and charge specification
-    namefracs = re.split("([A-Z][a-z]?(?:[1-8]?[+-])?)", compbare)[1:]
+    namefracs = _ELEMENT_RE.split(compbare)[1:]
     names = namefracs[0::2]
     # use unit count when empty, convert to float otherwise
     getfraction = lambda s: (s == "" and 1.0 or float(s))
@@ -62,6 +70,101 @@ def composition_analysis(compstring):
     return names, fractions
 
 
+def _normalize_phase_str(phase_str):
+    """strip the phases of a phase string, the key of the phase cache"""
+    return ",".join(el.strip() for el in phase_str.split(","))
+
+
+@lru_cache(maxsize=PHASE_PARSER_CACHE_SIZE)
+def _cached_phase_parser(phase_str):
+    """memoized core of ExceltoYaml.phase_parser
+
+    Returned dicts are shared by every caller with the same phase
+    string, never mutate them.
+    """
+    phase_dict = {}
+    composition_dict = {}
+    composition_str = ""
+    # figure out ratio between phases
+    compound_meta = phase_str.split(",")
+    for el in compound_meta:
+        _el = el.strip()
+        # if no ":" in the string
+        if ":" not in _el:
+            com = _el
+            amount = 1.0
+        # ":" in the string
+        else:
+            meta = _el.split(":")
+            # there is a ":" but nothing follows
+            if not meta[1]:
+                com = meta[0]
+                amount = 1.0
+            # presumably valid input
+            else:
+                com, amount = meta
+        # further verify if it's giving as 'X: 10%' format
+        if isinstance(amount, str):
+            amount = amount.strip()
+            amount = amount.replace("%", "")
+        # construct the not normalized phase dict
+        phase_dict.update({com.strip(): float(amount)})
+
+    # normalize phase ratio for composition dict
+    total = sum(phase_dict.values())
+    for k, v in phase_dict.items():
+        ratio = round(v / total, 2)
+        phase_dict[k] = ratio
+
+    # construct composition_dict
+    for k, v in phase_dict.items():
+        # k is compostring, v is phase ratio
+        try:
+            el_list, sto_list = composition_analysis(k.strip())
+        except ValueError:
+            # getx3 parser can't parse it, set default
+            el_list, sto_list = ([k], [v])
+        for el, sto in zip(el_list, sto_list):
+            # sum element
+            if el in composition_dict:
+                val = composition_dict.get(el)
+                val += sto * v
+                composition_dict.update({el: val})
+            else:
+                # otherwise, just update it
+                composition_dict.update({el: sto * v})
+
+    # finally, construct composition_str
+    for k, v in sorted(composition_dict.items()):
+        composition_str += str(k) + str(v)
+
+    return composition_dict, phase_dict, composition_str
+
+
+def phase_parser_cache_info():
+    """hits, misses and size of the phase string cache
+
+    Returns
+    -------
+    cache_info : functools._CacheInfo
+        named tuple of ``hits``, ``misses``, ``maxsize`` and ``currsize``
+    """
+    return _cached_phase_parser.cache_info()
+
+
+def clear_phase_parser_cache():
+    """empty the phase string cache and reset its statistics"""
+    _cached_phase_parser.cache_clear()
+
+
+def _copy_md(md):
+    """copy of a parsed md dict, one level deeper than dict.copy"""
+    return {
+        k: v.copy() if isinstance(v, (dict, list)) else v
+        for k, v in md.items()
+    }
+
+
 def export_userScriptsEtc():
     """ function that exports user defined objects/scripts stored under
         config_base and userScript.
@@ -252,71 +355,123 @@ class ExceltoYaml:
         )
 
     def parse_sample_md(self):
-        """parse a list of sample metadata into desired format"""
-        parsed_sa_md_list = []
-        for ind, row in self.pd_df.iterrows():
-            parsed_sa_md = {}
-            sa_md = row.dropna().to_dict()  # drop NAN and turn into dict
-            for k, v in sa_md.items():
-                k = str(k).lower()
-                v = str(v)
-                k = k.strip().replace(" ", "_")
-                v = v.replace("/", "_")  # make sure yaml path correct
-
-                # name fields
-                if k in self._NAME_FIELD:
-                    _k = k
-                    try:
-                        comma_sep_list = self._comma_separate_parser(v)
-                        parsed_name = []
-                        for el in comma_sep_list:
-                            parsed_name.extend(self._name_parser(el))
-                    except ValueError:
-                        parsed_name = v
-                    parsed_sa_md.setdefault(_k, [])
-                    parsed_sa_md.get(_k).extend(parsed_name)
-
-                # phase fields
-                elif k in self._PHASE_FIELD:
-                    parsed_sa_md.update(self.parse_phase_info(v))
-
-                # comma separated fields
-                elif k in self._COMMA_SEP_FIELD:
-                    _k = "".join(takewhile(lambda x: x.isalpha(), k))
-                    try:
-                        comma_sep_list = self._comma_separate_parser(v)
-                        # print("successfully parsed comma-sep-field {} -> {}"
-                        #      .format(v, comma_sep_list))
-                    except ValueError:
-                        comma_sep_list = v
-                    parsed_sa_md.setdefault(_k, [])
-                    parsed_sa_md.get(_k).extend(comma_sep_list)
-
-                # sample name field
-                elif k in self._SAMPLE_NAME_FIELD:
-                    _k = "sample_name"  # normalized name
-                    parsed_sa_md.update({_k: v.replace(" ", "_")})
-
-                # bkgd name field
-                elif k in self._BKGD_SAMPLE_NAME_FIELD:
-                    _k = "bkgd_sample_name"
-                    parsed_sa_md.update({_k: v.strip().replace(" ", "_")})
-
-                # dict-like field
-                elif k in self._DICT_LIKE_FIELD:
-                    _k = "".join(takewhile(lambda x: x.isalpha(), k))
-                    parsed_sa_md.update({_k: self._dict_like_parser(v)})
-
-                # other fields don't need to be parsed
-                else:
-                    # _k = ''.join(takewhile(lambda x: x.isalpha(), k))
-                    _k = k.replace(" ", "_")
-                    parsed_sa_md.update({_k: v})
+        """parse a list of sample metadata into desired format
 
-            parsed_sa_md_list.append(parsed_sa_md)
+        The spreadsheet is parsed column by column: each header is
+        normalized and mapped to its parser once and every distinct cell
+        value of a column is parsed only once.
+        """
+        parsed_sa_md_list = [{} for _ in range(len(self.pd_df))]
+        # same values (and dtype upcasting) as iterrows
+        values = self.pd_df.values
+        # duplicated headers: last column wins, at the first position
+        col_ind = {}
+        for j, col in enumerate(self.pd_df.columns):
+            col_ind[col] = j
+        for col, j in col_ind.items():
+            _k, extend, parser = self._column_parser(col)
+            column = values[:, j]
+            cache = {}
+            for i in (~pd.isna(column)).nonzero()[0]:
+                v = str(column[i]).replace("/", "_")  # yaml path correct
+                if v not in cache:
+                    cache[v] = parser(v)
+                parsed = cache[v]
+                if extend:
+                    parsed_sa_md_list[i].setdefault(_k, []).extend(parsed)
+                else:
+                    parsed_sa_md_list[i].update(_copy_md(parsed))
         self.parsed_sa_md_list = parsed_sa_md_list
 
-    def create_yaml(self, bt):
+    def _column_parser(self, col):
+        """map a spreadsheet header to its parser
+
+        Parameters
+        ----------
+        col : object
+            header of the spreadsheet column
+
+        Returns
+        -------
+        key : str
+            normalized key for list fields, None otherwise
+        extend : bool
+            True if the parsed cell extends a list under ``key``, False
+            if the parsed cell is a dict to update the sample md with
+        parser : callable
+            function taking a cell string and returning the parsed value
+        """
+        k = str(col).lower().strip().replace(" ", "_")
+        # name fields
+        if k in self._NAME_FIELD:
+            return k, True, self._parse_name_cell
+        # phase fields
+        elif k in self._PHASE_FIELD:
+            return None, False, self.parse_phase_info
+        # comma separated fields
+        elif k in self._COMMA_SEP_FIELD:
+            _k = "".join(takewhile(lambda x: x.isalpha(), k))
+            return _k, True, self._parse_comma_sep_cell
+        # sample name field
+        elif k in self._SAMPLE_NAME_FIELD:
+            return None, False, lambda v: {"sample_name": v.replace(" ", "_")}
+        # bkgd name field
+        elif k in self._BKGD_SAMPLE_NAME_FIELD:
+            return (
+                None,
+                False,
+                lambda v: {"bkgd_sample_name": v.strip().replace(" ", "_")},
+            )
+        # dict-like field
+        elif k in self._DICT_LIKE_FIELD:
+            _k = "".join(takewhile(lambda x: x.isalpha(), k))
+            return None, False, lambda v: {_k: self._dict_like_parser(v)}
+        # other fields don't need to be parsed
+        else:
+            return None, False, lambda v: {k: v}
+
+    @classmethod
+    def _parse_name_cell(cls, v):
+        try:
+            comma_sep_list = cls._comma_separate_parser(v)
+            parsed_name = []
+            for el in comma_sep_list:
+                parsed_name.extend(cls._name_parser(el))
+        except ValueError:
+            parsed_name = v
+        return parsed_name
+
+    @classmethod
+    def _parse_comma_sep_cell(cls, v):
+        try:
+            comma_sep_list = cls._comma_separate_parser(v)
+        except ValueError:
+            comma_sep_list = v
+        return comma_sep_list
+
+    def validate_sa_md_list(self):
+        """check every parsed row can be turned into a Sample
+
+        Raises
+        ------
+        ValueError
+            if any row misses a sample name. Rows are reported by their
+            position in the spreadsheet.
+        """
+        missing_name_rows = [
+            i
+            for i, d in enumerate(self.parsed_sa_md_list)
+            if not d.get("sample_name")
+        ]
+        if missing_name_rows:
+            raise ValueError(
+                "WARNING: rows {} of the spreadsheet don't have a sample "
+                "name in the column {}.\nNo Sample object has been "
+                "created. Please fix the spreadsheet and import "
+                "again".format(missing_name_rows, self.SAMPLE_NAME_FIELD)
+            )
+
+    def create_yaml(self, bt, bulk=False):
         """instantiate xpdacq.beamtime.Sample objects based on parsed md
 
         it also validate if bkgd_sample_name has already appeared as a
@@ -326,13 +481,20 @@ class ExceltoYaml:
         ----------
         bt : xpdacq.Beamtime object
             an object carries SAF, PI_last and other information
+        bulk : bool, optional
+            option of validating all rows before creating any Sample and
+            writing all Sample yaml files and the sample order file once,
+            at the end of the import. default to False.
 
         Returns
         -------
         None
         """
+        t0 = time.time()
+        if bulk:
+            self.validate_sa_md_list()
         sample_name_set = set(
-            [d["sample_name"] for d in self.parsed_sa_md_list]
+            [d.get("sample_name") for d in self.parsed_sa_md_list]
         )
         no_bkgd_sample_name_list = []
         for d in self.parsed_sa_md_list:
@@ -340,7 +502,18 @@ class ExceltoYaml:
             sample_name = d.get("sample_name")
             if bkgd_name not in sample_name_set:
                 no_bkgd_sample_name_list.append(sample_name)
-            Sample(bt, d)
+        if bulk:
+            with bt.deferred_flush():
+                for d in self.parsed_sa_md_list:
+                    Sample(bt, d)
+        else:
+            for d in self.parsed_sa_md_list:
+                Sample(bt, d)
+        print(
+            "INFO: imported {} samples in {:.3f}s".format(
+                len(self.parsed_sa_md_list), time.time() - t0
+            )
+        )
         if no_bkgd_sample_name_list:
             print(
                 "INFO: If you want to associate a background sample,"
@@ -475,69 +648,19 @@ class ExceltoYaml:
         ValueError
             if ',' is not specified between phases
         """
-        phase_dict = {}
-        composition_dict = {}
-        composition_str = ""
-        # figure out ratio between phases
-        compound_meta = phase_str.split(",")
-        for el in compound_meta:
-            _el = el.strip()
-            # if no ":" in the string
-            if ":" not in _el:
-                com = _el
-                amount = 1.0
-            # ":" in the string
-            else:
-                meta = _el.split(":")
-                # there is a ":" but nothing follows
-                if not meta[1]:
-                    com = meta[0]
-                    amount = 1.0
-                # presumably valid input
-                else:
-                    com, amount = meta
-            # further verify if it's giving as 'X: 10%' format
-            if isinstance(amount, str):
-                amount = amount.strip()
-                amount = amount.replace("%", "")
-            # construct the not normalized phase dict
-            phase_dict.update({com.strip(): float(amount)})
-
-        # normalize phase ratio for composition dict
-        total = sum(phase_dict.values())
-        for k, v in phase_dict.items():
-            ratio = round(v / total, 2)
-            phase_dict[k] = ratio
-
-        # construct composition_dict
-        for k, v in phase_dict.items():
-            # k is compostring, v is phase ratio
-            try:
-                el_list, sto_list = composition_analysis(k.strip())
-            except ValueError:
-                # getx3 parser can't parse it, set default
-                el_list, sto_list = ([k], [v])
-            for el, sto in zip(el_list, sto_list):
-                # sum element
-                if el in composition_dict:
-                    val = composition_dict.get(el)
-                    val += sto * v
-                    composition_dict.update({el: val})
-                else:
-                    # otherwise, just update it
-                    composition_dict.update({el: sto * v})
-
-        # finally, construct composition_str
-        for k, v in sorted(composition_dict.items()):
-            composition_str += str(k) + str(v)
-
-        return composition_dict, phase_dict, composition_str
+        composition_dict, phase_dict, composition_str = _cached_phase_parser(
+            _normalize_phase_str(phase_str)
+        )
+        # cached dicts are shared, hand out copies
+        return dict(composition_dict), dict(phase_dict), composition_str
 
 
 excel_to_yaml = ExceltoYaml(glbl["import_dir"])
 
 
-def import_sample_info(saf_num=None, bt=None, validate_only=False):
+def import_sample_info(
+    saf_num=None, bt=None, validate_only=False, bulk=False
+):
     """ import sample metadata based on a spreadsheet
 
     this function expects a pre-populated '<SAF_number>_sample.xls' file
@@ -558,6 +681,10 @@ def import_sample_info(saf_num=None, bt=None, validate_only=False):
         True, program will go through entire metadata and return
         keys with invalid character but not create Sample objects.
         default to False.
+    bulk : bool, optional
+        option of validating all rows up front and writing the Sample
+        yaml files in a single pass at the end of the import. This is
+        much faster for large spreadsheets. default to False.
     """
 
     if bt is None:
@@ -567,10 +694,14 @@ def import_sample_info(saf_num=None, bt=None, validate_only=False):
         bt = ips.ns_table["user_global"]["bt"]
 
     # pass to core function
-    _import_sample_info(saf_num=saf_num, bt=bt, validate_only=validate_only)
+    _import_sample_info(
+        saf_num=saf_num, bt=bt, validate_only=validate_only, bulk=bulk
+    )
 
 
-def _import_sample_info(saf_num=None, bt=None, validate_only=False):
+def _import_sample_info(
+    saf_num=None, bt=None, validate_only=False, bulk=False
+):
     """ core function to import sample metadata based on a spreadsheet
 
     this function expects a pre-populated '<SAF_number>_sample.xlxs' file
@@ -591,6 +722,10 @@ def _import_sample_info(saf_num=None, bt=None, validate_only=False):
         True, program will go through entire metadata and return
         keys with invalid character but not create Sample objects.
         default to False.
+    bulk : bool, optional
+        option of validating all rows up front and writing the Sample
+        yaml files in a single pass at the end of the import.
+        default to False.
     """
 
     # at core function level, bt should strictly be Beamtime,
@@ -645,5 +780,5 @@ def _import_sample_info(saf_num=None, bt=None, validate_only=False):
         )
         return
     else:
-        excel_to_yaml.create_yaml(bt)
+        excel_to_yaml.create_yaml(bt, bulk=bulk)
         return excel_to_yaml
@@ -0,0 +1,312 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import os
+import glob
+import json
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from bluesky.callbacks.core import CallbackBase
+
+from xpdacq.glbl import glbl
+from xpdacq.xpdacq_conf import xpd_configuration
+
+VERIFY_LOG_FNAME = ".write_verification.jsonl"
+
+
+def verify_run(db, uid, fill=True):
+    """problems found with the data of a run written in a database
+
+    The run is looked up by uid. It must have a stop document, as many
+    events in each stream as the stop document says, a datum for every
+    external reading and the files of its resources on disk. With
+    ``fill``, the external readings are loaded as well, where the
+    database supports it.
+
+    Parameters
+    ----------
+    db : databroker.Broker
+        database the run was written in
+    uid : str
+        uid of the start document of the run
+    fill : bool, optional
+        load the external readings. default to True.
+
+    Returns
+    -------
+    problems : list of str
+        descriptions of the problems found, empty if the run is fine
+    """
+    db = getattr(db, "v1", db)
+    header = db[uid]
+    if header.stop is None:
+        return ["no stop document"]
+    scan = _scan_documents(header)
+    problems = _check_event_counts(header.stop, scan.num_events)
+    problems += _check_datum(scan.referenced, scan.datum_ids)
+    problems += _check_resource_files(scan.resources)
+    if fill and not problems:
+        try:
+            for _ in db.get_events(header, fill=True):
+                pass
+        except NotImplementedError:
+            pass
+    return problems
+
+
+class _DocumentScan(CallbackBase):
+    """what ``verify_run`` checks, gathered from the documents of a run
+
+    The pages of events and datum are unpacked by ``CallbackBase``.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.streams = {}
+        self.external = {}
+        self.num_events = Counter()
+        self.datum_ids = set()
+        self.referenced = set()
+        self.resources = []
+
+    def descriptor(self, doc):
+        self.streams[doc["uid"]] = doc.get("name", "primary")
+        self.external[doc["uid"]] = [
+            key
+            for key, data_key in doc["data_keys"].items()
+            if data_key.get("external")
+        ]
+
+    def event(self, doc):
+        self.num_events[self.streams.get(doc["descriptor"])] += 1
+        for key in self.external.get(doc["descriptor"], []):
+            if not doc.get("filled", {}).get(key):
+                self.referenced.add(doc["data"][key])
+
+    def datum(self, doc):
+        self.datum_ids.add(doc["datum_id"])
+
+    def resource(self, doc):
+        self.resources.append(doc)
+
+
+def _scan_documents(header):
+    """events by stream, datum ids referenced and written, and resources
+    of a run
+    """
+    scan = _DocumentScan()
+    for name, doc in header.documents(fill=False):
+        scan(name, doc)
+    return scan
+
+
+def _check_event_counts(stop, num_events):
+    expected = stop.get("num_events") or {}
+    return [
+        "{} events in stream '{}' instead of {}".format(
+            num_events[stream], stream, num
+        )
+        for stream, num in sorted(expected.items())
+        if num_events[stream] != num
+    ]
+
+
+def _check_datum(referenced, datum_ids):
+    missing = referenced - datum_ids
+    if missing:
+        return ["{} datum missing".format(len(missing))]
+    return []
+
+
+def _check_resource_files(resources):
+    problems = []
+    for resource in resources:
+        path = os.path.join(
+            resource.get("root", ""), resource["resource_path"]
+        )
+        # file writers may add a suffix or a sequence number to the path
+        if not (os.path.exists(path) or glob.glob(glob.escape(path) + "*")):
+            problems.append("file {} missing".format(path))
+    return problems
+
+
+class WriteVerifier:
+    """
+    verify the data of runs in the background, as the runs end
+
+    Subscribed to a RunEngine, the verifier hands the uid of each run
+    ending to a pool of worker threads and returns at once; the next
+    run starts while the workers check the data with ``verify_run``. A
+    run not found in the database yet is looked up again a few times.
+
+    The result for every run is appended to a log file, one json line
+    per run. A run failing verification is reported with a warning
+    and, if ``pause_on_failure`` is True, the RunEngine is asked to
+    pause at its next checkpoint, so the queue can be looked at before
+    going on with ``xrun.resume()``.
+
+    Parameters
+    ----------
+    db : databroker.Broker, optional
+        database the runs are written in. default to the one in
+        ``xpd_configuration``.
+    workers : int, optional
+        number of worker threads. default to 2.
+    pause_on_failure : bool, optional
+        pause the RunEngine on failure. default to False.
+    run_engine : bluesky.RunEngine, optional
+        RunEngine to pause.
+    retries : int, optional
+        number of times a run not found is looked up again. default
+        to 3.
+    retry_delay : float, optional
+        seconds between two look ups. default to 1.
+    fill : bool, optional
+        load the external readings, see ``verify_run``. default to
+        True.
+
+    Examples
+    --------
+    >>> xrun(0, 0, verify_write=True)
+    >>> xrun.write_verifier.wait()
+    >>> xrun.write_verifier.results
+    {'4a7f...': {'uid': '4a7f...', 'passed': True, 'problems': [], ...}}
+    """
+
+    def __init__(
+        self,
+        db=None,
+        workers=2,
+        pause_on_failure=False,
+        run_engine=None,
+        retries=3,
+        retry_delay=1.0,
+        fill=True,
+    ):
+        self.db = db
+        self.workers = workers
+        self.pause_on_failure = pause_on_failure
+        self.run_engine = run_engine
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.fill = fill
+        self.results = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._futures = []
+
+    @property
+    def log_path(self):
+        return os.path.join(glbl["config_base"], VERIFY_LOG_FNAME)
+
+    @property
+    def failures(self):
+        """uids of the runs failing verification so far"""
+        with self._lock:
+            return [
+                uid for uid, res in self.results.items() if not res["passed"]
+            ]
+
+    def __call__(self, name, doc):
+        if name != "stop":
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        future = self._pool.submit(self._verify, doc["run_start"])
+        with self._lock:
+            self._futures.append(future)
+
+    def _database(self):
+        if self.db is not None:
+            return self.db
+        return xpd_configuration["db"]
+
+    def _verify(self, uid):
+        t0 = time.time()
+        for attempt in range(self.retries + 1):
+            try:
+                problems = verify_run(self._database(), uid, fill=self.fill)
+                break
+            except Exception as e:
+                problems = ["{}: {}".format(type(e).__name__, e)]
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay)
+        result = {
+            "uid": uid,
+            "time": time.time(),
+            "passed": not problems,
+            "problems": problems,
+            "duration": time.time() - t0,
+        }
+        with self._lock:
+            self.results[uid] = result
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+        if problems:
+            self._alert(result)
+        return result
+
+    def _alert(self, result):
+        print(
+            "WARNING: data of run {} failed verification: {}".format(
+                result["uid"], "; ".join(result["problems"])
+            )
+        )
+        run_engine = self.run_engine
+        if not self.pause_on_failure or run_engine is None:
+            return
+        if run_engine.state == "running":
+            print(
+                "WARNING: pausing at the next checkpoint, check the data "
+                "then resume with xrun.resume() or stop with xrun.stop()"
+            )
+            run_engine.request_pause(defer=True)
+
+    def wait(self):
+        """wait for the verifications pending, return the results of
+        those submitted since the last wait
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        return [f.result() for f in futures]
+
+    def close(self):
+        """finish the verifications pending and stop the workers"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        with self._lock:
+            self._futures = []
+
+
+def load_verification_log(path=None):
+    """results of the write verifications logged so far, by run uid
+
+    Parameters
+    ----------
+    path : str, optional
+        path of the log. default to the one in ``glbl["config_base"]``.
+    """
+    if path is None:
+        path = os.path.join(glbl["config_base"], VERIFY_LOG_FNAME)
+    if not os.path.isfile(path):
+        return {}
+    results = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                results[result["uid"]] = result
+    return results
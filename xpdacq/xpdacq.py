@@ -14,11 +14,10 @@
 #
 ##############################################################################
 import os
+import copy
 import uuid
-import time
 from textwrap import indent
 
-import yaml
 import warnings
 from pprint import pprint
 from itertools import groupby
@@ -30,34 +29,49 @@ import bluesky.preprocessors as bpp
 from bluesky import RunEngine
 from bluesky.suspenders import SuspendFloor
 from bluesky.utils import normalize_subs_input, single_gen, Msg
-from bluesky.callbacks.broker import verify_files_saved
 from bluesky.preprocessors import pchain
 
 from xpdacq.glbl import glbl
 from xpdacq.tools import xpdAcqException
 from xpdacq.beamtime import ScanPlan, _summarize, close_shutter_stub, \
-    open_shutter_stub
-from xpdacq.xpdacq_conf import xpd_configuration, XPDACQ_MD_VERSION
-from xpdconf.conf import XPD_SHUTTER_CONF
+    open_shutter_stub, shutter_tracker
+from xpdacq.xpdacq_conf import (
+    xpd_configuration,
+    area_det_config,
+    XPDACQ_MD_VERSION,
+)
+from xpdacq.serialization import yaml_load
+from xpdacq.darkframes import dark_registry
+from xpdacq.document_sink import BufferedDocumentSink
+from xpdacq.write_verification import WriteVerifier
+from xpdacq.callback_workers import (
+    ProcessCallback,
+    LiveTableFeed,
+    LiveTableRouter,
+)
 
 XPD_shutter = xpd_configuration.get("shutter")
 
 
+def _area_det_config():
+    """acquisition time and number of frames set on the area detector"""
+    area_det = xpd_configuration["area_det"]
+    acq_time = area_det_config.get("acquire_time")
+    if hasattr(area_det, 'images_per_set'):
+        num_frame = area_det_config.get("images_per_set")
+    else:
+        num_frame = 1
+    return acq_time, num_frame
+
+
 def _update_dark_dict_list(name, doc):
     """ generate dark frame reference
 
     This function should be subscribed to 'stop' documents from dark
     frame runs.
     """
-    # always grab from glbl state
-    dark_dict_list = list(glbl["_dark_dict_list"])
     # obtain light count time that is already set to area_det
-    area_det = xpd_configuration["area_det"]
-    acq_time = area_det.cam.acquire_time.get()
-    if hasattr(area_det, 'images_per_set'):
-        num_frame = area_det.images_per_set.get()
-    else:
-        num_frame = 1
+    acq_time, num_frame = _area_det_config()
     light_cnt_time = acq_time * num_frame
 
     dark_dict = {}
@@ -67,8 +81,7 @@ def _update_dark_dict_list(name, doc):
     dark_dict["uid"] = doc["run_start"]
     if doc["exit_status"] == "success":
         print("dark frame complete, update dark dict")
-        dark_dict_list.append(dark_dict)
-        glbl["_dark_dict_list"] = dark_dict_list  # update glbl._dark_dict_list
+        dark_registry.add(dark_dict)
     else:
         # FIXME: replace with logging and detailed warning next PR
         print(
@@ -85,11 +98,7 @@ def take_dark():
     # upto this stage, area_det has been configured to so exposure time is
     # correct
     area_det = xpd_configuration["area_det"]
-    acq_time = area_det.cam.acquire_time.get()
-    if hasattr(area_det, 'images_per_set'):
-        num_frame = area_det.images_per_set.get()
-    else:
-        num_frame = 1
+    acq_time, num_frame = _area_det_config()
     computed_exposure = acq_time * num_frame
     # update md
     _md = {
@@ -106,56 +115,69 @@ def take_dark():
     print("opening shutter...")
 
 
+def _dark_then_open_run(msg, acq_time, exposure, reason):
+    """take a dark frame, then open the light run referring to it"""
+    area_det = xpd_configuration["area_det"]
+    # Annoying detail: the detector was probably already staged.
+    # Unstage it (if it wasn't staged, nothing will happen) and
+    # then take_dark() and then re-stage it.
+    yield from bps.unstage(area_det)
+    yield from take_dark()
+    yield from bps.stage(area_det)
+    dark_uid = dark_registry.best(acq_time, exposure, glbl["dk_window"] * 60)
+    if dark_uid is None:
+        reason += ", the new dark frame failed"
+    msg.kwargs["sc_dk_field_uid"] = dark_uid
+    msg.kwargs["sc_dk_decision"] = {"action": "new_dark", "reason": reason}
+    yield from bpp.single_gen(msg)
+    return (yield from open_shutter_stub())
+
+
 def periodic_dark(plan):
     """
     a plan wrapper that takes a plan and inserts `take_dark`
 
     The `take_dark` plan is inserted on the fly before the beginning of
-    any new run after a period of time defined by glbl['dk_window'] has passed.
+    any new run that has no dark frame with the same acquisition time
+    and exposure taken within the last glbl['dk_window'] minutes.
+
+    Only ``open_run`` messages are looked at. The detector configuration
+    is read once per run, and the decision is recorded in the start
+    document: ``sc_dk_field_uid`` is the uid of the dark frame and
+    ``sc_dk_decision`` tells if it was reused or newly taken and why.
     """
-    need_dark = True
 
     def insert_take_dark(msg):
-        now = time.time()
-        nonlocal need_dark
-        qualified_dark_uid = _validate_dark(expire_time=glbl["dk_window"])
-        area_det = xpd_configuration["area_det"]
-
-        if (not need_dark) and (not qualified_dark_uid):
-            need_dark = True
-        if (
-            need_dark
-            and (not qualified_dark_uid)
-            and msg.command == "open_run"
-            and ("dark_frame" not in msg.kwargs)
-        ):
+        if msg.command != "open_run" or "dark_frame" in msg.kwargs:
+            return None, None
+        acq_time, num_frame = _area_det_config()
+        exposure = acq_time * num_frame
+        max_age = glbl["dk_window"] * 60
+        dark_uid = dark_registry.best(acq_time, exposure, max_age)
+        if dark_uid is None:
             # We are about to start a new 'run' (e.g., a count or a scan).
             # Insert a dark frame run first.
-            need_dark = False
-            # Annoying detail: the detector was probably already staged.
-            # Unstage it (if it wasn't staged, nothing will happen) and
-            # then take_dark() and then re-stage it.
-            return (
-                bpp.pchain(
-                    bps.unstage(area_det),
-                    take_dark(),
-                    bps.stage(area_det),
-                    bpp.single_gen(msg),
-                    open_shutter_stub(),
-                ),
-                None,
-            )
-        elif msg.command == "open_run" and "dark_frame" not in msg.kwargs:
+            old_dark = dark_registry.best(acq_time, exposure, float("inf"))
+            if old_dark is not None:
+                reason = "dark frames are older than {} min".format(
+                    glbl["dk_window"]
+                )
+            else:
+                reason = (
+                    "no dark frame with acq_time {} s and exposure {} s"
+                ).format(acq_time, exposure)
             return (
-                bpp.pchain(
-                    bpp.single_gen(msg),
-                    open_shutter_stub()
-                ),
+                _dark_then_open_run(msg, acq_time, exposure, reason),
                 None,
             )
-        else:
-            # do nothing if (not need_dark)
-            return None, None
+        msg.kwargs["sc_dk_field_uid"] = dark_uid
+        msg.kwargs["sc_dk_decision"] = {
+            "action": "reuse",
+            "reason": "dark frame taken within {} min".format(
+                glbl["dk_window"]
+            ),
+        }
+        return bpp.pchain(bpp.single_gen(msg), open_shutter_stub()), None
 
     return (yield from bpp.plan_mutator(plan, insert_take_dark))
 
@@ -168,39 +190,14 @@ def _validate_dark(expire_time=None):
     """
     if expire_time is None:
         expire_time = glbl["dk_window"]
-    dark_dict_list = glbl["_dark_dict_list"]
     # if glbl.dark_dict_list = None, do a dark anyway
-    if not dark_dict_list:
+    if not glbl["_dark_dict_list"]:
         return None
     # obtain light count time that is already set to pe1c
-    area_det = xpd_configuration["area_det"]
-    acq_time = area_det.cam.acquire_time.get()
-    if hasattr(area_det, 'images_per_set'):
-        num_frame = area_det.images_per_set.get()
-    else:
-        num_frame = 1
+    acq_time, num_frame = _area_det_config()
     light_cnt_time = acq_time * num_frame
-    # find fresh and qualified dark
-    now = time.time()
-    qualified_dark_list = []
-    for el in dark_dict_list:
-        expo_diff = abs(el["exposure"] - light_cnt_time)
-        time_diff = abs(el["timestamp"] - now)
-        if (
-            (expo_diff < acq_time)
-            and (time_diff < expire_time * 60)
-            and (el["acq_time"] == acq_time)
-        ):
-            qualified_dark_list.append((el.get("uid"), expo_diff, time_diff))
-    if qualified_dark_list:
-        # sort wrt expo_diff and time_diff for best candidate
-        # best_dark = sorted(qualified_dark_list,
-        #                   key=lambda x: x[1] and x[2])[0]
-        best_dark = sorted(qualified_dark_list, key=lambda x: x[2])[0]
-        best_dark_uid = best_dark[0]
-        return best_dark_uid
-    else:
-        return None
+    # freshest dark with the same acq_time and a close exposure
+    return dark_registry.best(acq_time, light_cnt_time, expire_time * 60)
 
 
 def show_calib():
@@ -217,15 +214,80 @@ def show_calib():
         print("INFO: no calibration has been perfomed yet")
 
 
+class _CalibrationCache:
+    """
+    contents of the calibration file, read again only when the file
+    changes
+
+    A cached dict is reused while the path, modification time and size of
+    the file are unchanged. ``run_calibration`` also drops the cache
+    explicitly once it has produced a new file.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.calib_dict = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, fpath):
+        """calibration dict stored in ``fpath``, None if no such file"""
+        try:
+            st = os.stat(fpath)
+        except FileNotFoundError:
+            self.invalidate()
+            return None
+        key = (fpath, st.st_mtime_ns, st.st_size)
+        if key == self.key:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with open(fpath) as f:
+                self.calib_dict = yaml_load(f)
+            self.key = key
+        return self.calib_dict
+
+    def invalidate(self):
+        self.key = None
+        self.calib_dict = None
+
+
+_calibration_cache = _CalibrationCache()
+
+
+def invalidate_calibration_cache():
+    """make the next run read the calibration file again"""
+    _calibration_cache.invalidate()
+
+
+def calibration_cache_info():
+    """numbers of calibration file reads served from the cache (hits)
+    and from the file (misses)
+
+    Returns
+    -------
+    info : dict
+        dictionary with ``hits`` and ``misses`` keys
+    """
+    return {
+        "hits": _calibration_cache.hits,
+        "misses": _calibration_cache.misses,
+    }
+
+
 def _auto_load_calibration_file(in_scan=True):
     """function to load the most recent calibration file in config_base
 
+    The file is only read again when it changes, see
+    ``invalidate_calibration_cache``.
+
     Returns
     -------
     calib_dict : dict
     dictionary contains calibration parameters computed by pyFAI
     and file name of the most recent calibration. If no calibration
-    file exits in xpdUser/config_base, returns None.
+    file exits in xpdUser/config_base, returns None. The dictionary is a
+    copy that the caller may modify.
     """
 
     config_dir = glbl["config_base"]
@@ -235,8 +297,9 @@ def _auto_load_calibration_file(in_scan=True):
             " exist, did you accidentally delete it?".format(config_dir)
         )
     calib_yaml_name = os.path.join(config_dir, glbl["calib_config_name"])
+    calib_dict = _calibration_cache.load(calib_yaml_name)
     # no calib, skip
-    if not os.path.isfile(calib_yaml_name):
+    if calib_dict is None:
         if in_scan:
             print(
                 "INFO: No calibration file found in config_base.\n"
@@ -244,14 +307,12 @@ def _auto_load_calibration_file(in_scan=True):
             )
         return
     else:
-        with open(calib_yaml_name) as f:
-            calib_dict = yaml.unsafe_load(f)
         if in_scan:
             print(
                 "INFO: This scan will append calibration parameters "
                 "recorded in {}".format(calib_dict["poni_file_name"])
             )
-        return calib_dict
+        return copy.deepcopy(calib_dict)
 
 
 def _inject_filter_positions(msg):
@@ -268,7 +329,12 @@ def _inject_filter_positions(msg):
 
 
 def _inject_qualified_dark_frame_uid(msg):
-    if msg.command == "open_run" and msg.kwargs.get("dark_frame") is not True:
+    # the dark strategy may have set it already, see periodic_dark
+    if (
+        msg.command == "open_run"
+        and msg.kwargs.get("dark_frame") is not True
+        and "sc_dk_field_uid" not in msg.kwargs
+    ):
         dark_uid = _validate_dark(glbl["dk_window"])
         msg.kwargs["sc_dk_field_uid"] = dark_uid
     return msg
@@ -427,6 +493,100 @@ xrun.halt()      Emergency Stop: Do not perform cleanup --- just stop.
 """
 
 
+class OpenRunInjectors:
+    """
+    ordered registry of the functions injecting metadata in open_run
+
+    Each injector takes the ``open_run`` message and returns it with
+    more metadata in ``msg.kwargs``. All of them are applied by a single
+    message mutator, see ``mutator``, which only looks at ``open_run``
+    messages. Injectors run by increasing ``order``, then by order of
+    registration.
+
+    Examples
+    --------
+    >>> def inject_operator(msg):
+    ...     msg.kwargs["operator"] = "Billinge"
+    ...     return msg
+    >>> xrun.open_run_injectors.register(inject_operator, order=600)
+    >>> xrun.open_run_injectors.unregister("inject_operator")
+    """
+
+    def __init__(self):
+        self._injectors = []
+        self._seq = 0
+
+    def register(self, func, *, name=None, order=0, condition=None):
+        """register an injector
+
+        Parameters
+        ----------
+        func : callable
+            function taking the ``open_run`` message and returning it.
+        name : str, optional
+            name of the injector, default to the name of ``func``. An
+            injector registered under the same name is replaced.
+        order : float, optional
+            injectors run by increasing order. default to 0.
+        condition : callable, optional
+            function without argument telling if the injector applies to
+            a plan. It is evaluated when the plan is executed. default to
+            always.
+        """
+        if name is None:
+            name = func.__name__
+        self.unregister(name)
+        self._injectors.append((order, self._seq, name, func, condition))
+        self._injectors.sort(key=lambda x: x[:2])
+        self._seq += 1
+
+    def unregister(self, name):
+        """remove the injector registered as ``name``, if any"""
+        if callable(name):
+            name = name.__name__
+        self._injectors = [el for el in self._injectors if el[2] != name]
+
+    @property
+    def names(self):
+        """names of the registered injectors, in running order"""
+        return [el[2] for el in self._injectors]
+
+    def mutator(self):
+        """message function applying the injectors that apply now"""
+        funcs = [
+            func
+            for _, _, _, func, condition in self._injectors
+            if condition is None or condition()
+        ]
+
+        def inject_open_run_md(msg):
+            if msg.command == "open_run":
+                for func in funcs:
+                    msg = func(msg)
+            return msg
+
+        return inject_open_run_md
+
+
+def _default_open_run_injectors():
+    """injectors applied to every run of xrun"""
+    injectors = OpenRunInjectors()
+    injectors.register(
+        _inject_qualified_dark_frame_uid,
+        order=100,
+        condition=lambda: glbl["shutter_control"] and glbl["auto_dark"],
+    )
+    injectors.register(
+        _inject_calibration_md,
+        order=200,
+        condition=lambda: glbl["auto_load_calib"],
+    )
+    injectors.register(_inject_xpdacq_md_version, order=300)
+    injectors.register(_inject_analysis_stage, order=400)
+    injectors.register(_inject_filter_positions, order=500)
+    return injectors
+
+
 class CustomizedRunEngine(RunEngine):
     """A RunEngine customized for XPD workflows.
 
@@ -441,6 +601,17 @@ class CustomizedRunEngine(RunEngine):
     ----------
     beamtime
         beamtime object currently associated with this RunEngine instance.
+    open_run_injectors : OpenRunInjectors
+        functions injecting metadata in the start document of every run.
+    document_sink : BufferedDocumentSink or None
+        sink inserting the documents into the database, see
+        ``install_document_sink``.
+    write_verifier : WriteVerifier or None
+        verifier of the data of the runs run with ``verify_write=True``,
+        created on first use.
+    process_callbacks : dict
+        persistent worker processes of callbacks, by factory, see
+        ``process_callback``.
 
     Examples
     --------
@@ -466,6 +637,93 @@ class CustomizedRunEngine(RunEngine):
         super().__init__(*args, **kwargs)
         self._beamtime = beamtime
         self.pause_msg = PAUSE_MSG
+        self.open_run_injectors = _default_open_run_injectors()
+        self.document_sink = None
+        self._document_sink_token = None
+        self.write_verifier = None
+        self.process_callbacks = {}
+
+    def install_document_sink(self, insert, **kwargs):
+        """insert the documents of all runs from a background thread
+
+        Parameters
+        ----------
+        insert : callable
+            function inserting a document, e.g. ``db.insert``.
+        kwargs :
+            passed to ``BufferedDocumentSink``.
+
+        Returns
+        -------
+        sink : BufferedDocumentSink
+            the sink, also available as ``document_sink``. The sink
+            installed before, if any, is flushed and replaced.
+
+        Examples
+        --------
+        >>> xrun.install_document_sink(db.insert)
+        """
+        if self.document_sink is not None:
+            self.unsubscribe(self._document_sink_token)
+            self.document_sink.close()
+        self.document_sink = BufferedDocumentSink(insert, **kwargs)
+        self._document_sink_token = self.subscribe(self.document_sink)
+        return self.document_sink
+
+    def process_callback(self, factory, **kwargs):
+        """persistent worker process running the callback of ``factory``
+
+        The worker is started once per factory and reused by every run
+        it is subscribed to, until ``close_process_callbacks``.
+
+        Parameters
+        ----------
+        factory : callable
+            picklable function returning the callback, see
+            ``ProcessCallback``. The same object gives the same worker.
+        kwargs :
+            passed to ``ProcessCallback`` when the worker is created.
+
+        Returns
+        -------
+        cb : ProcessCallback
+            callback forwarding the documents to the worker
+
+        Examples
+        --------
+        For the runs of one call
+
+        >>> plot = functools.partial(LivePlot, 'temperature')
+        >>> xrun(0, 0, subs=xrun.process_callback(plot))
+
+        or for all runs
+
+        >>> xrun.subscribe(xrun.process_callback(plot))
+        """
+        cb = self.process_callbacks.get(factory)
+        if cb is None:
+            cb = ProcessCallback(factory, **kwargs)
+            self.process_callbacks[factory] = cb
+        return cb
+
+    def close_process_callbacks(self):
+        """send the documents left to the workers of ``process_callback``
+        and stop them
+        """
+        callbacks, self.process_callbacks = self.process_callbacks, {}
+        for cb in callbacks.values():
+            cb.close()
+
+    def _live_table_worker(self):
+        return self.process_callback(LiveTableRouter)
+
+    def _run_xpd_plan(self, plan, subs, **metadata_kw):
+        # the live tables of the plans go to one persistent worker
+        LiveTableFeed.worker_hook = self._live_table_worker
+        try:
+            return super().__call__(plan, subs, **metadata_kw)
+        finally:
+            LiveTableFeed.worker_hook = None
 
     @property
     def beamtime(self):
@@ -510,7 +768,7 @@ class CustomizedRunEngine(RunEngine):
             sample = [self.translate_to_sample(s) for s in sample]
         if isinstance(sample, int):
             try:
-                sample = list(self.beamtime.samples.values())[sample]
+                sample = self.beamtime.samples.by_index(sample)
             except IndexError:
                 print(
                     "WARNING: hmm, there is no sample with index `{}`"
@@ -551,7 +809,7 @@ class CustomizedRunEngine(RunEngine):
         else:
             if isinstance(plan, int):
                 try:
-                    plan = list(self.beamtime.scanplans.values())[plan]
+                    plan = self.beamtime.scanplans.by_index(plan)
                 except IndexError:
                     print(
                         "WARNING: hmm, there is no scanplan with index `{}`"
@@ -646,10 +904,16 @@ class CustomizedRunEngine(RunEngine):
               lists of callables; valid keys are {'all', 'start', 'stop',
               'event', 'descriptor'}
 
+            Slow callbacks can run in a persistent worker process, from
+            ``xrun.process_callback``.
+
         verify_write: bool, optional
             Double check if the data have been written into database.
-            In general data is written in a lossless fashion at the
-            NSLS-II. Therefore, False by default.
+            The runs are verified in the background by
+            ``write_verifier`` while the next ones go on, and the
+            results are logged in ``glbl['config_base']``. In general
+            data is written in a lossless fashion at the NSLS-II.
+            Therefore, False by default.
         dark_strategy: callable, optional.
             Protocol of taking dark frame during experiment. Default
             to the logic of matching dark frame and light frame with
@@ -700,7 +964,7 @@ class CustomizedRunEngine(RunEngine):
                         print(
                             indent(
                                 "{}".format(
-                                    list(self.beamtime.scanplans.values())[pp]
+                                    self.beamtime.scanplans.by_index(pp)
                                 ),
                                 "\t",
                             )
@@ -737,7 +1001,9 @@ class CustomizedRunEngine(RunEngine):
 
         _subs = normalize_subs_input(subs)
         if verify_write:
-            _subs.update({"stop": verify_files_saved})
+            if self.write_verifier is None:
+                self.write_verifier = WriteVerifier(run_engine=self)
+            _subs["stop"].append(self.write_verifier)
 
         if self._beamtime and self._beamtime.get("bt_wavelength") is None:
             print(
@@ -750,29 +1016,25 @@ class CustomizedRunEngine(RunEngine):
             # only works if user allows shutter control
             if glbl["auto_dark"]:
                 plan = dark_strategy(plan)
-                plan = bpp.msg_mutator(plan, _inject_qualified_dark_frame_uid)
-            # force to close shutter after scan
-            plan = bpp.finalize_wrapper(
-                plan,
-                bps.abs_set(
-                    xpd_configuration["shutter"],
-                    XPD_SHUTTER_CONF["close"],
-                    wait=True,
-                ),
-            )
+            # force to close shutter after scan, whatever the tracker says
+            plan = bpp.finalize_wrapper(plan, close_shutter_stub())
 
-        # Load calibration file
-        if glbl["auto_load_calib"]:
-            plan = bpp.msg_mutator(plan, _inject_calibration_md)
-        # Insert xpdacq md version
-        plan = bpp.msg_mutator(plan, _inject_xpdacq_md_version)
-        # Insert analysis stage tag
-        plan = bpp.msg_mutator(plan, _inject_analysis_stage)
-        # Insert filter metadata
-        plan = bpp.msg_mutator(plan, _inject_filter_positions)
+        # Insert dark frame uid, calibration, xpdacq md version, analysis
+        # stage and filter metadata in one pass
+        plan = bpp.msg_mutator(plan, self.open_run_injectors.mutator())
 
         # Execute
-        return super().__call__(plan, subs, **metadata_kw)
+        shutter_tracker.reset_stats()
+        shutter_tracker.forget()
+        uids = self._run_xpd_plan(plan, _subs, **metadata_kw)
+        if shutter_tracker.skipped_moves:
+            print(
+                "INFO: {} redundant shutter moves skipped, {:.1f}s "
+                "saved".format(
+                    shutter_tracker.skipped_moves, shutter_tracker.saved_time
+                )
+            )
+        return uids
 
 
 # For convenience, define short plans the use these custom commands.
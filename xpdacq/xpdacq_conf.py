@@ -20,16 +20,21 @@ import os
 import platform
 import pprint
 import subprocess
-import time
 import warnings
 
-import yaml
-
+import bluesky.plan_stubs as bps
+from ophyd.status import wait as status_wait
 from xpdconf.conf import glbl_dict, GLBL_YAML_PATH
 from .tools import xpdAcqException
+from .serialization import yaml_load, yaml_dump
 from .yamldict import YamlDict
 
 glbl_dict.pop("exp_db")
+# keep the shutter open between frames of a tseries if the next frame
+# starts within this number of seconds, 0 to always close it
+glbl_dict.setdefault("shutter_keep_open", 0)
+# print the live tables of the plans from a worker process
+glbl_dict.setdefault("isolate_live_table", False)
 XPDACQ_MD_VERSION = 0.1
 
 # special function and dict to store all necessary objects
@@ -47,28 +52,177 @@ def configure_device(*, area_det, shutter, temp_controller, db, **kwargs):
     xpd_configuration.update(**kwargs)
 
 
-def configure_frame_acq_time(new_frame_acq_time):
-    """function to configure frame acquire time of area detector"""
-    area_det = xpd_configuration["area_det"]
-    # stop acquisition
-    area_det.cam.acquire.put(0)
-    time.sleep(1)
-    if hasattr(area_det, 'number_of_sets'):
-        area_det.number_of_sets.put(1)
-    area_det.cam.acquire_time.put(new_frame_acq_time)
-    # extra wait time for device to set
-    time.sleep(1)
-    area_det.cam.acquire.put(1)
+class AreaDetConfig:
+    """
+    last known configuration of the area detector
+
+    Values of ``cam.acquire_time`` and ``images_per_set`` of
+    xpd_configuration['area_det'] are read once and then kept up to date
+    through ophyd subscriptions, so a change made outside of xpdAcq,
+    e.g. from CSS, is seen as well. The cache starts over whenever
+    another detector is configured.
+
+    Examples
+    --------
+    >>> area_det_config.get("acquire_time")
+    0.1
+    >>> area_det_config.changed("images_per_set", 50)
+    True
+    """
+
+    def __init__(self):
+        self._det = None
+        self._values = {}
+        self._cids = []
+
+    @staticmethod
+    def _signals(det):
+        signals = {"acquire_time": det.cam.acquire_time}
+        if hasattr(det, "images_per_set"):
+            signals["images_per_set"] = det.images_per_set
+        return signals
+
+    def _attach(self):
+        det = xpd_configuration["area_det"]
+        if det is self._det:
+            return det
+        self.detach()
+        for key, sig in self._signals(det).items():
+            cid = sig.subscribe(self._updater(key), run=False)
+            self._cids.append((sig, cid))
+        self._det = det
+        return det
+
+    def _updater(self, key):
+        def update(value, **kwargs):
+            self._values[key] = value
+
+        return update
+
+    def detach(self):
+        """drop the subscriptions and the known values"""
+        for sig, cid in self._cids:
+            sig.unsubscribe(cid)
+        self._cids = []
+        self._values = {}
+        self._det = None
+
+    def get(self, key):
+        """value of 'acquire_time' or 'images_per_set'"""
+        det = self._attach()
+        if key not in self._values:
+            self._values[key] = self._signals(det)[key].get()
+        return self._values[key]
+
+    def changed(self, key, value):
+        """tell if putting ``value`` would change the detector"""
+        return self.get(key) != value
+
+    def record(self, key, value):
+        """note a value that has just been put to the detector"""
+        self._attach()
+        self._values[key] = value
+
+    def forget(self, key):
+        """read ``key`` from the detector next time
+
+        To be used after a set message in a plan: the plan may be
+        iterated without being executed, e.g. to summarize it, so the
+        value can't be recorded.
+        """
+        self._values.pop(key, None)
+
+
+area_det_config = AreaDetConfig()
+
+
+# seconds to wait for the area detector to acknowledge a setting
+FRAME_ACQ_TIME_TIMEOUT = 10
+
+
+def _frame_acq_time_steps(area_det, new_frame_acq_time):
+    """(signal, value) to set in order to run the detector at a frame
+    acquire time, none if it already does
+    """
+    changed = area_det_config.changed("acquire_time", new_frame_acq_time)
+    if not changed and area_det.cam.acquire.get():
+        return []
+    steps = []
+    if changed:
+        # stop acquisition
+        steps.append((area_det.cam.acquire, 0))
+    if hasattr(area_det, "number_of_sets"):
+        steps.append((area_det.number_of_sets, 1))
+    if changed:
+        steps.append((area_det.cam.acquire_time, new_frame_acq_time))
+    # (re)start acquisition
+    steps.append((area_det.cam.acquire, 1))
+    return steps
+
+
+def _print_frame_acq_time(new_frame_acq_time):
     print(
         "INFO: area detector has been configured to new "
         "acquisition time (time per frame)  = {}s".format(new_frame_acq_time)
     )
 
 
+def configure_frame_acq_time(new_frame_acq_time, timeout=None):
+    """function to configure frame acquire time of area detector
+
+    Each setting waits for the detector to report it back, instead of
+    sleeping a fixed time. Nothing is done if the detector already runs
+    at this frame acquisition time; a stopped detector is restarted.
+
+    Parameters
+    ----------
+    new_frame_acq_time : float
+        acquisition time per frame, in seconds
+    timeout : float, optional
+        maximum time to wait for each setting, in seconds. default to
+        ``FRAME_ACQ_TIME_TIMEOUT``.
+
+    See Also
+    --------
+    configure_frame_acq_time_plan
+    """
+    area_det = xpd_configuration["area_det"]
+    steps = _frame_acq_time_steps(area_det, new_frame_acq_time)
+    if not steps:
+        return
+    if timeout is None:
+        timeout = FRAME_ACQ_TIME_TIMEOUT
+    for sig, val in steps:
+        status_wait(sig.set(val), timeout=timeout)
+    area_det_config.record("acquire_time", new_frame_acq_time)
+    _print_frame_acq_time(new_frame_acq_time)
+
+
+def configure_frame_acq_time_plan(new_frame_acq_time):
+    """plan stub configuring the frame acquire time of area detector
+
+    Same as ``configure_frame_acq_time``, to be used inside a plan.
+
+    Examples
+    --------
+    >>> def my_plan():
+    ...     yield from configure_frame_acq_time_plan(0.2)
+    ...     yield from ct([pe1c], 5)
+    """
+    area_det = xpd_configuration["area_det"]
+    steps = _frame_acq_time_steps(area_det, new_frame_acq_time)
+    if not steps:
+        return
+    for sig, val in steps:
+        yield from bps.abs_set(sig, val, wait=True)
+    area_det_config.forget("acquire_time")
+    _print_frame_acq_time(new_frame_acq_time)
+
+
 def _verify_within_test(beamline_config_fp, verif):
     while verif != "y":
         with open(beamline_config_fp, "r") as f:
-            beamline_config = yaml.unsafe_load(f)
+            beamline_config = yaml_load(f)
         warnings.warn("Not verified")
         verif = "y"
     beamline_config["Verified by"] = "AUTO VERIFIED IN TEST"
@@ -77,7 +231,7 @@ def _verify_within_test(beamline_config_fp, verif):
         "%Y-%m-%d %H:%M:%S"
     )
     with open(beamline_config_fp, "w") as f:
-        yaml.dump(beamline_config, f)
+        yaml_dump(beamline_config, f)
     return beamline_config
 
 
@@ -97,7 +251,7 @@ def _load_beamline_config(beamline_config_fp, verif="", test=False):
     if not test:
         while verif.upper() != ("Y" or "YES"):
             with open(beamline_config_fp, "r") as f:
-                beamline_config = yaml.unsafe_load(f)
+                beamline_config = yaml_load(f)
             pp.pprint(beamline_config)
             verif = input("\nIs this configuration correct? y/n: ")
             if verif.upper() == ("N" or "NO"):
@@ -109,7 +263,7 @@ def _load_beamline_config(beamline_config_fp, verif="", test=False):
             "%Y-%m-%d %H:%M:%S"
         )
         with open(beamline_config_fp, "w") as f:
-            yaml.dump(beamline_config, f)
+            yaml_dump(beamline_config, f)
     else:
         beamline_config = _verify_within_test(beamline_config_fp, verif)
     return beamline_config
@@ -127,7 +281,7 @@ def _reload_glbl(glbl_yaml_path=None):
         glbl_yaml_path = glbl_dict["glbl_yaml_path"]
     if os.path.isfile(glbl_yaml_path):
         with open(glbl_dict["glbl_yaml_path"]) as f:
-            reload_dict = yaml.unsafe_load(f)
+            reload_dict = yaml_load(f)
         return reload_dict
     else:
         pass
@@ -166,7 +320,13 @@ class GlblYamlDict(YamlDict):
     """
 
     # required attributes for yaml
-    _VALID_ATTRS = ["_name", "_filepath", "filepath", "_referenced_by"]
+    _VALID_ATTRS = [
+        "_name",
+        "_filepath",
+        "filepath",
+        "_referenced_by",
+        "_last_dump",
+    ]
 
     # keys for fields allowed to change
     _MUTABLE_FIELDS = [
@@ -175,6 +335,8 @@ class GlblYamlDict(YamlDict):
         "dk_window",
         "_dark_dict_list",
         "shutter_control",
+        "shutter_keep_open",
+        "isolate_live_table",
         "auto_load_calib",
         "calib_config_name",
         "calib_config_dict",
@@ -226,7 +388,7 @@ class GlblYamlDict(YamlDict):
     @classmethod
     def from_yaml(cls, f):
         """method to reload object from local yaml"""
-        d = yaml.unsafe_load(f)
+        d = yaml_load(f)
         instance = cls.from_dict(d)
         if not isinstance(f, str):
             instance.filepath = os.path.abspath(f.name)
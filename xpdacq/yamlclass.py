@@ -15,7 +15,8 @@
 ##############################################################################
 
 import os
-import yaml
+
+from .serialization import yaml_dump
 
 
 class YamlClass:
@@ -62,4 +63,4 @@ class YamlClass:
     def flush(self):
         """method to yamlize allowed attributes"""
         with open(self._filepath, "w") as f:
-            yaml.dump(self._internal_dict, f, default_flow_style=False)
+            yaml_dump(self._internal_dict, f, default_flow_style=False)
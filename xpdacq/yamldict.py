@@ -12,10 +12,206 @@ from __future__ import (
     unicode_literals,
 )
 import os
-import tempfile
-import yaml
 import abc
-from collections import ChainMap
+import atexit
+import tempfile
+import threading
+import contextlib
+from collections import ChainMap, OrderedDict
+
+from .serialization import yaml_load, yaml_dump
+
+# files are written through mkstemp, which ignores the umask. Record it once
+# so rewritten files keep the permissions a plain ``open`` would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _atomic_write(fpath, text):
+    """write text to fpath without ever exposing a truncated file
+
+    The contents go to a hidden temporary file in the same directory,
+    which is synced and then renamed over ``fpath``. A crash at any point
+    leaves either the old or the new file, never a partial one.
+    """
+    dirname = os.path.dirname(fpath) or "."
+    fd, tmp_fpath = tempfile.mkstemp(
+        dir=dirname, prefix="." + os.path.basename(fpath) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_fpath, 0o666 & ~_UMASK)
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+
+
+class _BackgroundWriter(threading.Thread):
+    """daemon thread committing dirty objects after a quiet period"""
+
+    def __init__(self, engine, delay):
+        super().__init__(name="xpdacq-yaml-writer", daemon=True)
+        self.engine = engine
+        self.delay = delay
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        self.join()
+
+    def run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            # coalesce the burst of changes that woke us up
+            self._stopping.wait(self.delay)
+            self._wake.clear()
+            try:
+                self.engine._commit_from_writer()
+            except Exception as e:
+                print(
+                    "WARNING: background yaml writer failed: "
+                    "{}".format(e)
+                )
+
+
+class YamlFlushEngine:
+    """
+    Coordinate the writes of yaml-backed objects to disk
+
+    Objects report themselves dirty through ``mark_dirty`` whenever their
+    contents change. By default the dirty objects are written right away,
+    preserving the write-through behavior of ``YamlDict``. Inside a
+    ``deferred`` block, or while the background writer is running, dirty
+    objects are collected and each one is written once when the batch is
+    committed, no matter how many times it changed. Files whose contents
+    did not change since the last write are not rewritten, and every write
+    goes through a temporary file and an atomic rename.
+
+    Examples
+    --------
+    Batch many edits into a single write per file.
+
+    >>> with flush_engine.deferred():
+    ...     bt['new_field'] = 1
+    ...     bt['other_field'] = 2
+
+    Let a daemon thread coalesce bursts of edits.
+
+    >>> flush_engine.start_background_writer(delay=0.5)
+    """
+
+    def __init__(self):
+        # guards the contents of yaml objects and the pending queue
+        self.lock = threading.RLock()
+        # serializes the file-writing phase of commits
+        self._io_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._deferred = 0
+        self._writer = None
+        self.write_count = 0
+        self.skip_count = 0
+
+    @property
+    def pending(self):
+        """objects waiting to be written"""
+        with self.lock:
+            return list(self._pending.values())
+
+    @property
+    def background(self):
+        """True if the background writer is running"""
+        return self._writer is not None
+
+    def mark_dirty(self, obj):
+        """schedule obj, and the objects referencing it, for writing"""
+        with self.lock:
+            stack = [obj]
+            while stack:
+                el = stack.pop()
+                if id(el) in self._pending:
+                    continue
+                self._pending[id(el)] = el
+                stack.extend(reversed(getattr(el, "_referenced_by", [])))
+            if self._deferred:
+                return
+            if self._writer is not None:
+                self._writer.notify()
+                return
+        self.commit()
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """context manager holding back writes until the block exits"""
+        with self.lock:
+            self._deferred += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._deferred -= 1
+                done = not self._deferred
+            if done:
+                self.commit()
+
+    def commit(self):
+        """write every pending object to disk"""
+        with self._io_lock:
+            with self.lock:
+                pending = list(self._pending.values())
+                self._pending.clear()
+                snapshots = [(obj, obj._snapshot()) for obj in pending]
+            for obj, snapshot in snapshots:
+                if snapshot is None:
+                    self.skip_count += 1
+                    continue
+                fpath, text = snapshot
+                _atomic_write(fpath, text)
+                obj._last_dump = snapshot
+                self.write_count += 1
+
+    def _commit_from_writer(self):
+        # a deferred block commits its own batch when it exits
+        if not self._deferred:
+            self.commit()
+
+    def start_background_writer(self, delay=0.5):
+        """write dirty objects from a daemon thread
+
+        Parameters
+        ----------
+        delay : float, optional
+            seconds to wait after the first change of a burst before
+            writing, so that the whole burst is written once. default is
+            0.5s.
+        """
+        with self.lock:
+            if self._writer is not None:
+                self._writer.delay = delay
+                return
+            self._writer = _BackgroundWriter(self, delay)
+            self._writer.start()
+
+    def stop_background_writer(self):
+        """stop the background writer and write what is still pending"""
+        with self.lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.stop()
+        self.commit()
+
+
+flush_engine = YamlFlushEngine()
+atexit.register(flush_engine.stop_background_writer)
 
 
 class _YamlDictLike:
@@ -23,12 +219,14 @@ class _YamlDictLike:
     A dict-like wrapper over a YAML file
 
     Supports the dict-like (MutableMapping) interface plus a `flush` method
-    to manually update the file to the state of the dict.
+    to manually update the file to the state of the dict. Writes are
+    scheduled through ``flush_engine``, see ``YamlFlushEngine``.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._referenced_by = []  # to be flushed whenever this is flushed
+        self._last_dump = None  # (filepath, text) last written to disk
         self.filepath = self.default_yaml_path()
 
     def default_yaml_path(self):
@@ -55,17 +253,20 @@ class _YamlDictLike:
         pass
 
     def __setitem__(self, key, val):
-        res = super().__setitem__(key, val)
+        with flush_engine.lock:
+            res = super().__setitem__(key, val)
         self.flush()
         return res
 
     def __delitem__(self, key):
-        res = super().__delitem__(key)
+        with flush_engine.lock:
+            res = super().__delitem__(key)
         self.flush()
         return res
 
     def clear(self):
-        res = super().clear()
+        with flush_engine.lock:
+            res = super().clear()
         self.flush()
         return res
 
@@ -73,42 +274,69 @@ class _YamlDictLike:
         raise NotImplementedError
 
     def pop(self, key):
-        res = super().pop(key)
+        with flush_engine.lock:
+            res = super().pop(key)
         self.flush()
         return res
 
     def popitem(self):
-        res = super().popitem()
+        with flush_engine.lock:
+            res = super().popitem()
         self.flush()
         return res
 
     def update(self, *args, **kwargs):
-        res = super().update(*args, **kwargs)
+        with flush_engine.lock:
+            res = super().update(*args, **kwargs)
         self.flush()
         return res
 
     def setdefault(self, key, val):
-        res = super().setdefault(key, val)
+        with flush_engine.lock:
+            res = super().setdefault(key, val)
         self.flush()
         return res
 
+    def deferred_flush(self):
+        """
+        Context manager holding back writes until the block exits
+
+        Every object changed inside the block, including the ones
+        referencing this object, is written to disk once on exit.
+
+        Examples
+        --------
+        >>> with bt.deferred_flush():
+        ...     bt['bt_wavelength'] = 0.1828
+        ...     bt['new_field'] = 'test'
+        """
+        return flush_engine.deferred()
+
     def flush(self):
         """
         Ensure any mutable values are updated on disk.
         """
-        with open(self.filepath, "w") as f:
-            self.to_yaml(f)
-        for ref in self._referenced_by:
-            ref.flush()
+        flush_engine.mark_dirty(self)
+
+    def _snapshot(self):
+        """(filepath, text) to be written, None if the file is current"""
+        fpath = getattr(self, "_filepath", None)
+        if fpath is None:
+            return None
+        snapshot = (fpath, self.to_yaml())
+        last_dump = getattr(self, "_last_dump", None)
+        if snapshot == last_dump and os.path.isfile(fpath):
+            return None
+        return snapshot
 
 
 class YamlDict(_YamlDictLike, dict):
     def to_yaml(self, f=None):
-        return yaml.dump(dict(self), f, default_flow_style=False)
+        return yaml_dump(dict(self), f, default_flow_style=False)
 
     @classmethod
     def from_yaml(cls, f):
-        d = yaml.unsafe_load(f)
+        d = yaml_load(f)
         # If file is empty, make it an empty dict.
         if d is None:
             d = {}
@@ -124,13 +352,13 @@ class YamlDict(_YamlDictLike, dict):
 
 class YamlChainMap(_YamlDictLike, ChainMap):
     def to_yaml(self, f=None):
-        return yaml.dump(
+        return yaml_dump(
             list(map(dict, self.maps)), f, default_flow_style=False
         )
 
     @classmethod
     def from_yaml(cls, f):
-        maps = yaml.unsafe_load(f)
+        maps = yaml_load(f)
         # If file is empty, make it an empty list.
         if maps is None:
             maps = []
@@ -0,0 +1,219 @@
+##############################################################################
+#
+# xpdacq            by Billinge Group
+#                   Simon J. L. Billinge sb2896@columbia.edu
+#                   (c) 2016 trustees of Columbia University in the City of
+#                        New York.
+#                   All rights reserved
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE.txt for license information.
+#
+##############################################################################
+import os
+import json
+import sqlite3
+
+from .serialization import yaml_load
+
+INDEX_FNAME = ".yaml_index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS yaml_records (
+    path TEXT PRIMARY KEY,
+    kind TEXT,
+    uid TEXT,
+    name TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    inode INTEGER,
+    text TEXT,
+    json TEXT
+)
+"""
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _to_json(data):
+    """json text of ``data``, None if json can't give it back as is"""
+    try:
+        text = json.dumps(data)
+    except (TypeError, ValueError):
+        return None
+    return text if json.loads(text) == data else None
+
+
+def _describe(data):
+    """(kind, uid, name) of the parsed content of a beamtime yaml file"""
+    if isinstance(data, dict) and "bt_uid" in data:
+        return "beamtime", data["bt_uid"], data.get("bt_piLast")
+    if isinstance(data, list) and data and isinstance(data[0], dict):
+        if "sa_uid" in data[0]:
+            return "sample", data[0]["sa_uid"], data[0].get("sample_name")
+        if "sp_uid" in data[0]:
+            return "scanplan", data[0]["sp_uid"], None
+    return None, None, None
+
+
+class YamlIndex:
+    """
+    sqlite cache of parsed beamtime yaml files
+
+    Each record keeps the text and the parsed content of a yaml file
+    together with its modification time, size and inode. A record is
+    used only while these three match the file on disk, so the yaml
+    files stay the source of truth: editing, replacing or rewriting a
+    file simply makes the next lookup parse it again.
+
+    The parsed content is stored as json, which can't build arbitrary
+    objects. Content that doesn't survive a json round trip as is,
+    e.g. dates or tuples, is parsed again from the text recorded, with
+    the safe yaml loader.
+
+    Parameters
+    ----------
+    directory : str
+        directory of the index file, normally glbl['yaml_dir'].
+
+    Records are committed when the outermost ``with`` block exits. If the
+    database can't be used, e.g. because of file locking on NFS, the
+    index disables itself and files are parsed directly.
+
+    Examples
+    --------
+    >>> index = YamlIndex(glbl['yaml_dir'])
+    >>> with index:
+    ...     text, data = index.read(fpath)
+    """
+
+    def __init__(self, directory):
+        self.filepath = os.path.join(directory, INDEX_FNAME)
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._depth = 0
+        self.disabled = False
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath)
+            self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def _disable(self, err):
+        print(
+            "WARNING: yaml index {} is not available ({}), reading yaml "
+            "files directly".format(self.filepath, err)
+        )
+        self.disabled = True
+        self._conn = None
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if not self._depth:
+            self.close()
+
+    def close(self):
+        """commit pending records and close the database"""
+        if self._conn is not None:
+            try:
+                self._conn.commit()
+                self._conn.close()
+            except sqlite3.Error as e:
+                self._disable(e)
+            self._conn = None
+
+    def get(self, path):
+        """text and parsed data of an up-to-date record, None otherwise"""
+        row = (
+            self._connect()
+            .execute(
+                "SELECT mtime_ns, size, inode, text, json FROM yaml_records "
+                "WHERE path = ?",
+                (os.path.abspath(path),),
+            )
+            .fetchone()
+        )
+        if row is None or tuple(row[:3]) != _stat_key(path):
+            return None
+        text, data = row[3], row[4]
+        if data is None:
+            return text, yaml_load(text)
+        return text, json.loads(data)
+
+    def put(self, path, text, data, stat_key=None):
+        """record the text and parsed data of a yaml file
+
+        ``stat_key`` is the (mtime_ns, size, inode) of the file when it
+        was read, taken again from the file if not given.
+        """
+        if stat_key is None:
+            stat_key = _stat_key(path)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO yaml_records "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(path),)
+            + _describe(data)
+            + tuple(stat_key)
+            + (text, _to_json(data)),
+        )
+
+    def read(self, path):
+        """text and parsed data of a yaml file, through the index
+
+        Returns
+        -------
+        text : str
+            contents of the file
+        data : object
+            parsed contents of the file. A new object on every call.
+        """
+        if not self.disabled:
+            try:
+                record = self.get(path)
+            except sqlite3.Error as e:
+                self._disable(e)
+            else:
+                if record is not None:
+                    self.hits += 1
+                    return record
+        self.misses += 1
+        stat_key = _stat_key(path)
+        with open(path, "r") as f:
+            text = f.read()
+        data = yaml_load(text)
+        if not self.disabled:
+            try:
+                self.put(path, text, data, stat_key)
+            except sqlite3.Error as e:
+                self._disable(e)
+        return text, data
+
+    def records(self, kind=None):
+        """(path, kind, uid, name) of the indexed files"""
+        query = "SELECT path, kind, uid, name FROM yaml_records"
+        args = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            args = (kind,)
+        query += " ORDER BY path"
+        return self._connect().execute(query, args).fetchall()
+
+    def prune(self):
+        """drop the records of files that don't exist anymore"""
+        conn = self._connect()
+        gone = [
+            (path,)
+            for (path,) in conn.execute("SELECT path FROM yaml_records")
+            if not os.path.isfile(path)
+        ]
+        conn.executemany("DELETE FROM yaml_records WHERE path = ?", gone)
+        return len(gone)
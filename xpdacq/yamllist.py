@@ -11,7 +11,9 @@ from __future__ import (
     print_function,
     unicode_literals,
 )
-import yaml
+
+from .yamldict import _atomic_write
+from .serialization import yaml_load, yaml_dump
 
 
 class YamlList(list):
@@ -26,7 +28,7 @@ class YamlList(list):
     def __init__(self, fname):
         self.fname = fname
         with open(fname, "r") as f:
-            lst = yaml.unsafe_load(f)
+            lst = yaml_load(f)
         # If file is empty, make it an empty list.
         if lst is None:
             lst = []
@@ -82,5 +84,4 @@ class YamlList(list):
         """
         Ensure any mutable values are updated on disk.
         """
-        with open(self.fname, "w") as f:
-            yaml.dump(list(self), f)
+        _atomic_write(self.fname, yaml_dump(list(self)))